@@ -0,0 +1,79 @@
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from analytics import Analytics, format_report
+from ledger import Ledger
+from storage import JsonStorage
+
+# Время отчёта /stats: полный проход по всем пользователям, повтор без изменений (кэш)
+# и пересчёт после изменений у части пользователей. Данные синтетические, в памяти.
+# Запуск: python bench/analytics.py [--users 1000000] [--entries 6] [--changed 1000]
+
+NAMES = ["Яндекс Плюс", "Кинопоиск", "IVI", "Netflix", "netflix", "Spotify", "Метро", "Интернет", "Телефон",
+         "Спортзал", "iCloud", "YouTube Premium", "Okko", "Аренда"]
+
+
+def fill(storage: JsonStorage, users: int, entries: int, seed: int):
+    rng = random.Random(seed)
+    for uid in range(users):
+        ledger = Ledger()
+        for _ in range(rng.randint(0, entries * 2)):
+            if rng.random() < 0.25:
+                ledger.add("incomes", "Зарплата", float(rng.randint(10000, 200000)))
+            else:
+                name = rng.choice(NAMES) if rng.random() < 0.9 else f"Сервис {rng.randint(1, 10 ** 5)}"
+                ledger.add("subscriptions", name, float(rng.randint(50, 5000)), rng.random() < 0.15)
+        storage.data[str(uid)] = ledger
+
+
+def timed(title: str, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{title}: {time.perf_counter() - start:.2f} с")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--entries', type=int, default=6, help="в среднем записей у пользователя")
+    parser.add_argument('--changed', type=int, default=1000, help="пользователей меняется между отчётами")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--show', action='store_true', help="напечатать отчёт")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="moneysaver-analytics-") as tmp:
+        storage = JsonStorage(Path(tmp) / "data.json", compact_min_bytes=10 ** 18)
+        storage.load()
+        timed(f"данные: {args.users} пользователей", lambda: fill(storage, args.users, args.entries, args.seed))
+        analytics = Analytics([storage])
+        report = timed("первый отчёт (все пользователи)", analytics.report)
+        timed("повтор без изменений", analytics.report)
+        rng = random.Random(args.seed + 1)
+        for _ in range(args.changed):
+            uid = str(rng.randrange(args.users))
+            storage.add(uid, "subscriptions", rng.choice(NAMES), 100.0)
+            ledger = storage.user(uid)
+            if ledger.subscriptions:
+                storage.delete(uid, "subscriptions", ledger.subscriptions.ids[0])
+        updated = timed(f"после изменений у {args.changed} пользователей", analytics.report)
+        fresh = timed("отчёт заново с нуля для сравнения", lambda: Analytics([storage]).report())
+        if args.show:
+            print(format_report(updated))
+        print(f"записей: {sum(report['entries'].values())}, пользователей с данными: {report['users']}")
+        storage.data = {}  # снимок на 1М пользователей при закрытии не нужен
+        storage.close()
+    # Суммы складываются в другом порядке — сравниваем текст с округлением до рубля
+    if format_report(updated) != format_report(fresh):
+        print("FAIL пересчёт по изменениям разошёлся с отчётом с нуля")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
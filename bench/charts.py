@@ -0,0 +1,53 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from charts import RENDERERS, render_chart
+
+# Сравнение режимов отрисовки графиков: время и размер PNG.
+# Запуск: python bench/charts.py [--repeat 5] [--width 1200] [--json results.json]
+
+
+def make_entries(prefix: str, count: int) -> list:
+    return [(f"{prefix} {i + 1}", round(100 + 37.5 * i, 2)) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--modes', default=','.join(RENDERERS))
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    results = []
+    for entries in (0, 3, 10, 30):
+        subs = make_entries("Подписка", entries)
+        incs = make_entries("Доход", max(entries // 3, 1))
+        exp_total = round(sum(a for _, a in subs), 2)
+        inc_total = round(sum(a for _, a in incs), 2)
+        for mode in args.modes.split(','):
+            render_chart(mode, args.width, subs, incs, exp_total, inc_total)  # прогрев импортов и шрифтов
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                png = render_chart(mode, args.width, subs, incs, exp_total, inc_total)
+                times.append((time.perf_counter() - start) * 1000)
+            results.append({"mode": mode, "entries": entries, "median_ms": round(statistics.median(times), 1),
+                            "png_bytes": len(png)})
+
+    print(f"{'режим':<8} {'записей':>8} {'мс (медиана)':>14} {'PNG, КБ':>10}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['entries']:>8} {r['median_ms']:>14.1f} {r['png_bytes'] / 1024:>10.1f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"width": args.width, "repeat": args.repeat, "results": results}, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
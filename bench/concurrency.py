@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+os.environ['BOT_TOKEN'] = '123456:BENCH'  # настоящий токен из token.env не нужен и не используется
+
+from telebot import apihelper
+from telebot.types import Update
+
+import main as bot_main
+from analytics import Analytics, format_report
+from lanes import Lanes
+from outbox import Outbox
+from routing import pack_callback
+from storage import JsonStorage
+from fake_api import FakeBotApi
+from load import message_update, callback_update
+
+# Стресс-проверка параллельных обработчиков: поток обновлений (добавления, удаления по кнопке,
+# пакетный импорт, баланс) идёт через полосы (lanes.py), как при polling. Параллельно строятся
+# снимки журнала и сводка /stats. В конце данные каждого пользователя сравниваются с моделью,
+# где его обновления применены строго по порядку, — и в памяти, и после перечитывания с диска.
+# Удаление записи, которая из-за перестановки ещё не добавлена, ничего не удалит, и сравнение упадёт.
+# id записей предсказуемы (по порядку у пользователя) только у JSON-хранилища, поэтому проверяется оно.
+# Запуск: python bench/concurrency.py [--workers 1,2,4,8] [--users 200] [--updates 5000]
+
+
+# Ожидаемые записи пользователя: [(id, название, сумма)] в порядке добавления
+class Model:
+    def __init__(self):
+        self.entries = {}
+        self.next_id = {}
+
+    def add(self, uid: int, name: str, amount: float):
+        entry_id = self.next_id.get(uid, 0)
+        self.next_id[uid] = entry_id + 1
+        self.entries.setdefault(uid, []).append((entry_id, name, amount))
+
+    def delete(self, uid: int, position: int):
+        return self.entries[uid].pop(position)[0]
+
+
+def make_updates(users: int, count: int, seed: int) -> tuple:
+    rng = random.Random(seed)
+    model = Model()
+    updates = []
+    for update_id in range(1, count + 1):
+        uid = rng.randint(1, users)
+        roll = rng.random()
+        alive = model.entries.get(uid)
+        if roll < 0.15 and alive:
+            entry_id = model.delete(uid, rng.randrange(len(alive)))
+            updates.append(callback_update(update_id, uid, pack_callback("d", "s", bot_main.short_id(entry_id), 0)))
+        elif roll < 0.25:
+            lines = []
+            for _ in range(rng.randint(2, 5)):
+                name, amount = f"Импорт {uid}-{update_id}-{len(lines)}", float(rng.randint(1, 999))
+                model.add(uid, name, amount)
+                lines.append(f"{name} {amount:.0f}")
+            updates.append(message_update(update_id, uid, "\n".join(lines)))
+        elif roll < 0.35:
+            updates.append(message_update(update_id, uid, "📊 Баланс"))
+        else:
+            name, amount = f"Запись {uid}-{update_id}", float(rng.randint(1, 999))
+            model.add(uid, name, amount)
+            updates.append(message_update(update_id, uid, f"{name} {amount:.0f}"))
+    return [Update.de_json(update) for update in updates], model
+
+
+def check(storage: JsonStorage, model: Model) -> list:
+    errors = []
+    for uid in sorted(model.next_id):
+        expected = model.entries.get(uid, [])
+        ledger = storage.user(str(uid))
+        actual = [(e.id, e.name, e.amount) for e in ledger.subscriptions]
+        if actual != expected:
+            errors.append(f"пользователь {uid}: ожидали {len(expected)} записей, есть {len(actual)}")
+        elif not ledger.check_totals():
+            errors.append(f"пользователь {uid}: итоги не сходятся с записями")
+    return errors
+
+
+# Фоном, пока идут обновления: сводка /stats по изменениям и снимки журнала
+def background(storage: JsonStorage, analytics: Analytics, stop: threading.Event, counters: dict):
+    while not stop.is_set():
+        analytics.report()
+        counters["reports"] += 1
+        storage.compact()
+        counters["snapshots"] += 1
+        stop.wait(0.01)
+
+
+def run(args, workers: int, updates: list, model: Model) -> dict:
+    with tempfile.TemporaryDirectory(prefix="moneysaver-concurrency-") as tmp:
+        path = Path(tmp) / "data.json"
+        bot_main.storage = JsonStorage(path, compact_min_bytes=args.compact_min_bytes)
+        bot_main.storage.load()
+        bot_main.outbox = Outbox(bot_main.bot, 1e9, 1e9, 1e9, bot_main.OUTBOX_COALESCE_MS, bot_main.OUTBOX_WORKERS)
+        analytics = Analytics([bot_main.storage])
+        counters = {"reports": 0, "snapshots": 0}
+        stop = threading.Event()
+        side = threading.Thread(target=background, args=(bot_main.storage, analytics, stop, counters))
+        side.start()
+
+        bot_main.lanes = Lanes(workers, bot_main.LANE_QUEUE)
+        start = time.perf_counter()
+        # Один поток раскладывает обновления, как polling или вебхук
+        for update in updates:
+            bot_main.bot.process_new_updates([update])
+        bot_main.lanes.close()
+        duration = time.perf_counter() - start
+        bot_main.lanes = None
+        stop.set()
+        side.join()
+        bot_main.storage.sync()  # подтверждения после записи на диск тоже идут через outbox
+        bot_main.outbox.close(timeout=600)
+
+        errors = check(bot_main.storage, model)
+        if format_report(analytics.report()) != format_report(Analytics([bot_main.storage]).report()):
+            errors.append("сводка по изменениям разошлась со сводкой с нуля")
+        bot_main.storage.close()
+        reopened = JsonStorage(path)
+        reopened.load()
+        errors += [f"после перезапуска: {error}" for error in check(reopened, model)]
+        reopened.close()
+    return {"workers": workers, "duration_s": duration, "ups": len(updates) / duration, "errors": errors, **counters}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default="1,2,4,8", help="числа потоков через запятую")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--compact-min-bytes', type=int, default=16384, help="снимок, когда журнал дорос до N байт (и до размера снимка)")
+    parser.add_argument('--api-latency-ms', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotApi(latency_ms=args.api_latency_ms).start()
+    apihelper.API_URL = api.api_url
+    bot_main.bot.threaded = False
+    updates, model = make_updates(args.users, args.updates, args.seed)
+    failed = False
+    for workers in map(int, args.workers.split(',')):
+        result = run(args, workers, updates, model)
+        status = "OK  " if not result["errors"] else "FAIL"
+        print(f"{status} потоков {workers:3d}: {result['ups']:8.1f} обн./с, {result['duration_s']:.2f} с "
+              f"(сводок {result['reports']}, снимков {result['snapshots']})")
+        for error in result["errors"][:10]:
+            print(f"     {error}")
+        failed = failed or bool(result["errors"])
+    api.stop()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
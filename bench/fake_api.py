@@ -0,0 +1,179 @@
+import json
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+# Локальная подделка Bot API для бенчмарков: отвечает на методы, которые зовёт бот,
+# и считает запросы. Подключение: apihelper.API_URL = server.api_url
+# С flood=(в секунду на всех, в секунду на чат, подряд в чат) отвечает 429, как Telegram при превышении лимитов
+
+SENDING_METHODS = {"sendMessage", "sendPhoto", "editMessageText"}
+
+
+class _Bucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0, flood: tuple = None):
+        self.latency = latency_ms / 1000
+        self.flood = flood
+        self._global_bucket = _Bucket(flood[0], flood[0]) if flood else None
+        self._chat_buckets = {}
+        self.updates = []  # отдаются через getUpdates, update_id по порядку с 1
+        self.delivered = 0  # update_id последнего отданного обновления
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def push_updates(self, updates: list):
+        with self._lock:
+            for update in updates:
+                self.updates.append({**update, "update_id": len(self.updates) + 1})
+
+    def _get_updates(self, params: dict) -> list:
+        offset = max(int(params.get("offset") or 1), 1)
+        limit = int(params.get("limit") or 100)
+        with self._lock:
+            batch = self.updates[offset - 1:offset - 1 + limit]
+            if batch:
+                self.delivered = max(self.delivered, batch[-1]["update_id"])
+        if not batch:
+            time.sleep(0.05)  # вместо долгого опроса
+        return batch
+
+    def _next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = int(params.get("chat_id", 0) or 0)
+        message = {
+            "message_id": self._next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+        }
+        message.update(extra)
+        return message
+
+    # True — запрос укладывается в лимиты
+    def _within_limits(self, method: str, params: dict) -> bool:
+        if not self.flood or method not in SENDING_METHODS:
+            return True
+        with self._lock:
+            chat = params.get("chat_id")
+            bucket = self._chat_buckets.get(chat)
+            if bucket is None:
+                bucket = self._chat_buckets[chat] = _Bucket(self.flood[1], self.flood[2])
+            return bucket.take() and self._global_bucket.take()
+
+    def handle(self, method: str, params: dict):
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method == "sendPhoto":
+            file_id = params.get("photo") or f"photo-{self._next_message_id()}"
+            photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+            return self._message(params, photo=photo, caption=params.get("caption", ""))
+        if method in ("answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            return True
+        if method == "getUpdates":
+            return self._get_updates(params)
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+            disable_nagle_algorithm = True  # иначе заголовки и тело ответа ждут ACK ~40 мс
+
+            def do_GET(self):
+                self._serve()
+
+            def do_POST(self):
+                self._serve()
+
+            def _serve(self):
+                path, _, query = self.path.partition("?")
+                method = path.rsplit("/", 1)[-1]
+                params = dict(parse_qsl(query))
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if body and content_type.startswith("application/x-www-form-urlencoded"):
+                    params.update(parse_qsl(body.decode("utf-8")))
+                elif body and content_type.startswith("application/json"):
+                    params.update(json.loads(body))
+                elif body and content_type.startswith("multipart/form-data"):
+                    params.update(_parse_multipart_fields(body, content_type))
+                if api._within_limits(method, params):
+                    code, body = 200, {"ok": True, "result": api.handle(method, params)}
+                else:
+                    with api._lock:
+                        api.calls["429"] += 1
+                    code, body = 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                       "parameters": {"retry_after": 1}}
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# Из multipart берём только текстовые поля (chat_id, caption); сами файлы не нужны
+def _parse_multipart_fields(body: bytes, content_type: str) -> dict:
+    boundary = content_type.split("boundary=", 1)[-1].strip('"').encode()
+    fields = {}
+    for part in body.split(b"--" + boundary):
+        head, _, value = part.partition(b"\r\n\r\n")
+        if b'name="' not in head or b"filename=" in head:
+            continue
+        name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+        fields[name] = value.rstrip(b"\r\n").decode("utf-8", "replace")
+    return fields
@@ -0,0 +1,404 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+os.environ['BOT_TOKEN'] = '123456:BENCH'  # настоящий токен из token.env не нужен и не используется
+
+from telebot import apihelper
+from telebot.types import Update
+
+import main as bot_main
+from charts import ChartCache, ChartPool
+from storage import JsonStorage, SqliteStorage
+from routing import pack_callback
+from outbox import Outbox
+from fake_api import FakeBotApi
+
+# Нагрузочный прогон настоящих обработчиков из src/main.py против локального фейкового Bot API.
+# Задержка обновления — до готового ответа: обработчик только ставит работу в очередь, поэтому ждём
+# подтверждения после записи на диск (after_sync), отрисовки графика и запросов outbox к API.
+# Запуск: python bench/load.py [--users 10000] [--updates 20000] [--json results.json]
+#         [--baseline old.json --max-regression 0.2] — при ухудшении код выхода 1
+
+DEFAULT_MIX = "add=45,balance=20,list=15,delete=10,page=5,chart=5"
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)]
+
+
+def parse_mix(text: str) -> tuple:
+    ops, weights = [], []
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if name not in OPS:
+            raise SystemExit(f"Неизвестная операция в --mix: {name}")
+        ops.append(name)
+        weights.append(float(weight))
+    return ops, weights
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+
+
+def message_update(update_id: int, uid: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": uid, "type": "private"},
+        "from": _user(uid), "text": text}}
+
+
+def callback_update(update_id: int, uid: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(uid), "chat_instance": str(uid), "data": data,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": uid, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bench"}, "text": "список"}}}
+
+
+# Генераторы обновлений: (update_id, uid, rng) -> dict.
+# Для удаления id записи берём из хранилища — это вне замера
+def op_add(update_id, uid, rng):
+    if rng.random() < 0.3:
+        return message_update(update_id, uid, f"+ Доход {rng.randint(1, 50)} {rng.randint(1000, 90000)}")
+    return message_update(update_id, uid, f"Подписка {rng.randint(1, 50)} {rng.randint(99, 2000)}")
+
+
+def op_balance(update_id, uid, rng):
+    return message_update(update_id, uid, "📊 Баланс")
+
+
+def op_list(update_id, uid, rng):
+    return message_update(update_id, uid, rng.choice(("📋 Подписки", "📋 Доходы")))
+
+
+def op_page(update_id, uid, rng):
+    return callback_update(update_id, uid, pack_callback("p", rng.choice("si"), rng.randint(0, 2)))
+
+
+def op_delete(update_id, uid, rng):
+    subs = bot_main.storage.user(str(uid)).subscriptions
+    entry_id = rng.choice(subs.ids) if subs else 10 ** 6
+    return callback_update(update_id, uid, pack_callback("d", "s", bot_main.short_id(entry_id), 0))
+
+
+def op_chart(update_id, uid, rng):
+    return message_update(update_id, uid, "📈 Графики доходов и трат")
+
+
+OPS = {"add": op_add, "balance": op_balance, "list": op_list, "page": op_page,
+       "delete": op_delete, "chart": op_chart}
+
+
+def open_bench_storage(kind: str, directory: Path):
+    if kind == 'json':
+        return JsonStorage(directory / 'data.json')
+    return SqliteStorage(directory / 'data.db')
+
+
+def prefill(storage, users: int, entries: int, rng):
+    for uid in range(1, users + 1):
+        items = [("subscriptions", f"Подписка {i}", float(rng.randint(99, 2000))) for i in range(entries)]
+        items.append(("incomes", "Зарплата", float(rng.randint(30000, 150000))))
+        storage.add_many(str(uid), items)
+    storage.sync()
+
+
+def storage_bytes(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.iterdir() if path.is_file())
+
+
+class _Pending:
+    __slots__ = ("count", "end", "done", "lock")
+
+    def __init__(self):
+        self.count = 1  # сам обработчик
+        self.end = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+
+# Незавершённая работа обновления: обработчик, отложенные колбэки (after_sync, готовность Future)
+# и Future запросов outbox и пула графиков. Колбэк выполняется «от имени» того обновления,
+# в обработчике которого его поставили, поэтому и его запросы к API засчитываются этому обновлению.
+# Обновление готово, когда счётчик дошёл до нуля: время — по последнему завершению
+class ReplyTracker:
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin(self) -> _Pending:
+        self._local.current = pending = _Pending()
+        return pending
+
+    def end(self, pending: _Pending):
+        self._local.current = None
+        self._release(pending)
+
+    def _hold(self):
+        pending = getattr(self._local, "current", None)
+        if pending is not None:
+            with pending.lock:
+                pending.count += 1
+        return pending
+
+    def _release(self, pending: _Pending):
+        with pending.lock:
+            pending.count -= 1
+            if pending.count == 0:
+                pending.end = time.perf_counter()
+                pending.done.set()
+
+    def callback(self, function):
+        pending = self._hold()
+        if pending is None:
+            return function
+
+        def run(*args):
+            previous = getattr(self._local, "current", None)
+            self._local.current = pending
+            try:
+                return function(*args)
+            finally:
+                self._local.current = previous
+                self._release(pending)
+        return run
+
+    def future(self, future):
+        if future is None:
+            return None
+        pending = self._hold()
+        if pending is None:
+            return future
+        future.add_done_callback(lambda _: self._release(pending))
+        return _TrackedFuture(future, self)
+
+    def wrap(self, function):
+        return lambda *args, **kwargs: self.future(function(*args, **kwargs))
+
+    # Подменяем точки, где обработчики откладывают работу
+    def install(self):
+        for name in ("send_message", "edit_message_text", "call", "call_now"):
+            setattr(bot_main.outbox, name, self.wrap(getattr(bot_main.outbox, name)))
+        for name in ("submit", "submit_history"):
+            setattr(bot_main.chart_pool, name, self.wrap(getattr(bot_main.chart_pool, name)))
+        bot_main.in_background = self.wrap(bot_main.in_background)
+        after_sync = bot_main.storage.after_sync
+        bot_main.storage.after_sync = lambda callback: after_sync(self.callback(callback))
+
+
+class _TrackedFuture:
+    def __init__(self, future, tracker: ReplyTracker):
+        self._future = future
+        self._tracker = tracker
+
+    def add_done_callback(self, function):
+        self._future.add_done_callback(self._tracker.callback(function))
+
+    def __getattr__(self, name):
+        return getattr(self._future, name)
+
+
+class Runner:
+    def __init__(self, args):
+        self.args = args
+        self.ops, self.weights = parse_mix(args.mix)
+        self.latencies = {op: [] for op in self.ops}
+        self.memory = {op: [] for op in self.ops}
+        self.errors = {op: 0 for op in self.ops}
+        self.tracker = ReplyTracker()
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def _take(self):
+        with self._lock:
+            if self._next >= self.args.updates:
+                return None
+            self._next += 1
+            return self._next
+
+    def _work(self, seed: int):
+        rng = random.Random(seed)
+        trace = self.args.trace_memory
+        while True:
+            update_id = self._take()
+            if update_id is None:
+                return
+            op = rng.choices(self.ops, self.weights)[0]
+            uid = rng.randint(1, self.args.users)
+            update = Update.de_json(OPS[op](update_id, uid, rng))
+            before = tracemalloc.get_traced_memory()[0] if trace else 0
+            failed = False
+            pending = self.tracker.begin()
+            start = time.perf_counter()
+            try:
+                bot_main.bot.process_new_updates([update])
+            except Exception:
+                failed = True
+            finally:
+                self.tracker.end(pending)
+            memory = tracemalloc.get_traced_memory()[0] - before if trace else 0
+            if not pending.done.wait(self.args.reply_timeout):
+                failed = True
+                elapsed = self.args.reply_timeout * 1000
+            else:
+                elapsed = (pending.end - start) * 1000
+            with self._lock:
+                self.errors[op] += failed
+                self.latencies[op].append(elapsed)
+                if trace:
+                    self.memory[op].append(memory)
+
+    def run(self) -> float:
+        threads = [threading.Thread(target=self._work, args=(self.args.seed + i,), name=f"load-{i}")
+                   for i in range(self.args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def handler_stats(self) -> dict:
+        stats = {}
+        for op in self.ops:
+            values = sorted(self.latencies[op])
+            if not values:
+                continue
+            stats[op] = {
+                "count": len(values),
+                "errors": self.errors[op],
+                "p50_ms": round(percentile(values, 0.50), 3),
+                "p99_ms": round(percentile(values, 0.99), 3),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "max_ms": round(values[-1], 3),
+            }
+            if self.memory[op]:
+                stats[op]["mem_kb"] = round(sum(self.memory[op]) / len(self.memory[op]) / 1024, 2)
+        return stats
+
+
+# Сравнение с прошлым прогоном: задержки растут или пропускная способность падает больше чем на threshold
+def compare(result: dict, baseline: dict, threshold: float, noise_ms: float) -> list:
+    problems = []
+    for op, current in result["handlers"].items():
+        old = baseline.get("handlers", {}).get(op)
+        if not old:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if current[metric] > old[metric] * (1 + threshold) and current[metric] - old[metric] > noise_ms:
+                problems.append(f"{op}.{metric}: {old[metric]:.2f} -> {current[metric]:.2f} мс")
+    old_ups = baseline.get("throughput_ups")
+    if old_ups and result["throughput_ups"] < old_ups * (1 - threshold):
+        problems.append(f"throughput: {old_ups:.0f} -> {result['throughput_ups']:.0f} обн./с")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8,
+                        help="параллельных клиентов: каждый шлёт следующее обновление, дождавшись ответа")
+    parser.add_argument('--reply-timeout', type=float, default=60, help="сколько секунд ждать ответа на обновление")
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--prefill', type=int, default=3, help="подписок у каждого пользователя до начала")
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--chart-workers', type=int, default=2)
+    parser.add_argument('--chart-mode', default='raster')
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="искусственная задержка фейкового API")
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="лимиты отправки как в Telegram (OUTBOX_*), фейковый API отвечает 429 сверх них; "
+                             "без флага очередь отправки не ограничена")
+    parser.add_argument('--trace-memory', action='store_true', help="память на обновление через tracemalloc (медленнее)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--noise-ms', type=float, default=1.0, help="меньшие изменения задержки не считаем регрессией")
+    args = parser.parse_args()
+
+    limits = (bot_main.OUTBOX_GLOBAL_RATE, bot_main.OUTBOX_CHAT_RATE, bot_main.OUTBOX_CHAT_BURST)
+    api = FakeBotApi(latency_ms=args.api_latency_ms, flood=limits if args.telegram_limits else None).start()
+    apihelper.API_URL = api.api_url
+    bot_main.bot.threaded = False  # обработчик выполняется в потоке замера
+
+    with tempfile.TemporaryDirectory(prefix="moneysaver-bench-") as tmp:
+        directory = Path(tmp)
+        bot_main.storage = open_bench_storage(args.storage, directory)
+        bot_main.chart_cache = ChartCache(bot_main.CHART_CACHE_BYTES)
+        bot_main.chart_pool = ChartPool(args.chart_workers, None, args.chart_mode)
+        if not args.telegram_limits:
+            bot_main.outbox = Outbox(bot_main.bot, 1e9, 1e9, 1e9, bot_main.OUTBOX_COALESCE_MS,
+                                     bot_main.OUTBOX_WORKERS)
+        bot_main.storage.load()
+        bot_main.chart_pool.warm_up()
+
+        start = time.perf_counter()
+        prefill(bot_main.storage, args.users, args.prefill, random.Random(args.seed))
+        prefill_s = time.perf_counter() - start
+        print(f"Заполнено {args.users} пользователей за {prefill_s:.1f} с")
+
+        if args.trace_memory:
+            tracemalloc.start()
+        runner = Runner(args)
+        runner.tracker.install()
+        duration = runner.run()
+        if args.trace_memory:
+            tracemalloc.stop()
+        # Ответы уже дождались в замере; остаётся то, что не относится к обновлениям.
+        # Сначала запись на диск: подтверждения после неё (after_sync) тоже идут через outbox
+        start = time.perf_counter()
+        bot_main.storage.sync()
+        bot_main.outbox.close(timeout=600)
+        drain_s = time.perf_counter() - start
+
+        result = {
+            "config": {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+            "prefill_s": round(prefill_s, 2),
+            "duration_s": round(duration, 3),
+            "throughput_ups": round(args.updates / duration, 1),
+            "outbox_drain_s": round(drain_s, 3),
+            "outbox": {name: getattr(bot_main.outbox, name)
+                       for name in ("sent", "merged", "superseded", "retries", "failed")},
+            "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "storage_bytes": storage_bytes(directory),
+            "api_calls": dict(api.calls),
+            "chart_cache": {"hits": bot_main.chart_cache.hits, "misses": bot_main.chart_cache.misses},
+            "handlers": runner.handler_stats(),
+        }
+        bot_main.chart_pool.close()
+        bot_main.storage.close()
+    api.stop()
+
+    print(f"{'операция':<10} {'кол-во':>8} {'ошибок':>7} {'p50, мс':>9} {'p99, мс':>9} {'макс, мс':>9}")
+    for op, s in result["handlers"].items():
+        print(f"{op:<10} {s['count']:>8} {s['errors']:>7} {s['p50_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.1f}")
+    print(f"\n{result['throughput_ups']:.0f} обн./с, пик RSS {result['rss_peak_mb']:.0f} МБ, "
+          f"данные {result['storage_bytes'] / 1024:.0f} КБ")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(result, json.load(f), args.max_regression, args.noise_ms)
+        if problems:
+            print("\nРегрессия относительно", args.baseline)
+            for problem in problems:
+                print(" ", problem)
+            sys.exit(1)
+        print("\nРегрессий относительно", args.baseline, "нет")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import gc
+import sys
+import json
+import random
+import argparse
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from ledger import KINDS, Ledger
+
+# Память на пользователя и на запись: словари из data.json (как данные лежали в памяти раньше,
+# вместе с индексом id -> запись) против Ledger. Без сети и без бота.
+# Запуск: python bench/memory.py [--users 20000] [--entries 10] [--json results.json]
+
+NAMES = ["Яндекс Плюс", "Кинопоиск", "IVI", "Netflix", "Spotify", "Метро", "Интернет", "Телефон",
+         "Зарплата", "Фриланс", "Аренда", "Спортзал", "iCloud", "YouTube Premium", "Okko"]
+
+
+def make_users(users: int, entries: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    data = {}
+    for uid in range(users):
+        user = {kind: [] for kind in KINDS}
+        for entry_id in range(entries):
+            kind = "incomes" if rng.random() < 0.3 else "subscriptions"
+            # Как из json.load: у каждой записи своя копия строки названия
+            name = json.loads(json.dumps(rng.choice(NAMES) if rng.random() < 0.8 else f"Запись {rng.randint(1, 10 ** 6)}"))
+            user[kind].append({"name": name, "amount": float(rng.randint(100, 100000)) / 100, "id": entry_id})
+        user["next_id"] = entries
+        data[str(uid)] = user
+    return data
+
+
+def as_dicts(raw: dict) -> dict:
+    data = json.loads(json.dumps(raw))
+    for user in data.values():
+        user["totals"] = {"expenses": round(sum(e["amount"] for e in user["subscriptions"]), 2),
+                          "incomes": round(sum(e["amount"] for e in user["incomes"]), 2), "balance": 0.0}
+        user["_index"] = {entry["id"]: (kind, entry) for kind in KINDS for entry in user[kind]}
+    return data
+
+
+def as_ledgers(raw: dict) -> dict:
+    return {uid: Ledger.from_json(user) for uid, user in json.loads(json.dumps(raw)).items()}
+
+
+# Сколько байт остаётся занято после построения (промежуточный JSON уже освобождён)
+def measure(build, raw: dict) -> int:
+    gc.collect()
+    tracemalloc.start()
+    data = build(raw)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--entries', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="записать результат в файл")
+    args = parser.parse_args()
+
+    raw = make_users(args.users, args.entries, args.seed)
+    empty = {str(uid): {"subscriptions": [], "incomes": [], "next_id": 0} for uid in range(args.users)}
+    total_entries = args.users * args.entries
+    results = {}
+    for label, build in (("dicts", as_dicts), ("ledger", as_ledgers)):
+        base = measure(build, empty)  # пользователи без записей
+        full = measure(build, raw)
+        results[label] = {"bytes_per_user": round(base / args.users, 1),
+                          "bytes_per_entry": round((full - base) / total_entries, 1),
+                          "total_mb": round(full / 2 ** 20, 1)}
+        print(f"{label:7s} на пользователя {results[label]['bytes_per_user']:8.1f} Б, "
+              f"на запись {results[label]['bytes_per_entry']:8.1f} Б, всего {results[label]['total_mb']:.1f} МБ")
+    print(f"экономия: {results['dicts']['total_mb'] / results['ledger']['total_mb']:.1f}x")
+
+    ledgers = as_ledgers(raw)
+    if any(ledgers[uid].to_json() != as_ledger_json(raw[uid]) for uid in raw):
+        print("FAIL to_json(from_json(x)) != x")
+        sys.exit(1)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+# Ожидаемый JSON после круга from_json -> to_json: те же записи и next_id плюс итоги
+def as_ledger_json(user: dict) -> dict:
+    expected = {kind: user[kind] for kind in KINDS}
+    expenses = round(sum(e["amount"] for e in user["subscriptions"]), 2)
+    incomes = round(sum(e["amount"] for e in user["incomes"]), 2)
+    expected["totals"] = {"expenses": expenses, "incomes": incomes, "balance": round(incomes - expenses, 2)}
+    expected["next_id"] = user["next_id"]
+    return expected
+
+
+if __name__ == '__main__':
+    main()
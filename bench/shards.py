@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+os.environ['BOT_TOKEN'] = '123456:BENCH'
+
+from telebot import apihelper
+from telebot.types import Update
+
+import main as bot_main
+from outbox import Outbox
+from routing import pack_callback
+from sharding import HashRing, ShardDispatcher, rebalance
+from storage import KINDS
+from fake_api import FakeBotApi
+
+# Проверка режима шардов: один и тот же поток обновлений прогоняем через SHARDS процессов
+# (фронт получает обновления через getUpdates фейкового API) и через один процесс,
+# затем сравниваем данные всех пользователей. После этого меняем число шардов
+# и возвращаемся к одному data.json — данные не должны меняться.
+# Запуск: python bench/shards.py [--shards 4] [--users 200] [--updates 5000]
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+
+
+def _message(uid: int, text: str) -> dict:
+    return {"message": {"message_id": 1, "date": 0, "chat": {"id": uid, "type": "private"},
+                        "from": _user(uid), "text": text}}
+
+
+def _callback(uid: int, data: str) -> dict:
+    return {"callback_query": {"id": "1", "from": _user(uid), "chat_instance": str(uid), "data": data,
+                               "message": {"message_id": 1, "date": 0, "chat": {"id": uid, "type": "private"},
+                                           "text": "список"}}}
+
+
+# Поток обновлений. id записей предсказываем сами: у каждого пользователя счётчик next_id
+def make_updates(users: int, count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    next_id = {}
+    live = {}  # uid -> [(код списка, id)]
+    updates = []
+    for _ in range(count):
+        uid = rng.randint(1, users)
+        roll = rng.random()
+        if roll < 0.4:
+            lines = [f"{'+ ' if rng.random() < 0.3 else ''}Запись {rng.randint(1, 99)} {rng.randint(1, 5000)}"
+                     for _ in range(1 if rng.random() < 0.8 else rng.randint(2, 5))]
+            updates.append(_message(uid, "\n".join(lines)))
+            for line in lines:
+                live.setdefault(uid, []).append(("i" if line.startswith("+") else "s", next_id.get(uid, 0)))
+                next_id[uid] = next_id.get(uid, 0) + 1
+        elif roll < 0.6 and live.get(uid):
+            kind, entry_id = live[uid].pop(rng.randrange(len(live[uid])))
+            updates.append(_callback(uid, pack_callback("d", kind, bot_main.short_id(entry_id), 0)))
+        elif roll < 0.8:
+            updates.append(_message(uid, rng.choice(("📊 Баланс", "📋 Подписки", "📋 Доходы"))))
+        else:
+            updates.append(_callback(uid, pack_callback("p", rng.choice("si"), rng.randint(0, 1))))
+    return updates
+
+
+# Данные всех пользователей вместе с id записей: при переносе между шардами id сохраняются
+def snapshot(storages) -> dict:
+    state = {}
+    for storage in storages:
+        for user_id in storage.user_ids():
+            user = storage.user(user_id)
+            if not any(user.entries(kind) for kind in KINDS):
+                continue
+            if user_id in state:
+                raise AssertionError(f"Пользователь {user_id} сразу в нескольких шардах")
+            state[user_id] = {kind: list(zip(user.entries(kind).ids, user.entries(kind).items())) for kind in KINDS}
+            state[user_id]["next_id"] = user.next_id
+            state[user_id]["totals"] = user.totals
+    return state
+
+
+def read_layout_state(shards: int) -> dict:
+    storages = [bot_main.open_storage(bot_main.shard_path(shards, shard)) for shard in range(max(shards, 1))]
+    for storage in storages:
+        storage.load()
+    try:
+        if shards:
+            ring = HashRing(shards)
+            for shard, storage in enumerate(storages):
+                for user_id in storage.user_ids():
+                    if any(storage.user(user_id).entries(kind) for kind in KINDS) and ring.shard_for(user_id) != shard:
+                        raise AssertionError(f"Пользователь {user_id} лежит не в своём шарде {shard}")
+        return snapshot(storages)
+    finally:
+        for storage in storages:
+            storage.close()
+
+
+def run_sharded(api: FakeBotApi, updates: list, shards: int) -> float:
+    api.push_updates(updates)
+    dispatcher = ShardDispatcher(shards, bot_main.run_shard)
+    start = time.perf_counter()
+    dispatcher.start()
+    poller = threading.Thread(target=dispatcher.poll, args=(bot_main.bot, 1), daemon=True)
+    poller.start()
+    while api.delivered < len(api.updates):
+        time.sleep(0.05)
+    dispatcher.stop_polling()
+    poller.join()
+    dispatcher.stop()
+    return time.perf_counter() - start
+
+
+def run_single(updates: list) -> float:
+    storage = bot_main.open_storage(bot_main.shard_path(0, 0))
+    storage.load()
+    bot_main.storage = storage
+    bot_main.bot.threaded = False
+    start = time.perf_counter()
+    for i, raw in enumerate(updates, 1):
+        bot_main.bot.process_new_updates([Update.de_json({**raw, "update_id": i})])
+    storage.close()
+    bot_main.outbox.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotApi().start()
+    apihelper.API_URL = api.api_url
+    # Лимиты Telegram здесь не проверяем — отправка без ожидания
+    bot_main.OUTBOX_GLOBAL_RATE = bot_main.OUTBOX_CHAT_RATE = bot_main.OUTBOX_CHAT_BURST = 1e9
+    bot_main.outbox = Outbox(bot_main.bot, 1e9, 1e9, 1e9, bot_main.OUTBOX_COALESCE_MS)
+    updates = make_updates(args.users, args.updates, args.seed)
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="moneysaver-shards-") as tmp:
+        sharded_dir, single_dir = Path(tmp) / "sharded", Path(tmp) / "single"
+        # Шарды — первыми: процессы создаются, пока в этом процессе нет лишних потоков
+        bot_main.SHARDS, bot_main.SHARDS_PATH, bot_main.DATA_FILE = args.shards, sharded_dir, sharded_dir / "data.json"
+        meta = sharded_dir / "shards.json"
+        rebalance(meta, args.shards, bot_main.shard_path, bot_main.open_storage, bot_main.open_history)  # как main() при запуске
+        sharded_s = run_sharded(api, updates, args.shards)
+        sharded = read_layout_state(args.shards)
+
+        bot_main.SHARDS, bot_main.SHARDS_PATH, bot_main.DATA_FILE = 0, single_dir, single_dir / "data.json"
+        single_s = run_single(updates)
+        single = read_layout_state(0)
+
+        print(f"обновлений: {len(updates)}, пользователей с данными: {len(single)}")
+        print(f"один процесс: {single_s:.2f} с, шардов {args.shards}: {sharded_s:.2f} с")
+        failed |= check("шарды == один процесс", sharded, single)
+
+        bot_main.SHARDS_PATH, bot_main.DATA_FILE = sharded_dir, sharded_dir / "data.json"
+        for shards in (args.shards + 1, max(args.shards - 1, 1), 0):
+            moved = rebalance(meta, shards, bot_main.shard_path, bot_main.open_storage, bot_main.open_history)
+            failed |= check(f"после перехода на {shards} шардов (перенесено {moved})",
+                            read_layout_state(shards), single)
+    api.stop()
+    sys.exit(1 if failed else 0)
+
+
+def check(title: str, actual: dict, expected: dict) -> bool:
+    if actual == expected:
+        print(f"OK   {title}")
+        return False
+    differ = [user_id for user_id in set(actual) | set(expected) if actual.get(user_id) != expected.get(user_id)]
+    print(f"FAIL {title}: расходятся пользователи {sorted(differ)[:10]}")
+    return True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# Запуск из корня репозитория: python -m src
+sys.path.insert(0, str(Path(__file__).parent))
+
+from main import main
+
+main()
@@ -0,0 +1,301 @@
+import sys
+import json
+import argparse
+import threading
+import functools
+from array import array
+from pathlib import Path
+
+from ledger import KINDS
+
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+# Границы корзин гистограммы сумм в месяц, ₽
+AMOUNT_BINS = (0, 100, 300, 1000, 3000, 10000, 30000, 100000)
+
+
+# Коды названий: одинаковые с точностью до регистра и пробелов («Netflix», «netflix ») считаются вместе.
+# canon[код названия] -> код группы, labels[код группы] -> название в том виде, в каком встретилось первым
+class _Names(dict):
+    def __init__(self):
+        super().__init__()
+        self.canon = array("i")
+        self.labels = []
+        self._groups = {}
+
+    def __missing__(self, name: str) -> int:
+        code = self[name] = len(self.canon)
+        key = " ".join(name.casefold().split())
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = len(self.labels)
+            self.labels.append(name)
+        self.canon.append(group)
+        return code
+
+
+_KIND_CODES = (b"\x00", b"\x01")  # номер вида записи в KINDS
+
+
+# Строки (записи) одного пересчёта, пока копятся в array, потом уходят в numpy одним куском
+class _Rows:
+    def __init__(self):
+        self.kind = bytearray()  # 0 — подписка, 1 — доход
+        self.amount = array("d")
+        self.name = array("i")
+        self.yearly = bytearray()
+
+    # Запись из scan() может дописываться в другом потоке: берём общую длину колонок,
+    # иначе строки всех следующих пользователей съедут
+    def extend(self, ledger, names: _Names):
+        for code, kind in enumerate(KINDS):
+            entries = ledger.entries(kind)
+            count = min(len(entries.amounts), len(entries.names), len(entries.yearly))
+            if not count:
+                continue
+            self.kind.extend(_KIND_CODES[code] * count)
+            self.amount.extend(entries.amounts[:count])
+            self.name.extend(map(names.__getitem__, entries.names[:count]))
+            self.yearly.extend(entries.yearly[:count])
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+
+# Отчёт по всем пользователям: данные раскладываются по колонкам numpy (запись — строка),
+# агрегаты считаются векторно. Первый отчёт читает всё хранилище, дальше пересчитываются
+# только пользователи, изменившиеся с прошлого раза (storage.subscribe), готовый отчёт кэшируется.
+class Analytics:
+    def __init__(self, storages: list):
+        self.storages = storages
+        self._lock = threading.Lock()  # пересчёт и отчёт
+        self._dirty_lock = threading.Lock()  # отметки об изменениях из потоков обработчиков
+        self._dirty = {}  # user_id -> хранилище
+        self._built = False
+        self._reports = {}  # top -> отчёт, пока нет изменений
+        self._names = _Names()
+        self._slots = {}  # user_id -> номер пользователя в колонках ниже
+        for storage in storages:
+            storage.subscribe(functools.partial(self._mark, storage))
+
+    def _mark(self, storage, user_id: str):
+        with self._dirty_lock:
+            self._dirty[user_id] = storage
+            self._reports.clear()
+
+    def _build(self):
+        import numpy as np
+
+        rows = _Rows()
+        starts, stops, expenses, incomes = array("q"), array("q"), array("d"), array("d")
+        self._names = _Names()
+        self._slots = {}
+        with self._dirty_lock:
+            self._dirty.clear()
+        for storage in self.storages:
+            for user_id, ledger in storage.scan():
+                self._slots[user_id] = len(starts)
+                starts.append(len(rows))
+                rows.extend(ledger, self._names)
+                stops.append(len(rows))
+                expenses.append(ledger.expenses_total)
+                incomes.append(ledger.incomes_total)
+        self.kind = np.frombuffer(rows.kind, dtype=np.int8)
+        self.amount = np.frombuffer(rows.amount, dtype=np.float64)
+        self.name = np.frombuffer(rows.name, dtype=np.int32)
+        self.yearly = np.frombuffer(rows.yearly, dtype=np.bool_)
+        self.live = np.ones(len(rows), dtype=np.bool_)
+        self.start = np.frombuffer(starts, dtype=np.int64).copy()
+        self.stop = np.frombuffer(stops, dtype=np.int64).copy()
+        self.expenses = np.frombuffer(expenses, dtype=np.float64).copy()
+        self.incomes = np.frombuffer(incomes, dtype=np.float64).copy()
+        self._built = True
+
+    # Изменившиеся пользователи: старые строки гасим, новые дописываем в конец
+    def _update(self, dirty: dict):
+        import numpy as np
+
+        rows = _Rows()
+        offset = len(self.amount)
+        users = len(self.start)
+        new_users = [array("q"), array("q"), array("d"), array("d")]  # start, stop, расходы, доходы
+        for user_id, storage in dirty.items():
+            ledger = storage.user_snapshot(user_id)
+            start = offset + len(rows)
+            rows.extend(ledger, self._names)
+            stop = offset + len(rows)
+            slot = self._slots.get(user_id)
+            if slot is None:
+                self._slots[user_id] = users + len(new_users[0])
+                for column, value in zip(new_users, (start, stop, ledger.expenses_total, ledger.incomes_total)):
+                    column.append(value)
+                continue
+            self.live[self.start[slot]:self.stop[slot]] = False
+            self.start[slot], self.stop[slot] = start, stop
+            self.expenses[slot] = ledger.expenses_total
+            self.incomes[slot] = ledger.incomes_total
+        if new_users[0]:
+            self.start = np.concatenate([self.start, np.frombuffer(new_users[0], dtype=np.int64)])
+            self.stop = np.concatenate([self.stop, np.frombuffer(new_users[1], dtype=np.int64)])
+            self.expenses = np.concatenate([self.expenses, np.frombuffer(new_users[2], dtype=np.float64)])
+            self.incomes = np.concatenate([self.incomes, np.frombuffer(new_users[3], dtype=np.float64)])
+        if len(rows):
+            self.kind = np.concatenate([self.kind, np.frombuffer(rows.kind, dtype=np.int8)])
+            self.amount = np.concatenate([self.amount, np.frombuffer(rows.amount, dtype=np.float64)])
+            self.name = np.concatenate([self.name, np.frombuffer(rows.name, dtype=np.int32)])
+            self.yearly = np.concatenate([self.yearly, np.frombuffer(rows.yearly, dtype=np.bool_)])
+            self.live = np.concatenate([self.live, np.ones(len(rows), dtype=np.bool_)])
+        if self.live.size and np.count_nonzero(self.live) < self.live.size // 2:
+            self._compact()
+
+    # Погашенных строк больше половины — выбрасываем их и пересчитываем границы пользователей
+    def _compact(self):
+        import numpy as np
+
+        before = np.concatenate([[0], np.cumsum(self.live)])  # живых строк до позиции i
+        self.start = before[self.start]
+        self.stop = before[self.stop]
+        for column in ("kind", "amount", "name", "yearly"):
+            setattr(self, column, getattr(self, column)[self.live])
+        self.live = np.ones(len(self.amount), dtype=np.bool_)
+
+    def refresh(self):
+        with self._lock:
+            if not self._built:
+                self._build()
+                return
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, {}
+            if dirty:
+                self._update(dirty)
+
+    def report(self, top: int = 10) -> dict:
+        with self._dirty_lock:
+            cached = self._reports.get(top)
+        if cached is not None:
+            return cached
+        self.refresh()
+        with self._lock:
+            result = self._report(top)
+        with self._dirty_lock:
+            if not self._dirty:
+                self._reports[top] = result
+        return result
+
+    def _report(self, top: int) -> dict:
+        import numpy as np
+
+        live = self.live
+        subs = live & (self.kind == 0)
+        incs = live & (self.kind == 1)
+        # Текущие строки пользователя — [start, stop), все живые; погашенные ничьи
+        active = self.stop > self.start
+        balance = (self.incomes - self.expenses)[active]
+        with_subs = self.expenses[active & (self.expenses > 0)]
+
+        groups = np.frombuffer(self._names.canon, dtype=np.int32)[self.name[subs]] if self._names.canon else \
+            np.zeros(0, dtype=np.int32)
+        labels = self._names.labels
+        by_count = np.bincount(groups, minlength=len(labels))
+        by_spend = np.bincount(groups, weights=self.amount[subs], minlength=len(labels))
+
+        def top_of(values) -> list:
+            k = min(top, int(np.count_nonzero(values)))
+            if k == 0:
+                return []
+            # Равные значения — по названию: отчёт не зависит от порядка, в котором встретились названия
+            threshold = values[np.argpartition(-values, k - 1)[:k]].min()
+            best = sorted(np.flatnonzero(values >= threshold), key=lambda i: (-values[i], labels[i]))[:k]
+            return [{"name": labels[i], "count": int(by_count[i]), "spend": round(float(by_spend[i]), 2)}
+                    for i in best]
+
+        bins = np.array(AMOUNT_BINS + (np.inf,))
+        histogram = {}
+        for label, mask in (("monthly", subs & ~self.yearly), ("yearly", subs & self.yearly)):
+            histogram[label] = np.histogram(self.amount[mask], bins=bins)[0].tolist()
+
+        def percentiles(values) -> dict:
+            if not values.size:
+                return {}
+            return {str(p): round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+        return {
+            "users": int(active.sum()),
+            "users_seen": int(self.start.size),
+            "entries": {"subscriptions": int(subs.sum()), "incomes": int(incs.sum())},
+            "yearly": {"subscriptions": int((subs & self.yearly).sum()), "incomes": int((incs & self.yearly).sum())},
+            "spend": round(float(self.amount[subs].sum()), 2),
+            "income": round(float(self.amount[incs].sum()), 2),
+            "balance_percentiles": percentiles(balance),
+            "expense_percentiles": percentiles(with_subs),
+            "top_by_count": top_of(by_count.astype(np.float64)),
+            "top_by_spend": top_of(by_spend),
+            "amount_bins": list(AMOUNT_BINS),
+            "histogram": histogram,
+        }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"📊 Пользователей с данными: {report['users']} (всего заходили: {report['users_seen']})",
+        f"Подписок: {report['entries']['subscriptions']} (годовых {report['yearly']['subscriptions']}), "
+        f"доходов: {report['entries']['incomes']} (годовых {report['yearly']['incomes']})",
+        f"💸 Все расходы: {report['spend']:.2f} ₽/мес.",
+        f"💰 Все доходы: {report['income']:.2f} ₽/мес.",
+    ]
+    for title, key in (("Баланс пользователя", "balance_percentiles"), ("Расходы пользователя", "expense_percentiles")):
+        if report[key]:
+            lines.append(f"\n{title}, перцентили:")
+            lines.append(", ".join(f"p{p} {value:+.0f}" if key == "balance_percentiles" else f"p{p} {value:.0f}"
+                                   for p, value in report[key].items()))
+    for title, key in (("Популярные подписки", "top_by_count"), ("Подписки с наибольшими тратами", "top_by_spend")):
+        if report[key]:
+            lines.append(f"\n{title}:")
+            lines.extend(f"{i}. {item['name']} — {item['count']} шт., {item['spend']:.2f} ₽/мес."
+                         for i, item in enumerate(report[key], 1))
+    lines.append("\nПодписки по сумме в месяц (месячные / годовые):")
+    bounds = report["amount_bins"]
+    for i, (monthly, yearly) in enumerate(zip(report["histogram"]["monthly"], report["histogram"]["yearly"])):
+        upper = f"{bounds[i + 1]}" if i + 1 < len(bounds) else "∞"
+        lines.append(f"{bounds[i]}–{upper} ₽: {monthly} / {yearly}")
+    return "\n".join(lines)
+
+
+# Отчёт по файлам данных без бота: python src/analytics.py data.json [shards/shard-*/data.json] [--json]
+# Файлы только читаются, можно запускать рядом с работающим ботом.
+# --check — вместо отчёта найти пользователей, у которых сохранённые итоги разошлись с записями (код выхода 1)
+def main():
+    from storage import JsonStorage, SqliteStorage
+
+    parser = argparse.ArgumentParser(description="Сводка по всем пользователям")
+    parser.add_argument('paths', nargs='+', type=Path, help="data.json или data.db (у шардов — все файлы)")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help="вывести JSON вместо текста")
+    parser.add_argument('--check', action='store_true', help="только проверить итоги пользователей")
+    args = parser.parse_args()
+
+    storages = []
+    for path in args.paths:
+        storage = SqliteStorage(path, read_only=True) if path.suffix == '.db' else JsonStorage(path, read_only=True)
+        storage.load()
+        storages.append(storage)
+    if args.check:
+        broken = [(path, user_id) for path, storage in zip(args.paths, storages)
+                  for user_id in storage.check_consistency()]
+        for storage in storages:
+            storage.close()
+        for path, user_id in broken:
+            print(f"{path}: итоги пользователя {user_id} не сходятся с записями")
+        print(f"Пользователей с расхождением: {len(broken)}")
+        sys.exit(1 if broken else 0)
+    report = Analytics(storages).report(args.top)
+    for storage in storages:
+        storage.close()
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(format_report(report))
+
+
+if __name__ == '__main__':
+    main()
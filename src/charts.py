@@ -0,0 +1,540 @@
+import os
+import io
+import json
+import hashlib
+import threading
+import importlib.util
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+from ledger import Ledger
+
+# Меняем при изменении внешнего вида графиков, чтобы старый кэш не подмешивался
+CHART_VERSION = "1"
+
+
+# Ключ кэша — хэш содержимого: одинаковые списки дают одну и ту же картинку.
+# variant — режим и размер отрисовки, у разных режимов картинки разные
+def chart_key(user: Ledger, variant: str = "") -> str:
+    payload = json.dumps(
+        [CHART_VERSION, variant, user.subscriptions.items(), user.incomes.items()],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# История баланса: точки уже прорежены (history.py), ключ — по ним
+def history_key(points: tuple, variant: str = "") -> str:
+    payload = json.dumps([CHART_VERSION, "history", variant, *map(list, points)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Только простые типы: данные уходят в процесс-рисовальщик через pickle
+def chart_payload(user: Ledger) -> tuple:
+    return (
+        user.subscriptions.items(),
+        user.incomes.items(),
+        user.expenses_total,
+        user.incomes_total,
+    )
+
+
+def _draw_pie(ax, items: list, title: str, total: float, empty_text: str):
+    if items:
+        ax.pie([amount for _, amount in items], labels=[name for name, _ in items],
+               autopct='%1.1f%%', startangle=90, textprops={'fontsize': 11})
+        ax.set_title(f'{title}\n{total:.2f} ₽/мес.', fontsize=14)
+    else:
+        ax.text(0.5, 0.5, f'{empty_text}\n😔', ha='center', va='center', fontsize=16, transform=ax.transAxes)
+        ax.set_title(f'{title}\n0 ₽', fontsize=14)
+        ax.axis('off')  # чистый фон без осей
+    ax.axis('equal')
+
+
+# Два графика в одном изображении. Рисуем через Figure/Agg без pyplot:
+# у pyplot глобальное состояние, которое нельзя делить между потоками
+def _render_matplotlib(subs: list, incs: list, exp_total: float, inc_total: float,
+                       figsize: tuple, dpi: int, tight: bool) -> bytes:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(1, 2)
+    _draw_pie(axs[0], subs, 'Траты', exp_total, 'Нет трат')
+    _draw_pie(axs[1], incs, 'Доходы', inc_total, 'Нет доходов')
+    fig.suptitle('Месячные доходы и траты', fontsize=18)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight' if tight else None, dpi=dpi)
+    return buf.getvalue()
+
+
+# full — исходный вид: 14x7 дюймов, dpi=200, около 2800x1400
+def render_full(subs: list, incs: list, exp_total: float, inc_total: float, width: int = None) -> bytes:
+    return _render_matplotlib(subs, incs, exp_total, inc_total, (14, 7), 200, True)
+
+
+# lite — тот же matplotlib, но под экран телефона и без пересчёта bbox_inches='tight'
+def render_lite(subs: list, incs: list, exp_total: float, inc_total: float, width: int = 1200) -> bytes:
+    dpi = 100
+    return _render_matplotlib(subs, incs, exp_total, inc_total, (14, 7), round(dpi * width / 1400), False)
+
+
+# Цвета секторов как у matplotlib по умолчанию (tab10)
+PIE_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+              "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+_fonts = {}
+
+
+# Шрифт с кириллицей: CHART_FONT, иначе DejaVuSans из поставки matplotlib (без его импорта)
+def _font(size: int):
+    from PIL import ImageFont
+
+    if size not in _fonts:
+        path = os.getenv('CHART_FONT')
+        if not path:
+            spec = importlib.util.find_spec('matplotlib')
+            if spec and spec.submodule_search_locations:
+                candidate = Path(spec.submodule_search_locations[0]) / 'mpl-data' / 'fonts' / 'ttf' / 'DejaVuSans.ttf'
+                path = str(candidate) if candidate.exists() else None
+        _fonts[size] = ImageFont.truetype(path, size) if path else ImageFont.load_default(size)
+    return _fonts[size]
+
+
+def _fit_text(draw, text: str, font, max_width: float) -> str:
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > max_width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _raster_pie(img, draw, items: list, title: str, total: float, empty_text: str, x0: int, width: int, height: int):
+    from PIL import Image, ImageDraw
+
+    title_font = _font(max(height // 22, 10))
+    text_font = _font(max(height // 32, 9))
+    title_text = f'{title}\n{total:.2f} ₽/мес.' if items else f'{title}\n0 ₽'
+    draw.multiline_text((x0 + width / 2, height * 0.16), title_text, fill='black', font=title_font,
+                        anchor='ma', align='center')
+    if not items:
+        draw.text((x0 + width / 2, height * 0.55), empty_text, fill='black', font=_font(max(height // 20, 10)),
+                  anchor='mm')
+        return
+
+    radius = int(min(height * 0.28, width * 0.22))
+    cx, cy = int(x0 + width * 0.05) + radius, int(height * 0.58)
+    # Сектор рисуем в двойном размере и уменьшаем — так края сглажены
+    scale = 2
+    pie = Image.new('RGBA', (radius * 2 * scale, radius * 2 * scale), (255, 255, 255, 0))
+    pie_draw = ImageDraw.Draw(pie)
+    total_amount = sum(amount for _, amount in items) or 1
+    angle = 270.0  # начинаем сверху и идём против часовой, как startangle=90 у matplotlib
+    for i, (_, amount) in enumerate(items):
+        sweep = 360.0 * amount / total_amount
+        pie_draw.pieslice((0, 0, radius * 2 * scale - 1, radius * 2 * scale - 1), angle - sweep, angle,
+                          fill=PIE_COLORS[i % len(PIE_COLORS)], outline='white', width=scale)
+        angle -= sweep
+    pie = pie.reduce(scale)
+    img.paste(pie, (cx - radius, cy - radius), pie)
+
+    # Легенда справа от круга, что не влезло — одной строкой «… ещё N»
+    line_height = int(text_font.size * 1.5)
+    lx = cx + radius + width * 0.05
+    max_text = x0 + width - lx - line_height * 1.5
+    max_lines = max(int(radius * 2 / line_height), 1)
+    shown = items if len(items) <= max_lines else items[:max_lines - 1]
+    ly = cy - min(len(items), max_lines) * line_height / 2
+    for i, (name, amount) in enumerate(shown):
+        color = PIE_COLORS[i % len(PIE_COLORS)]
+        box = text_font.size
+        draw.rectangle((lx, ly + (line_height - box) / 2, lx + box, ly + (line_height + box) / 2), fill=color)
+        percent = f' {100 * amount / total_amount:.1f}%'
+        label = _fit_text(draw, name, text_font, max_text - draw.textlength(percent, font=text_font)) + percent
+        draw.text((lx + box * 1.5, ly + line_height / 2), label, fill='black', font=text_font, anchor='lm')
+        ly += line_height
+    if len(shown) < len(items):
+        draw.text((lx, ly + line_height / 2), f'… ещё {len(items) - len(shown)}', fill='gray', font=text_font,
+                  anchor='lm')
+
+
+# raster — рисуем круги и легенду напрямую в Pillow, без matplotlib вообще
+def render_raster(subs: list, incs: list, exp_total: float, inc_total: float, width: int = 1200) -> bytes:
+    from PIL import Image, ImageDraw
+
+    height = width // 2
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.text((width / 2, height * 0.03), 'Месячные доходы и траты', fill='black', font=_font(max(height // 16, 12)),
+              anchor='ma')
+    _raster_pie(img, draw, subs, 'Траты', exp_total, 'Нет трат', 0, width // 2, height)
+    _raster_pie(img, draw, incs, 'Доходы', inc_total, 'Нет доходов', width // 2, width // 2, height)
+    buf = io.BytesIO()
+    # Палитра из 64 цветов: файл в разы меньше, а на круговой диаграмме разницы не видно
+    img.quantize(colors=64).save(buf, format='png')
+    return buf.getvalue()
+
+
+RENDERERS = {"full": render_full, "lite": render_lite, "raster": render_raster}
+
+
+def render_chart(mode: str, width: int, subs: list, incs: list, exp_total: float, inc_total: float) -> bytes:
+    return RENDERERS[mode](subs, incs, exp_total, inc_total, width)
+
+
+# Баланс ступеньками: значение держится до следующего изменения
+def _history_lines(days: list, expenses: list, incomes: list) -> tuple:
+    balance = [round(inc - exp, 2) for exp, inc in zip(expenses, incomes)]
+    return [date.fromordinal(day) for day in days], balance
+
+
+def _render_history_matplotlib(days: list, expenses: list, incomes: list, figsize: tuple, dpi: int) -> bytes:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dates, balance = _history_lines(days, expenses, incomes)
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.step(dates, incomes, where='post', color='#2ca02c', linewidth=1, label='Доходы')
+    ax.step(dates, expenses, where='post', color='#d62728', linewidth=1, label='Расходы')
+    ax.step(dates, balance, where='post', color='#1f77b4', linewidth=2.5, label='Баланс')
+    ax.axhline(0, color='gray', linewidth=0.8)
+    ax.set_title('История баланса, ₽/мес.', fontsize=16)
+    ax.legend(loc='upper left')
+    ax.grid(alpha=0.3)
+    fig.autofmt_xdate()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi)
+    return buf.getvalue()
+
+
+def _render_history_raster(days: list, expenses: list, incomes: list, width: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    dates, balance = _history_lines(days, expenses, incomes)
+    height = width // 2
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    title_font, text_font = _font(max(height // 16, 12)), _font(max(height // 32, 9))
+    draw.text((width / 2, height * 0.03), 'История баланса, ₽/мес.', fill='black', font=title_font, anchor='ma')
+    left, right, top, bottom = width * 0.1, width * 0.97, height * 0.15, height * 0.88
+    low = min(min(balance), min(expenses), min(incomes), 0)
+    high = max(max(balance), max(expenses), max(incomes), 0)
+    span_y = (high - low) or 1
+    first, last = days[0], max(days[-1], days[0] + 1)
+
+    def xy(day, value):
+        return (left + (right - left) * (day - first) / (last - first),
+                bottom - (bottom - top) * (value - low) / span_y)
+
+    draw.line((xy(first, 0), xy(last, 0)), fill='gray', width=1)
+    for values, color, line_width in ((incomes, '#2ca02c', 2), (expenses, '#d62728', 2), (balance, '#1f77b4', 4)):
+        points = []
+        for i, (day, value) in enumerate(zip(days, values)):
+            points.append(xy(day, value))
+            points.append(xy(days[i + 1] if i + 1 < len(days) else last, value))
+        draw.line(points, fill=color, width=line_width)
+    for value in (high, low):
+        draw.text((left - 8, xy(first, value)[1]), f'{value:.0f}', fill='black', font=text_font, anchor='rm')
+    for day, anchor in ((first, 'la'), (last, 'ra')):
+        draw.text((xy(day, low)[0], bottom + 8), date.fromordinal(day).strftime('%d.%m.%Y'), fill='black',
+                  font=text_font, anchor=anchor)
+    buf = io.BytesIO()
+    img.quantize(colors=64).save(buf, format='png')
+    return buf.getvalue()
+
+
+# days — date.toordinal(), по точке на день или месяц; расходы и доходы — итоги на этот день
+def render_history(mode: str, width: int, days: list, expenses: list, incomes: list) -> bytes:
+    if mode == "raster":
+        return _render_history_raster(days, expenses, incomes, width)
+    if mode == "full":
+        return _render_history_matplotlib(days, expenses, incomes, (14, 7), 200)
+    return _render_history_matplotlib(days, expenses, incomes, (14, 7), round(100 * width / 1400))
+
+
+# Прогрев процесса: matplotlib (или Pillow для raster) импортируется один раз
+# на весь срок жизни процесса
+def _init_worker(mode: str):
+    if mode == "raster":
+        from PIL import Image, ImageDraw
+        _font(12)
+        return
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+def _ping():
+    return True
+
+
+# Процессы пула — не fork от бота: к первому графику (или при пересоздании пула из полосы) в боте уже
+# работают потоки записи, напоминаний, метрик, и fork копирует их блокировки в чужом состоянии.
+# forkserver форкает процессы от отдельного чистого процесса без потоков, где заранее импортирован
+# этот модуль; главный модуль бота в них не импортируется. Где forkserver нет — spawn
+def _pool_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+# Пул процессов для отрисовки. Одновременно в работе не больше max_pending графиков,
+# остальным сразу отказываем, чтобы всплеск запросов графиков не занял все потоки бота.
+# workers=0 — рисуем прямо в потоке обработчика.
+class ChartPool:
+    def __init__(self, workers: int = 2, max_pending: int = None, mode: str = "full", width: int = 1200):
+        if mode not in RENDERERS:
+            raise ValueError(f"Неизвестный режим графиков: {mode}")
+        self.workers = workers
+        self.mode = mode
+        self.width = width
+        self.variant = f"{mode}:{width}" if mode != "full" else mode
+        self.max_pending = max_pending or max(workers, 1) * 2
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self.pending = 0  # графики в очереди и в работе
+        self._pending_lock = threading.Lock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context(),
+                                                     initializer=_init_worker, initargs=(self.mode,))
+            return self._executor
+
+    # Запускаем процессы заранее, чтобы первый график не ждал старта пула и импорта библиотек.
+    # Не ждём: процессы стартуют на задачах-пустышках, а импорт идёт в них параллельно.
+    # Без пула импортируем библиотеки в фоновом потоке к первому запросу графика.
+    def warm_up(self):
+        if self.workers > 0:
+            for _ in range(self.workers):
+                self._get_executor().submit(_ping)
+        else:
+            threading.Thread(target=_init_worker, args=(self.mode,), name="chart-warm-up", daemon=True).start()
+
+    def _done(self, _):
+        with self._pending_lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def submit(self, user: Ledger):
+        return self._submit(render_chart, *chart_payload(user))
+
+    def submit_history(self, points: tuple):
+        return self._submit(render_history, *points)
+
+    def _submit(self, render, *payload):
+        if not self._slots.acquire(blocking=False):
+            return None
+        with self._pending_lock:
+            self.pending += 1
+        if self.workers > 0:
+            try:
+                future = self._get_executor().submit(render, self.mode, self.width, *payload)
+            except Exception as e:
+                # Пул сломан (процесс убит) — пересоздаём при следующем запросе
+                with self._executor_lock:
+                    self._executor = None
+                future = Future()
+                future.set_exception(e)
+        else:
+            future = Future()
+            try:
+                future.set_result(render(self.mode, self.width, *payload))
+            except Exception as e:
+                future.set_exception(e)
+        future.add_done_callback(self._done)
+        return future
+
+    # Ждём выхода процессов пула: без этого выход процесса бота (или шарда) повисает в atexit
+    # multiprocessing на воркерах, ещё не дочитавших очередь, а закрытие посреди их запуска
+    # сыплет ошибками SemLock. Очередь отменяем, ждём только графики, которые уже рисуются.
+    def close(self):
+        with self._executor_lock:
+            if self._executor:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+# LRU готовых PNG с лимитом по байтам + необязательный кэш на диске, тоже LRU с лимитом
+# disk_max_bytes: давно не нужные .png и .id удаляются. Порядок на диске переживает перезапуск
+# через mtime файлов (попадание обновляет mtime).
+# Для каждого ключа помним file_id из Telegram, чтобы не загружать картинку повторно.
+class ChartCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: Path = None, max_file_ids: int = 100000,
+                 disk_max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_file_ids = max_file_ids
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._images = OrderedDict()  # key -> png
+        self._size = 0
+        self._file_ids = OrderedDict()  # key -> file_id
+        self._disk = OrderedDict()  # key -> {".png": байт, ".id": байт}, от давно не нужных к свежим
+        self._disk_size = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    def get(self, key: str):
+        with self._lock:
+            png = self._images.get(key)
+            if png is not None:
+                self._images.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits += 1
+                return png
+        png = self._read_disk(key)
+        with self._lock:
+            if png is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, png)
+        return png
+
+    def put(self, key: str, png: bytes):
+        with self._lock:
+            self._remember(key, png)
+        self._write_disk(key, png)
+
+    def _remember(self, key: str, png: bytes):
+        if len(png) > self.max_bytes:
+            return
+        old = self._images.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._images[key] = png
+        self._size += len(png)
+        while self._size > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._size -= len(evicted)
+
+    def file_id(self, key: str):
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is not None:
+                self._file_ids.move_to_end(key)
+                self.hits += 1
+                return file_id
+        if self.disk_dir:
+            path = self.disk_dir / f"{key}.id"
+            if path.exists():
+                file_id = path.read_text(encoding='utf-8').strip()
+                with self._lock:
+                    self._set_file_id(key, file_id)
+                    self.hits += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                return file_id
+        return None
+
+    def set_file_id(self, key: str, file_id: str):
+        with self._lock:
+            self._set_file_id(key, file_id)
+        if self.disk_dir:
+            content = file_id.encode('utf-8')
+            self._atomic_write(self.disk_dir / f"{key}.id", content)
+            self._disk_added(key, ".id", len(content))
+
+    def _set_file_id(self, key: str, file_id: str):
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    # Telegram может перестать принимать file_id — тогда загружаем картинку заново
+    def forget_file_id(self, key: str):
+        with self._lock:
+            self._file_ids.pop(key, None)
+        if self.disk_dir:
+            (self.disk_dir / f"{key}.id").unlink(missing_ok=True)
+            self._disk_removed(key, ".id")
+
+    def _read_disk(self, key: str):
+        if not self.disk_dir:
+            return None
+        path = self.disk_dir / f"{key}.png"
+        try:
+            png = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self._touch_disk(key)
+        return png
+
+    def _write_disk(self, key: str, png: bytes):
+        if self.disk_dir:
+            self._atomic_write(self.disk_dir / f"{key}.png", png)
+            self._disk_added(key, ".png", len(png))
+
+    # Индекс файлов на диске при старте: старые — по mtime в начале очереди на удаление
+    def _scan_disk(self):
+        found = []
+        for item in os.scandir(self.disk_dir):
+            name, suffix = os.path.splitext(item.name)
+            if suffix == ".tmp":
+                os.unlink(item.path)  # недописанный файл после падения
+            elif suffix in (".png", ".id"):
+                stat = item.stat()
+                found.append((stat.st_mtime, name, suffix, stat.st_size))
+        for _, key, suffix, size in sorted(found):
+            self._disk.setdefault(key, {})[suffix] = size
+            self._disk.move_to_end(key)
+            self._disk_size += size
+        self._evict_disk()
+
+    def _touch_disk(self, key: str):
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        try:
+            os.utime(self.disk_dir / f"{key}.png")
+        except FileNotFoundError:
+            pass
+
+    def _disk_added(self, key: str, suffix: str, size: int):
+        with self._lock:
+            files = self._disk.setdefault(key, {})
+            self._disk_size += size - files.get(suffix, 0)
+            files[suffix] = size
+            self._disk.move_to_end(key)
+        self._evict_disk()
+
+    def _disk_removed(self, key: str, suffix: str):
+        with self._lock:
+            files = self._disk.get(key)
+            if files and suffix in files:
+                self._disk_size -= files.pop(suffix)
+                if not files:
+                    del self._disk[key]
+
+    def _evict_disk(self):
+        with self._lock:
+            evicted = []
+            while self._disk_size > self.disk_max_bytes and self._disk:
+                key, files = self._disk.popitem(last=False)
+                self._disk_size -= sum(files.values())
+                evicted.extend(self.disk_dir / f"{key}{suffix}" for suffix in files)
+        for path in evicted:
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _atomic_write(path: Path, content: bytes):
+        tmp_path = path.with_name(path.name + f".{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
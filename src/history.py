@@ -0,0 +1,145 @@
+import time
+import struct
+import sqlite3
+import logging
+import threading
+import functools
+from array import array
+from datetime import date
+from pathlib import Path
+
+log = logging.getLogger("moneysaver")
+
+# Запись в history.bin прежних версий: user_id, день (date.toordinal), расходы, доходы — 28 байт
+RECORD = struct.Struct("<qidd")
+
+
+@functools.lru_cache(maxsize=4096)
+def _month(day: int) -> int:
+    d = date.fromordinal(day)
+    return d.year * 12 + d.month
+
+
+# Прореживание: до cutoff оставляем по одной точке на месяц (последнюю), дальше — по дню
+def downsample(days, expenses, incomes, cutoff: int) -> tuple:
+    keep = [i for i in range(len(days))
+            if days[i] >= cutoff or i + 1 == len(days) or days[i + 1] >= cutoff
+            or _month(days[i]) != _month(days[i + 1])]
+    if len(keep) == len(days):
+        return days, expenses, incomes
+    return (array("i", (days[i] for i in keep)), array("d", (expenses[i] for i in keep)),
+            array("d", (incomes[i] for i in keep)))
+
+
+# История итогов: таблица points в history.db рядом с файлом данных (у шарда — в его каталоге).
+# В памяти ничего не держим: ряд пользователя читается по индексу, когда он открывает график,
+# поэтому память не растёт с числом пользователей. Каждое изменение — точка дня (последнее значение
+# за день); при закрытии точки старше daily_days прореживаются до одной на месяц.
+# Запись без fsync: последние точки перед падением могут потеряться — история не деньги, а картинка.
+# history.bin прежних версий (записи RECORD подряд) переносится при первом запуске.
+class History:
+    def __init__(self, path: Path, daily_days: int = 90, clock=time.time, import_from: Path = None):
+        self.path = Path(path)
+        self.daily_days = daily_days
+        self.clock = clock
+        self.import_from = import_from
+        self._lock = threading.Lock()
+        self._db = None
+
+    def today(self) -> int:
+        return date.fromtimestamp(self.clock()).toordinal()
+
+    def _cutoff(self) -> int:
+        return self.today() - self.daily_days
+
+    def load(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS points (
+                    user_id INTEGER NOT NULL,
+                    day INTEGER NOT NULL,
+                    month INTEGER NOT NULL,
+                    expenses REAL NOT NULL,
+                    incomes REAL NOT NULL,
+                    PRIMARY KEY (user_id, day)
+                ) WITHOUT ROWID
+            """)
+            is_empty = self._db.execute("SELECT 1 FROM points LIMIT 1").fetchone() is None
+            if is_empty and self.import_from and Path(self.import_from).exists():
+                self._import_bin(Path(self.import_from))
+                self._prune(self._cutoff())
+
+    # Старый журнал читаем кусками: записи идут по времени, поэтому точка дня — последняя за день
+    def _import_bin(self, path: Path, chunk: int = 65536):
+        def rows():
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(RECORD.size * chunk)
+                    whole = len(data) - len(data) % RECORD.size  # оборванная последняя запись
+                    for user_id, day, expenses, incomes in RECORD.iter_unpack(memoryview(data)[:whole]):
+                        yield user_id, day, _month(day), expenses, incomes
+                    if len(data) < RECORD.size * chunk:
+                        break
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?)", rows())
+
+    # До cutoff остаётся последняя точка каждого месяца — то же, что downsample() для ряда
+    def _prune(self, cutoff: int):
+        self._db.execute("""
+            DELETE FROM points WHERE day < :cutoff AND EXISTS (
+                SELECT 1 FROM points AS later WHERE later.user_id = points.user_id
+                AND later.day > points.day AND later.day < :cutoff AND later.month = points.month)
+        """, {"cutoff": cutoff})
+
+    def record(self, user_id: str, totals: dict):
+        day = self.today()
+        with self._lock:
+            if self._db:
+                self._db.execute("INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?)",
+                                 (int(user_id), day, _month(day), totals["expenses"], totals["incomes"]))
+
+    # Каждое изменение данных в storage — точка в истории
+    def track(self, storage):
+        storage.subscribe(lambda user_id: self.record(user_id, storage.user(user_id).totals))
+
+    # Ряд пользователя: (дни, расходы, доходы) по возрастанию дней
+    def series(self, user_id: str) -> tuple:
+        with self._lock:
+            rows = self._db.execute("SELECT day, expenses, incomes FROM points WHERE user_id = ? ORDER BY day",
+                                    (int(user_id),)).fetchall()
+        return (array("i", (row[0] for row in rows)), array("d", (row[1] for row in rows)),
+                array("d", (row[2] for row in rows)))
+
+    # Заменить ряд пользователя (переезд между шардами); пустой ряд — удалить историю
+    def put(self, user_id: str, series: tuple):
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM points WHERE user_id = ?", (int(user_id),))
+            self._db.executemany("INSERT INTO points VALUES (?, ?, ?, ?, ?)",
+                                 ((int(user_id), day, _month(day), expenses, incomes)
+                                  for day, expenses, incomes in zip(*series)))
+
+    # Точки для графика: (дни, расходы, доходы), прорежённые на сегодня и продлённые до сегодня текущими итогами.
+    # Точек не больше daily_days + число месяцев, сколько бы времени ни прошло
+    def points(self, user_id: str, totals: dict) -> tuple:
+        today = self.today()
+        days, expenses, incomes = downsample(*self.series(user_id), today - self.daily_days)
+        days, expenses, incomes = list(days), list(expenses), list(incomes)
+        if not days or days[-1] < today:
+            days.append(today)
+            expenses.append(totals["expenses"])
+            incomes.append(totals["incomes"])
+        return days, expenses, incomes
+
+    def close(self):
+        with self._lock:
+            if self._db is None:
+                return
+            self._prune(self._cutoff())
+            self._db.close()
+            self._db = None
@@ -0,0 +1,61 @@
+import queue
+import logging
+import threading
+
+log = logging.getLogger("moneysaver")
+
+
+# Обработка обновлений в workers потоках-«полосах»: пользователь всегда попадает в одну полосу
+# (user_id % workers), поэтому его обновления выполняются строго по очереди, а обновления разных
+# пользователей — параллельно. Это те же полосатые блокировки на пользователя (полоса держит
+# «блокировку» всех своих пользователей), только с порядком: очередь полосы — FIFO.
+# Памяти — workers очередей по queue_size, сколько бы ни было пользователей; при заполнении
+# очереди submit() ждёт, и получение обновлений притормаживает.
+class Lanes:
+    def __init__(self, workers: int, queue_size: int = 100):
+        self.workers = workers
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+        for lane, tasks in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(lane, tasks), name=f"lane-{lane}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def lane(self, key: int) -> int:
+        return key % self.workers
+
+    # После close() — прямо в потоке вызова: так доделываются продолжения из фоновых задач
+    # (скачанный файл импорта), которые закончились уже при остановке
+    def submit(self, key: int, function, *args):
+        with self._lock:
+            if not self._closed:
+                self._queues[self.lane(key)].put((function, args))
+                return
+        function(*args)
+
+    def _work(self, lane: int, tasks: queue.Queue):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            function, args = task
+            try:
+                function(*args)
+            except Exception:
+                log.exception("lane-%d: ошибка обработчика", lane)
+
+    # Обновления, ждущие в очередях полос (как у queue.Queue — для metrics.register_queue)
+    def qsize(self) -> int:
+        return sum(tasks.qsize() for tasks in self._queues)
+
+    # Дорабатываем всё, что уже в очередях, и останавливаем потоки
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for tasks in self._queues:
+                tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
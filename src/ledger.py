@@ -0,0 +1,215 @@
+import sys
+from array import array
+from typing import NamedTuple
+
+KINDS = ("subscriptions", "incomes")
+
+
+# Запись списка. Создаётся при чтении, в памяти лежат только колонки Entries
+class Entry(NamedTuple):
+    id: int
+    name: str
+    amount: float  # в месяц
+    yearly: bool = False  # введено как годовая сумма (/год) и поделено на 12
+    day: int = 0  # день списания (@15), 0 — не задан
+
+
+# Один список пользователя по колонкам: id и суммы — в массивах (8 байт на значение), признак «годовая»
+# и день списания — по байту,
+# названия — в списке интернированных строк, одинаковые названия у всех пользователей — один объект.
+# Вместо словаря на запись и индекса id -> запись — десятки байт на запись вместо ~400 (bench/memory.py).
+class Entries:
+    __slots__ = ("ids", "names", "amounts", "yearly", "days")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.names = []
+        self.amounts = array("d")
+        self.yearly = bytearray()
+        self.days = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return map(Entry, self.ids, self.names, self.amounts, map(bool, self.yearly), self.days)
+
+    # entries[i] -> Entry, entries[a:b] -> [Entry, ...] (страницы списков)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(map(Entry, self.ids[index], self.names[index], self.amounts[index],
+                            map(bool, self.yearly[index]), self.days[index]))
+        return Entry(self.ids[index], self.names[index], self.amounts[index], bool(self.yearly[index]),
+                     self.days[index])
+
+    # [(название, сумма), ...] — для графиков
+    def items(self) -> list:
+        return list(zip(self.names, self.amounts))
+
+    def append(self, entry_id: int, name: str, amount: float, yearly: bool = False, day: int = 0) -> Entry:
+        name = sys.intern(name)
+        self.ids.append(entry_id)
+        self.names.append(name)
+        self.amounts.append(amount)
+        self.yearly.append(bool(yearly))
+        self.days.append(day)
+        return Entry(entry_id, name, self.amounts[-1], bool(yearly), day)
+
+    # Позиция записи с этим id или -1; поиск по массиву идёт в C, списки короткие
+    def position(self, entry_id: int) -> int:
+        try:
+            return self.ids.index(entry_id)
+        except ValueError:
+            return -1
+
+    def pop(self, position: int) -> Entry:
+        return Entry(self.ids.pop(position), self.names.pop(position), self.amounts.pop(position),
+                     bool(self.yearly.pop(position)), self.days.pop(position))
+
+    def copy(self) -> "Entries":
+        entries = Entries()
+        entries.ids = self.ids[:]
+        entries.names = self.names[:]
+        entries.amounts = self.amounts[:]
+        entries.yearly = self.yearly[:]
+        entries.days = self.days[:]
+        return entries
+
+
+# Общий пустой список, пока у пользователя нет записей этого вида: в него никто не пишет,
+# а многие пользователи только открывали бота
+_EMPTY = Entries()
+
+
+# Данные пользователя: подписки, доходы, итоги и счётчик id записей.
+# В data.json лежат в виде {"subscriptions": [{"name", "amount", "id"}], "incomes": [...],
+# "totals": {...}, "next_id": N}, в памяти — компактно (from_json/to_json переводят без потерь)
+class Ledger:
+    __slots__ = ("subscriptions", "incomes", "expenses_total", "incomes_total", "next_id")
+
+    def __init__(self):
+        self.subscriptions = _EMPTY
+        self.incomes = _EMPTY
+        self.expenses_total = 0.0
+        self.incomes_total = 0.0
+        self.next_id = 0
+
+    def entries(self, kind: str) -> Entries:
+        if kind == "subscriptions":
+            return self.subscriptions
+        if kind == "incomes":
+            return self.incomes
+        raise KeyError(kind)
+
+    # Список для записи: вместо общего пустого заводим свой
+    def _writable(self, kind: str) -> Entries:
+        entries = self.entries(kind)
+        if entries is _EMPTY:
+            entries = Entries()
+            setattr(self, kind, entries)
+        return entries
+
+    @property
+    def totals(self) -> dict:
+        return {"expenses": self.expenses_total, "incomes": self.incomes_total,
+                "balance": round(self.incomes_total - self.expenses_total, 2)}
+
+    # Итоги пересчитываем целиком только при загрузке и миграции,
+    # дальше они двигаются на сумму добавленной/удалённой записи
+    def rebuild_totals(self) -> dict:
+        self.expenses_total = round(sum(self.subscriptions.amounts, 0.0), 2)
+        self.incomes_total = round(sum(self.incomes.amounts, 0.0), 2)
+        return self.totals
+
+    def _shift_totals(self, kind: str, delta: float):
+        if kind == "subscriptions":
+            self.expenses_total = round(self.expenses_total + delta, 2)
+        else:
+            self.incomes_total = round(self.incomes_total + delta, 2)
+
+    def check_totals(self) -> bool:
+        stored = (self.expenses_total, self.incomes_total)
+        actual = (round(sum(self.subscriptions.amounts, 0.0), 2), round(sum(self.incomes.amounts, 0.0), 2))
+        return all(abs(a - b) < 0.005 for a, b in zip(stored, actual))
+
+    # entry_id не задан — берём следующий из next_id
+    def add(self, kind: str, name: str, amount: float, yearly: bool = False, day: int = 0,
+            entry_id: int = None) -> Entry:
+        if entry_id is None:
+            entry_id = self.next_id
+            self.next_id += 1
+        entry = self._writable(kind).append(entry_id, name, amount, yearly, day)
+        self._shift_totals(kind, entry.amount)
+        return entry
+
+    def find(self, kind: str, entry_id: int):
+        entries = self.entries(kind)
+        position = entries.position(entry_id)
+        return entries[position] if position >= 0 else None
+
+    def remove(self, kind: str, entry_id: int):
+        position = self.entries(kind).position(entry_id)
+        return self.remove_at(kind, position) if position >= 0 else None
+
+    # Старый формат журнала: удаление по позиции
+    def remove_at(self, kind: str, position: int):
+        entries = self.entries(kind)
+        if not 0 <= position < len(entries):
+            return None
+        entry = entries.pop(position)
+        self._shift_totals(kind, -entry.amount)
+        return entry
+
+    # Копия для снимка на диск: пишется в фоне, пока пользователь меняет свои списки
+    def copy(self) -> "Ledger":
+        ledger = Ledger()
+        for kind in KINDS:
+            entries = self.entries(kind)
+            if entries is not _EMPTY:
+                setattr(ledger, kind, entries.copy())
+        ledger.expenses_total = self.expenses_total
+        ledger.incomes_total = self.incomes_total
+        ledger.next_id = self.next_id
+        return ledger
+
+    def to_json(self) -> dict:
+        data = {kind: [_entry_json(e) for e in self.entries(kind)] for kind in KINDS}
+        data["totals"] = self.totals
+        data["next_id"] = self.next_id
+        return data
+
+    # Из data.json, в том числе старых форматов: просто список подписок, записи без id, без итогов.
+    # У записей без id постоянный id появляется по порядку после наибольшего
+    @classmethod
+    def from_json(cls, data) -> "Ledger":
+        if not isinstance(data, dict):
+            data = {"subscriptions": data if isinstance(data, list) else []}
+        ledger = cls()
+        items = [(kind, entry) for kind in KINDS for entry in data.get(kind, [])]
+        next_id = max([data.get("next_id", 0)] + [entry["id"] + 1 for _, entry in items if "id" in entry])
+        for kind, entry in items:
+            if "id" in entry:
+                entry_id = entry["id"]
+            else:
+                entry_id = next_id
+                next_id += 1
+            ledger._writable(kind).append(entry_id, entry["name"], entry["amount"], entry.get("yearly", False),
+                                          entry.get("day", 0))
+        ledger.next_id = next_id
+        totals = data.get("totals")
+        if totals:
+            ledger.expenses_total = totals["expenses"]
+            ledger.incomes_total = totals["incomes"]
+        else:
+            ledger.rebuild_totals()
+        return ledger
+
+
+# "yearly" и "day" пишем только если заданы: у старых записей их нет, и они остаются как были
+def _entry_json(entry: Entry) -> dict:
+    data = {"name": entry.name, "amount": entry.amount, "id": entry.id}
+    if entry.yearly:
+        data["yearly"] = True
+    if entry.day:
+        data["day"] = entry.day
+    return data
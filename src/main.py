@@ -1,14 +1,32 @@
-import os
-import json
+import time
+_started = time.perf_counter() # для замера холодного старта
+
 import io
+import os
+import csv
+import signal
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from pathlib import Path
 from dotenv import load_dotenv
 import telebot
-import matplotlib
-matplotlib.use('Agg')  # ← обязательно до импорта pyplot, убирает все ошибки Tkinter
-import matplotlib.pyplot as plt
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from telebot import apihelper
 from telebot.apihelper import ApiTelegramException
+from storage import JsonStorage, SqliteStorage
+from ledger import Entries, Ledger
+from charts import ChartCache, ChartPool, chart_key, history_key
+from history import History
+from reminders import Reminders, format_reminder
+from parsing import EntryError, parse_entry, iter_csv_lines, iter_json_lines
+from routing import Router, pack_callback
+from outbox import Outbox
+from lanes import Lanes
+from sharding import ShardDispatcher, rebalance
+from analytics import Analytics, format_report
+import metrics
 
 # Токен бота
 BASE_DIR = Path(__file__).parent.parent
@@ -16,43 +34,152 @@ TOKEN_PATH = BASE_DIR / 'token.env'
 DATA_FILE = BASE_DIR / 'data.json'
 load_dotenv(TOKEN_PATH)
 TOKEN = os.getenv('BOT_TOKEN')
-if not TOKEN:
-    raise ValueError("Токен не найден! Проверь token.env")
-bot = telebot.TeleBot(TOKEN)
-
-# Работа с json
-def load_data() -> dict:
-    if DATA_FILE.exists():
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-def save_data():
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-data = load_data() # {user_id: {"subscriptions": [], "incomes": []}}
-
-def get_user_data(user_id: str) -> dict:
-    if user_id not in data or not isinstance(data[user_id], dict):
-        old_subs = data.get(user_id, []) if isinstance(data.get(user_id), list) else []
-        data[user_id] = {"subscriptions": old_subs, "incomes": []}
-    return data[user_id]
-
-def get_subs(user_id: str) -> list:
-    return get_user_data(user_id)["subscriptions"]
-
-def get_incomes(user_id: str) -> list:
-    return get_user_data(user_id)["incomes"]
+# Токен проверяем в main(): модуль можно импортировать в тестах и утилитах без него
+bot = telebot.TeleBot(TOKEN or "", validate_token=bool(TOKEN))
+router = Router() # кнопки, команды и callback — через словари, см. routing.py
+log = logging.getLogger("moneysaver")
+
+# Хранилище: json (data.json + журнал data.log) или sqlite (data.db)
+STORAGE = os.getenv('STORAGE', 'json')
+SQLITE_FILE = BASE_DIR / os.getenv('SQLITE_FILE', 'data.db')
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+
+# Шарды: SHARDS процессов, у каждого свои пользователи и свои файлы в SHARDS_DIR/shard-N (см. sharding.py).
+# 0 — всё в одном процессе. При смене числа шардов пользователи переносятся при запуске
+SHARDS = int(os.getenv('SHARDS', '0'))
+SHARDS_PATH = BASE_DIR / os.getenv('SHARDS_DIR', 'shards')
+SHARD_QUEUE = int(os.getenv('SHARD_QUEUE', '1000'))
+
+def shard_path(shards: int, shard: int) -> Path:
+    if shards == 0:
+        return SQLITE_FILE if STORAGE == 'sqlite' else DATA_FILE
+    return SHARDS_PATH / f"shard-{shard}" / ('data.db' if STORAGE == 'sqlite' else 'data.json')
+
+def open_storage(path: Path = None):
+    path = path or shard_path(0, 0)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if STORAGE == 'json':
+        return JsonStorage(path)
+    if STORAGE == 'sqlite':
+        return SqliteStorage(path, cache_size=USER_CACHE_SIZE, import_from=DATA_FILE if path == SQLITE_FILE else None)
+    raise ValueError(f"Неизвестное хранилище STORAGE={STORAGE}")
+
+storage = open_storage() # данные загружаются в main()
+
+# История итогов для графика «📉 История баланса»: по дням за последние HISTORY_DAILY_DAYS, раньше — по месяцам.
+# Лежит рядом с данными (у шарда — в его каталоге)
+HISTORY_DAILY_DAYS = int(os.getenv('HISTORY_DAILY_DAYS', '90'))
+
+def open_history(path: Path = None) -> History:
+    path = path or shard_path(0, 0)
+    return History(path.with_name('history.db'), HISTORY_DAILY_DAYS, import_from=path.with_name('history.bin'))
+
+history = open_history() # загружается в main()
+
+# Напоминания о списаниях подписок с днём списания («Кинопоиск 499 @15»): за REMIND_DAYS_BEFORE дней
+# в REMIND_HOUR часов, не больше REMINDER_BATCH сообщений в секунду поверх лимитов outbox
+REMIND_DAYS_BEFORE = int(os.getenv('REMIND_DAYS_BEFORE', '1'))
+REMIND_HOUR = int(os.getenv('REMIND_HOUR', '10'))
+REMINDER_BATCH = int(os.getenv('REMINDER_BATCH', '20'))
+
+def send_reminder(user_id: str, due: list):
+    outbox.send_message(int(user_id), format_reminder(due))
+
+def open_reminders(path: Path = None) -> Reminders:
+    return Reminders((path or shard_path(0, 0)).with_name('reminders.json'), send_reminder, REMIND_DAYS_BEFORE,
+                     REMIND_HOUR, REMINDER_BATCH)
+
+reminders = open_reminders() # запускается в main()
+
+# Рантайм: sync (TeleBot) или async (AsyncTeleBot, см. runtime_async.py); обработчики в обоих — в полосах
+RUNTIME = os.getenv('RUNTIME', 'sync')
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '50'))
+
+# Получение обновлений: polling (getUpdates) или webhook (встроенный HTTP-сервер, см. webhook.py)
+UPDATES_MODE = os.getenv('UPDATES_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') # публичный адрес; пусто — setWebhook не вызываем
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_QUEUE = int(os.getenv('WEBHOOK_QUEUE', '1000'))
+
+# Потоки-обработчики (в каждом шарде — свои): обновления одного пользователя —
+# по порядку в одной полосе, разных — параллельно. LANE_QUEUE — очередь полосы
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '8'))
+LANE_QUEUE = int(os.getenv('LANE_QUEUE', '100'))
+lanes = None # создаются в main(); без них (утилиты, бенчмарки) обработчик выполняется в потоке вызова
+# Долгие запросы вне полос (скачивание файла импорта, /stats): полоса за это время
+# обслуживает остальных своих пользователей, ответ уходит из колбэка
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', '4'))
+tasks = ThreadPoolExecutor(max_workers=TASK_WORKERS, thread_name_prefix="tasks")
+
+# Кэш графиков: PNG в памяти (CHART_CACHE_BYTES) и, если задан CHART_CACHE_DIR, на диске (CHART_CACHE_DISK_BYTES)
+CHART_CACHE_BYTES = int(os.getenv('CHART_CACHE_BYTES', str(64 * 1024 * 1024)))
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR')
+CHART_CACHE_DISK_BYTES = int(os.getenv('CHART_CACHE_DISK_BYTES', str(256 * 1024 * 1024)))
+chart_cache = ChartCache(CHART_CACHE_BYTES, BASE_DIR / CHART_CACHE_DIR if CHART_CACHE_DIR else None,
+                         disk_max_bytes=CHART_CACHE_DISK_BYTES)
+
+# Графики рисуются в пуле из CHART_WORKERS процессов (0 — в потоке обработчика)
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_MAX_PENDING = int(os.getenv('CHART_MAX_PENDING', '0')) or None
+CHART_TIMEOUT = float(os.getenv('CHART_TIMEOUT', '20'))
+# Режим отрисовки: full (как раньше, 2800x1400), lite (matplotlib под телефон), raster (Pillow)
+CHART_MODE = os.getenv('CHART_MODE', 'full')
+CHART_WIDTH = int(os.getenv('CHART_WIDTH', '1200'))
+chart_pool = ChartPool(CHART_WORKERS, CHART_MAX_PENDING, CHART_MODE, CHART_WIDTH)
+
+# Пакетный импорт: сколько строк принимаем за раз и какой файл готовы скачать
+MAX_IMPORT_LINES = int(os.getenv('MAX_IMPORT_LINES', '1000'))
+MAX_IMPORT_BYTES = int(os.getenv('MAX_IMPORT_BYTES', str(1024 * 1024)))
+IMPORT_ERRORS_SHOWN = 20
+# Сколько записей на одной странице списка
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '10'))
+# /stats — сводка по всем пользователям, только для ADMIN_IDS (id в Telegram через запятую)
+ADMIN_IDS = {admin.strip() for admin in os.getenv('ADMIN_IDS', '').split(',') if admin.strip()}
+ADMIN_TOP = int(os.getenv('ADMIN_TOP', '10'))
+analytics = None # колонки numpy строятся при первом /stats, дальше обновляются по изменениям
+analytics_lock = threading.Lock()
+
+# Исходящие сообщения — через очередь с лимитами Telegram (см. outbox.py):
+# OUTBOX_GLOBAL_RATE в секунду на всех, OUTBOX_CHAT_RATE в секунду на чат (до OUTBOX_CHAT_BURST подряд).
+# Сообщения в один чат за OUTBOX_COALESCE_MS склеиваются в одно
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', '1'))
+OUTBOX_CHAT_BURST = float(os.getenv('OUTBOX_CHAT_BURST', '3'))
+OUTBOX_COALESCE_MS = float(os.getenv('OUTBOX_COALESCE_MS', '50'))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '8'))
+outbox = Outbox(bot, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_COALESCE_MS, OUTBOX_WORKERS)
+
+# Метрики Prometheus на METRICS_HOST:METRICS_PORT/metrics (0 — выключены, замеров нет)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Профилировщик: GET /profile?seconds=N или SIGUSR1 (вкл/выкл, горячие стеки пишутся в лог)
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+profiler = metrics.SamplingProfiler(PROFILE_INTERVAL_MS)
+
+def get_user_data(user_id: str) -> Ledger:
+    return storage.user(user_id) # подписки, доходы и итоги, см. ledger.py
+
+def get_subs(user_id: str) -> Entries:
+    return get_user_data(user_id).subscriptions
+
+def get_incomes(user_id: str) -> Entries:
+    return get_user_data(user_id).incomes
+
+# Итоги хранятся в записи пользователя и обновляются при каждом изменении
+def get_totals(user_id: str) -> dict:
+    return get_user_data(user_id).totals # {"expenses", "incomes", "balance"}
 
 def get_total_expenses(user_id: str) -> float:
-    return sum(sub["amount"] for sub in get_subs(user_id))
+    return get_totals(user_id)["expenses"]
 
 def get_total_incomes(user_id: str) -> float:
-    return sum(inc["amount"] for inc in get_incomes(user_id))
+    return get_totals(user_id)["incomes"]
 
 def get_balance(user_id: str) -> float:
-    return get_total_incomes(user_id) - get_total_expenses(user_id)
+    return get_totals(user_id)["balance"]
 
 # Клавиатуры
 def main_keyboard() -> ReplyKeyboardMarkup:
@@ -65,79 +192,74 @@ def main_keyboard() -> ReplyKeyboardMarkup:
         KeyboardButton("📊 Баланс"),
         KeyboardButton("📈 Графики доходов и трат")
     )
+    markup.add(KeyboardButton("📉 История баланса"))
     return markup
 
-def expenses_keyboard(user_id: str) -> InlineKeyboardMarkup:
+# Списки показываем страницами: в тексте и на кнопках только видимый кусок
+def page_slice(items: Entries, page: int):
+    pages = max((len(items) + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE, 1)
+    page = min(max(page, 0), pages - 1)
+    start = page * LIST_PAGE_SIZE
+    return items[start:start + LIST_PAGE_SIZE], page, pages
+
+def page_buttons(kind: str, page: int, pages: int) -> list:
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=pack_callback("p", kind, page - 1)))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Вперёд ▶️", callback_data=pack_callback("p", kind, page + 1)))
+    return buttons
+
+# Постоянный id записи в callback_data — в base36, чтобы было короче
+def short_id(entry_id: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        entry_id, rest = divmod(entry_id, 36)
+        text = digits[rest] + text
+        if not entry_id:
+            return text
+
+def expenses_keyboard(subs: list, page: int, pages: int) -> InlineKeyboardMarkup:
     markup = InlineKeyboardMarkup(row_width=1)
-    for i, sub in enumerate(get_subs(user_id)):
+    for sub in subs:
         markup.add(InlineKeyboardButton(
-            f"❌ {sub['name']} — {sub['amount']:.2f} ₽",
-            callback_data=f"delete_sub_{i}"
+            f"❌ {sub.name} — {sub.amount:.2f} ₽",
+            callback_data=pack_callback("d", "s", short_id(sub.id), page)
         ))
+    nav = page_buttons("s", page, pages)
+    if nav:
+        markup.row(*nav)
     return markup
 
-def incomes_keyboard(user_id: str) -> InlineKeyboardMarkup:
+def incomes_keyboard(incs: list, page: int, pages: int) -> InlineKeyboardMarkup:
     markup = InlineKeyboardMarkup(row_width=1)
-    for i, inc in enumerate(get_incomes(user_id)):
+    for inc in incs:
         markup.add(InlineKeyboardButton(
-            f"❌ {inc['name']} — {inc['amount']:.2f} ₽",
-            callback_data=f"delete_inc_{i}"
+            f"❌ {inc.name} — {inc.amount:.2f} ₽",
+            callback_data=pack_callback("d", "i", short_id(inc.id), page)
         ))
+    nav = page_buttons("i", page, pages)
+    if nav:
+        markup.row(*nav)
     return markup
 
-# Два графика в одном изображении
-def create_dual_chart(user_id: str):
-    subs = get_subs(user_id)
-    incs = get_incomes(user_id)
-    exp_total = get_total_expenses(user_id)
-    inc_total = get_total_incomes(user_id)
-    bal = get_balance(user_id)
+# Подпись к графику; без картинки она же служит запасным текстовым ответом
+def chart_caption(user: Ledger, title: str = "📈 Диаграммы доходов и трат") -> str:
+    totals = user.totals
+    exp_total = totals["expenses"]
+    inc_total = totals["incomes"]
+    bal = totals["balance"]
     emoji = "💚" if bal > 0 else "🔴" if bal < 0 else "😐"
-
-    fig, axs = plt.subplots(1, 2, figsize=(14, 7))
-
-    # Траты
-    if subs:
-        labels_exp = [sub['name'] for sub in subs]
-        sizes_exp = [sub['amount'] for sub in subs]
-        axs[0].pie(sizes_exp, labels=labels_exp, autopct='%1.1f%%', startangle=90, textprops={'fontsize': 11})
-        axs[0].set_title(f'Траты\n{exp_total:.2f} ₽/мес.', fontsize=14)
-    else:
-        axs[0].text(0.5, 0.5, 'Нет трат\n😔', ha='center', va='center', fontsize=16, transform=axs[0].transAxes)
-        axs[0].set_title('Траты\n0 ₽', fontsize=14)
-        axs[0].axis('off')  # чистый фон без осей
-
-    axs[0].axis('equal')
-
-    # Доходы
-    if incs:
-        labels_inc = [inc['name'] for inc in incs]
-        sizes_inc = [inc['amount'] for inc in incs]
-        axs[1].pie(sizes_inc, labels=labels_inc, autopct='%1.1f%%', startangle=90, textprops={'fontsize': 11})
-        axs[1].set_title(f'Доходы\n{inc_total:.2f} ₽/мес.', fontsize=14)
-    else:
-        axs[1].text(0.5, 0.5, 'Нет доходов\n😔', ha='center', va='center', fontsize=16, transform=axs[1].transAxes)
-        axs[1].set_title('Доходы\n0 ₽', fontsize=14)
-        axs[1].axis('off')  # чистый фон без осей
-
-    axs[1].axis('equal')
-
-    fig.suptitle('Месячные доходы и траты', fontsize=18)
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', dpi=200)
-    buf.seek(0)
-    plt.close(fig)
-
-    caption = (
-        f"📈 Диаграммы доходов и трат\n\n"
+    return (
+        f"{title}\n\n"
         f"💸 Расходы: {exp_total:.2f} ₽\n"
         f"💰 Доходы: {inc_total:.2f} ₽\n"
         f"📊 Баланс: {bal:+.2f} ₽ {emoji}"
     )
-    return buf, caption
 
-# Вывод списков и итогов
-def send_expenses(chat_id: int, user_id: str, edit_msg=None):
+# Вывод списков и итогов: текст и кнопки страницы списка — (text, markup)
+def expenses_view(user_id: str, page: int = 0) -> tuple:
     subs = get_subs(user_id)
     total = get_total_expenses(user_id)
     if not subs:
@@ -150,23 +272,17 @@ def send_expenses(chat_id: int, user_id: str, edit_msg=None):
         )
         markup = None
     else:
-        text = "📋 Твои подписки (расходы):\n\n"
-        for sub in subs:
-            text += f"- {sub['name']} — {sub['amount']:.2f} ₽/мес.\n"
+        visible, page, pages = page_slice(subs, page)
+        text = "📋 Твои подписки (расходы)"
+        text += f", стр. {page + 1}/{pages}:\n\n" if pages > 1 else ":\n\n"
+        for sub in visible:
+            billing = f", списание {sub.day}-го" if sub.day else ""
+            text += f"- {sub.name} — {sub.amount:.2f} ₽/мес.{billing}\n"
         text += f"\n💸 Итого расходов: {total:.2f} ₽"
-        markup = expenses_keyboard(user_id)
-    if edit_msg:
-        try:
-            bot.edit_message_text(chat_id=chat_id, message_id=edit_msg.message.message_id, text=text, reply_markup=markup)
-        except ApiTelegramException as e:
-            if "message is not modified" in str(e):
-                pass
-            else:
-                raise
-    else:
-        bot.send_message(chat_id, text, reply_markup=markup)
+        markup = expenses_keyboard(visible, page, pages)
+    return text, markup
 
-def send_incomes(chat_id: int, user_id: str, edit_msg=None):
+def incomes_view(user_id: str, page: int = 0) -> tuple:
     incs = get_incomes(user_id)
     total = get_total_incomes(user_id)
     if not incs:
@@ -179,36 +295,46 @@ def send_incomes(chat_id: int, user_id: str, edit_msg=None):
         )
         markup = None
     else:
-        text = "📋 Твои доходы:\n\n"
-        for inc in incs:
-            text += f"+ {inc['name']} — {inc['amount']:.2f} ₽/мес.\n"
+        visible, page, pages = page_slice(incs, page)
+        text = "📋 Твои доходы"
+        text += f", стр. {page + 1}/{pages}:\n\n" if pages > 1 else ":\n\n"
+        for inc in visible:
+            text += f"+ {inc.name} — {inc.amount:.2f} ₽/мес.\n"
         text += f"\n💰 Итого доходов: {total:.2f} ₽"
-        markup = incomes_keyboard(user_id)
+        markup = incomes_keyboard(visible, page, pages)
+    return text, markup
+
+def show_list(chat_id: int, view: tuple, edit_msg=None):
+    text, markup = view
     if edit_msg:
-        try:
-            bot.edit_message_text(chat_id=chat_id, message_id=edit_msg.message.message_id, text=text, reply_markup=markup)
-        except ApiTelegramException as e:
-            if "message is not modified" in str(e):
-                pass
-            else:
-                raise
+        outbox.edit_message_text(chat_id, edit_msg.message.message_id, text, reply_markup=markup)
     else:
-        bot.send_message(chat_id, text, reply_markup=markup)
+        outbox.send_message(chat_id, text, reply_markup=markup)
+
+def send_expenses(chat_id: int, user_id: str, edit_msg=None, page: int = 0):
+    show_list(chat_id, expenses_view(user_id, page), edit_msg)
+
+def send_incomes(chat_id: int, user_id: str, edit_msg=None, page: int = 0):
+    show_list(chat_id, incomes_view(user_id, page), edit_msg)
+
+def reply_to(message, text: str):
+    outbox.send_message(message.chat.id, text, reply_to_message_id=message.message_id)
 
 def send_balance(chat_id: int, user_id: str):
-    exp = get_total_expenses(user_id)
-    inc = get_total_incomes(user_id)
-    bal = get_balance(user_id)
+    totals = get_totals(user_id)
+    exp = totals["expenses"]
+    inc = totals["incomes"]
+    bal = totals["balance"]
     emoji = "💚" if bal > 0 else "🔴" if bal < 0 else "😐"
     text = (
         f"💰 Доходы: {inc:.2f} ₽\n"
         f"💸 Расходы: {exp:.2f} ₽\n"
         f"📊 Баланс: {bal:+.2f} ₽ {emoji}"
     )
-    bot.send_message(chat_id, text)
+    outbox.send_message(chat_id, text)
 
 # Команды
-@bot.message_handler(commands=['start'])
+@router.command('start')
 def start(message):
     user_id = str(message.from_user.id)
     get_user_data(user_id)
@@ -216,10 +342,11 @@ def start(message):
         "💰 Я трекер подписок, доходов и баланса\n\n"
         "Добавляй расходы (подписки) просто текстом:\n"
         "Название стоимость ← месячная\n"
-        "Название стоимость/год ← годовая (поделится на 12)\n\n"
+        "Название стоимость/год ← годовая (поделится на 12)\n"
+        "Название стоимость @день ← напомню накануне списания\n\n"
         "Примеры расходов:\n"
         "-Яндекс Плюс 299\n"
-        "-Кинопоиск 499\n"
+        "-Кинопоиск 499 @15\n"
         "-IVI 399\n"
         "-Метро 20500/год\n\n"
         "Добавляй доходы с префиксом + или «Доход »:\n"
@@ -229,119 +356,464 @@ def start(message):
         "+Зарплата 80000\n"
         "+Мама отправляет 400\n"
         "+Доход Стипендия 5000\n\n"
+        "Можно прислать сразу много строк одним сообщением\n"
+        "или файл .csv/.json (название, стоимость, доход)\n\n"
         "Кнопки всегда внизу 👇"
     )
-    bot.send_message(message.chat.id, text, reply_markup=main_keyboard())
+    outbox.send_message(message.chat.id, text, reply_markup=main_keyboard())
+
+# Остальным /stats не отличается от любого другого текста
+@router.command('stats')
+def admin_stats(message):
+    if str(message.from_user.id) not in ADMIN_IDS:
+        router.default(message)
+        return
+    in_background(send_stats, message.chat.id)
+
+# Первый отчёт строит колонки по всем пользователям — в пуле tasks, не в полосе
+def send_stats(chat_id: int):
+    global analytics
+    with analytics_lock:
+        if analytics is None or analytics.storages != [storage]:
+            analytics = Analytics([storage])
+        text = format_report(analytics.report(ADMIN_TOP))
+    outbox.send_message(chat_id, text)
 
 # Кнопки
-@bot.message_handler(func=lambda m: m.text == "📋 Подписки")
+@router.text("📋 Подписки")
 def btn_expenses(message):
     send_expenses(message.chat.id, str(message.from_user.id))
 
-@bot.message_handler(func=lambda m: m.text == "📋 Доходы")
+@router.text("📋 Доходы")
 def btn_incomes(message):
     send_incomes(message.chat.id, str(message.from_user.id))
 
-@bot.message_handler(func=lambda m: m.text == "📊 Баланс")
+@router.text("📊 Баланс")
 def btn_balance(message):
     send_balance(message.chat.id, str(message.from_user.id))
 
-@bot.message_handler(func=lambda m: m.text == "📈 Графики доходов и трат")
+@router.text("📈 Графики доходов и трат")
 def btn_chart(message):
+    # Копия: отрисовка может начаться уже не в полосе пользователя (после устаревшего file_id)
+    user = storage.user_snapshot(str(message.from_user.id))
+    send_chart(message, chart_key(user, chart_pool.variant), chart_caption(user), lambda: chart_pool.submit(user))
+
+@router.text("📉 История баланса")
+def btn_history(message):
     user_id = str(message.from_user.id)
-    img, caption = create_dual_chart(user_id)
-    bot.send_photo(message.chat.id, img, caption=caption)
+    user = get_user_data(user_id)
+    points = history.points(user_id, user.totals)
+    first = date.fromordinal(points[0][0]).strftime('%d.%m.%Y')
+    caption = chart_caption(user, f"📉 История баланса с {first}")
+    send_chart(message, history_key(points, chart_pool.variant), caption, lambda: chart_pool.submit_history(points))
+
+# Картинка из кэша, по file_id или из пула; render() ставит отрисовку в пул (None — пул занят).
+# Полосу не держим: отправка и отрисовка заканчиваются в колбэках, обработчик сразу свободен
+def send_chart(message, key: str, caption: str, render):
+    chat_id = message.chat.id
+    # Та же картинка уже была в Telegram — отправляем по file_id без загрузки; file_id устарел — рисуем
+    file_id = chart_cache.file_id(key)
+    if file_id:
+        def resend(f):
+            if isinstance(f.exception(), ApiTelegramException):
+                chart_cache.forget_file_id(key)
+                send_rendered(chat_id, key, caption, render)
+        outbox.call(chat_id, bot.send_photo, chat_id, file_id, caption=caption).add_done_callback(resend)
+        return
+    send_rendered(chat_id, key, caption, render)
 
-# Добавление доходов/расходов
-@bot.message_handler(func=lambda m: True)
-def add_entry(message):
-    if message.text in {"📋 Подписки", "📋 Доходы", "📊 Баланс", "📈 Графики доходов и трат"}:
+def send_rendered(chat_id: int, key: str, caption: str, render):
+    img = chart_cache.get(key)
+    if img is not None:
+        send_photo(chat_id, key, caption, img)
         return
-    user_id = str(message.from_user.id)
-    original_text = message.text.strip()
-    text = original_text
-    is_income = False
-    if text.startswith("+"):
-        text = text[1:].strip()
-        is_income = True
-    elif text.lower().startswith("доход "):
-        text = text[6:].strip()
-        is_income = True
-    parts = text.split()
-    if len(parts) < 2:
-        bot.reply_to(message, "❌ Формат: [+] Название стоимость\nили [+] Название стоимость/год\nПример: + Зарплата 80000")
+    future = render()
+    if future is None:
+        outbox.send_message(chat_id, f"⏳ Сейчас строится много графиков, попробуй чуть позже.\n\n{caption}")
         return
-    raw_amount = parts[-1]
-    name = ' '.join(parts[:-1]).strip()
-    if not name:
-        bot.reply_to(message, "❌ Укажи название.")
+    # Отвечаем один раз: картинкой или, если пул не успел за CHART_TIMEOUT, цифрами.
+    # Даже если не успел, готовая картинка попадёт в кэш к следующему нажатию
+    answered = threading.Lock()
+    def fail():
+        if answered.acquire(blocking=False):
+            outbox.send_message(chat_id, f"⚠️ Не удалось построить график, вот цифры:\n\n{caption}")
+    def rendered(f):
+        timer.cancel()
+        if f.cancelled() or f.exception() is not None:
+            fail()
+            return
+        chart_cache.put(key, f.result())
+        if answered.acquire(blocking=False):
+            send_photo(chat_id, key, caption, f.result())
+    timer = threading.Timer(CHART_TIMEOUT, fail)
+    timer.daemon = True
+    timer.start()
+    future.add_done_callback(rendered)
+
+# Не ждём отправки: file_id запомним, когда картинка уйдёт
+def send_photo(chat_id: int, key: str, caption: str, img: bytes):
+    def remember_file_id(f):
+        if f.exception() is None:
+            chart_cache.set_file_id(key, f.result().photo[-1].file_id)
+    outbox.call(chat_id, bot.send_photo, chat_id, img, caption=caption).add_done_callback(remember_file_id)
+
+# Добавление доходов/расходов: любой текст, кроме кнопок и команд
+@router.fallback
+def add_entry(message):
+    # Несколько непустых строк — пакетное добавление с одним ответом
+    if "\n" in message.text.strip():
+        import_entries(message, enumerate(message.text.splitlines(), 1))
         return
+    user_id = str(message.from_user.id)
     try:
-        extra_info = ""
-        if '/' in raw_amount:
-            cost_str, period = raw_amount.split('/', 1)
-            cost = float(cost_str.replace(',', '.'))
-            period = period.strip().lower()
-            if period in ["год", "г", "y", "year", "annual"]:
-                amount = round(cost / 12, 2)
-                extra_info = f" (из годовой {cost:.2f} ₽)"
-            elif period in ["месяц", "мес", "м", "month"]:
-                amount = round(cost, 2)
-            else:
-                raise ValueError
-        else:
-            amount = round(float(raw_amount.replace(',', '.')), 2)
-        if amount <= 0:
-            raise ValueError
-    except ValueError:
-        bot.reply_to(message, "❌ Стоимость — положительное число (1234.56 или 1234,56 или 83988/год)")
+        kind, name, amount, yearly, day, extra_info = parse_entry(message.text)
+    except EntryError as e:
+        reply_to(message, str(e))
         return
-    if is_income:
-        get_incomes(user_id).append({"name": name, "amount": amount})
-        category = "доход"
+    storage.add(user_id, kind, name, amount, yearly, day)
+    category = "доход" if kind == "incomes" else "подписка"
+    totals = get_totals(user_id)
+    exp = totals["expenses"]
+    inc = totals["incomes"]
+    bal = totals["balance"]
+    emoji = "💚" if bal > 0 else "🔴" if bal < 0 else "😐"
+    # Подтверждаем только то, что уже на диске; полоса тем временем берёт следующее обновление
+    def confirm():
+        reply_to(message, f"✅ Добавлено {category}: «{name}» — {amount:.2f} ₽/мес.{extra_info}")
+        outbox.send_message(message.chat.id,
+                            f"💸 Расходы: {exp:.2f} ₽\n"
+                            f"💰 Доходы: {inc:.2f} ₽\n"
+                            f"📊 Баланс: {bal:+.2f} ₽ {emoji}")
+    storage.after_sync(confirm)
+
+# Импорт из файла: .csv (название; стоимость[/год]; [доход]) или .json/.jsonl
+@router.content_type('document')
+def add_document(message):
+    file_name = (message.document.file_name or "").lower()
+    if file_name.endswith(('.csv', '.txt')):
+        reader = iter_csv_lines
+    elif file_name.endswith(('.json', '.jsonl')):
+        reader = iter_json_lines
     else:
-        get_subs(user_id).append({"name": name, "amount": amount})
-        category = "подписка"
-    save_data()
-    bot.reply_to(message, f"✅ Добавлено {category}: «{name}» — {amount:.2f} ₽/мес.{extra_info}")
-    exp = get_total_expenses(user_id)
-    inc = get_total_incomes(user_id)
-    bal = get_balance(user_id)
+        reply_to(message, "❌ Принимаю файлы .csv и .json")
+        return
+    if (message.document.file_size or 0) > MAX_IMPORT_BYTES:
+        reply_to(message, f"❌ Файл больше {MAX_IMPORT_BYTES // 1024} КБ")
+        return
+    # Скачиваем в пуле tasks, а записи добавляем снова в полосе пользователя, где меняются его данные.
+    # Сообщения, пришедшие во время скачивания, могут обработаться раньше файла
+    def downloaded(f):
+        if f.exception() is not None:
+            reply_to(message, "❌ Не удалось скачать файл, попробуй ещё раз")
+            return
+        in_lane(message.from_user, import_file, message, reader, f.result())
+    in_background(download_file, message.document.file_id).add_done_callback(downloaded)
+
+def download_file(file_id: str) -> bytes:
+    return bot.download_file(bot.get_file(file_id).file_path)
+
+def import_file(message, reader, content: bytes):
+    try:
+        import_entries(message, reader(io.BytesIO(content)))
+    except (ValueError, csv.Error):
+        reply_to(message, "❌ Не удалось прочитать файл. Нужна кодировка UTF-8 и столбцы: название, стоимость, [доход], "
+                          "[день списания]")
+
+# Все строки проверяем вместе, пишем одним изменением и отвечаем одним сообщением
+def import_entries(message, numbered_lines):
+    user_id = str(message.from_user.id)
+    items, errors = [], []
+    for number, line in numbered_lines:
+        if not line.strip():
+            continue
+        if len(items) + len(errors) >= MAX_IMPORT_LINES:
+            errors.append((number, f"❌ За раз принимаю не больше {MAX_IMPORT_LINES} строк, остальное пропущено"))
+            break
+        try:
+            kind, name, amount, yearly, day, _ = parse_entry(line)
+            items.append((kind, name, amount, yearly, day))
+        except EntryError as e:
+            errors.append((number, str(e).splitlines()[0]))
+    if items:
+        storage.add_many(user_id, items)
+    incomes_count = sum(1 for item in items if item[0] == "incomes")
+    text = f"✅ Добавлено записей: {len(items)} (подписок: {len(items) - incomes_count}, доходов: {incomes_count})\n"
+    if errors:
+        text += f"\n⚠️ Не добавлено строк: {len(errors)}\n"
+        for number, error in errors[:IMPORT_ERRORS_SHOWN]:
+            text += f"строка {number}: {error}\n"
+        if len(errors) > IMPORT_ERRORS_SHOWN:
+            text += f"… и ещё {len(errors) - IMPORT_ERRORS_SHOWN}\n"
+    totals = get_totals(user_id)
+    bal = totals["balance"]
     emoji = "💚" if bal > 0 else "🔴" if bal < 0 else "😐"
-    bot.send_message(message.chat.id,
-                     f"💸 Расходы: {exp:.2f} ₽\n"
-                     f"💰 Доходы: {inc:.2f} ₽\n"
-                     f"📊 Баланс: {bal:+.2f} ₽ {emoji}")
+    text += (
+        f"\n💸 Расходы: {totals['expenses']:.2f} ₽\n"
+        f"💰 Доходы: {totals['incomes']:.2f} ₽\n"
+        f"📊 Баланс: {bal:+.2f} ₽ {emoji}"
+    )
+    storage.after_sync(lambda: reply_to(message, text))
+
+# Callback: листание, удаление по id и кнопки старого формата (см. routing.py).
+# Ответ на нажатие — сразу, мимо очереди чата и её лимита (у Telegram на него несколько секунд),
+# но не в полосе: её не держим
+def answer_callback(call, text: str = None, show_alert: bool = False):
+    outbox.call_now(bot.answer_callback_query, call.id, text, show_alert=show_alert)
+
+LIST_KINDS = {"s": ("subscriptions", expenses_view), "i": ("incomes", incomes_view)}
+
+@router.action("p", 2)
+def turn_page(call, kind, page):
+    _, view = LIST_KINDS[kind]
+    page = int(page)
+    answer_callback(call)
+    show_list(call.message.chat.id, view(str(call.from_user.id), page), edit_msg=call)
+
+@router.action("d", 3)
+def delete_entry(call, kind, entry_id, page):
+    list_kind, view = LIST_KINDS[kind]
+    entry_id, page = int(entry_id, 36), int(page)
+    user_id = str(call.from_user.id)
+    chat_id = call.message.chat.id
+    deleted = storage.delete(user_id, list_kind, entry_id)
+    # Список строим сейчас, в полосе, а показываем, когда удаление уже на диске
+    updated = view(user_id, page)
+    if deleted:
+        label = "Удалена подписка" if list_kind == "subscriptions" else "Удалён доход"
+        answer = {"text": f"{label}: {deleted.name}", "show_alert": True}
+    else:
+        answer = {"text": "Эта запись уже удалена"}
+    def confirm():
+        answer_callback(call, **answer)
+        show_list(chat_id, updated, edit_msg=call)
+    storage.after_sync(confirm)
+
+# Кнопки старого формата (по позиции) могли устареть — просто показываем актуальный список
+@router.action("r", 1)
+def refresh_list(call, kind):
+    _, view = LIST_KINDS[kind]
+    answer_callback(call, "Список обновился, нажми ещё раз")
+    show_list(call.message.chat.id, view(str(call.from_user.id)), edit_msg=call)
+
+@router.callback_fallback
+def unknown_callback(call):
+    answer_callback(call, "Ошибка удаления")
+
+# В TeleBot зарегистрированы только диспетчеры, дальше — один поиск в словаре
+@bot.message_handler(content_types=['text', 'document'])
+def route_message(message):
+    in_lane(message.from_user, router.dispatch_message, message)
 
-# Callback (удаление)
 @bot.callback_query_handler(func=lambda call: True)
-def callback(call):
-    user_id = str(call.from_user.id)
-    if call.data.startswith("delete_sub_"):
-        try:
-            idx = int(call.data.split("_")[-1])
-            subs = get_subs(user_id)
-            if 0 <= idx < len(subs):
-                deleted = subs.pop(idx)
-                save_data()
-                bot.answer_callback_query(call.id, f"Удалена подписка: {deleted['name']}", show_alert=True)
-                send_expenses(call.message.chat.id, user_id, edit_msg=call)
-                return
-        except:
-            pass
-    elif call.data.startswith("delete_inc_"):
-        try:
-            idx = int(call.data.split("_")[-1])
-            incs = get_incomes(user_id)
-            if 0 <= idx < len(incs):
-                deleted = incs.pop(idx)
-                save_data()
-                bot.answer_callback_query(call.id, f"Удалён доход: {deleted['name']}", show_alert=True)
-                send_incomes(call.message.chat.id, user_id, edit_msg=call)
-                return
-        except:
-            pass
-    bot.answer_callback_query(call.id, "Ошибка удаления")
-
-print("Бот запущен...")
-bot.infinity_polling()
\ No newline at end of file
+def route_callback(call):
+    in_lane(call.from_user, router.dispatch_callback, call)
+
+# Обработчик — в полосе пользователя: его обновления по порядку, данные меняет только этот поток
+def in_lane(user, dispatch, *args):
+    if lanes is None:
+        dispatch(*args)
+    else:
+        lanes.submit(user.id if user else 0, dispatch, *args)
+
+# Задача в пуле tasks; ошибка попадает в лог, как у обработчиков в полосах
+def in_background(function, *args):
+    def logged(f):
+        if f.exception() is not None:
+            log.error("tasks: ошибка в %s", function.__name__, exc_info=f.exception())
+    future = tasks.submit(function, *args)
+    future.add_done_callback(logged)
+    return future
+
+# Замер холодного старта: время от запуска процесса до каждого этапа
+def log_startup(stage: str):
+    log.info("startup: %s — %.0f мс", stage, (time.perf_counter() - _started) * 1000)
+
+# Время до первого обработанного обновления. Обработчики TeleBot только раскладывают обновления
+# по полосам, поэтому оборачиваем то, что выполняется в полосе, — router.dispatch_*. После первого
+# обновления обёртки снимаются. В режиме шардов — в каждом шарде, где обновления и обрабатываются
+def track_first_update(stage: str = "первое обновление обработано"):
+    done = threading.Lock()
+    def wrap(function):
+        def dispatch(update):
+            try:
+                return function(update)
+            finally:
+                if done.acquire(blocking=False):
+                    del router.dispatch_message, router.dispatch_callback
+                    log_startup(stage)
+        return dispatch
+    router.dispatch_message = wrap(router.dispatch_message)
+    router.dispatch_callback = wrap(router.dispatch_callback)
+
+# В async-режиме обработчики отправляют сообщения через мост в цикл событий
+def run_async():
+    global bot
+    from runtime_async import AsyncRuntime
+    runtime = AsyncRuntime(TOKEN, bot, pool_size=HTTP_POOL_SIZE)
+    bot = runtime.bridge
+    outbox.bot = bot
+    runtime.run()
+
+# target — бот или, в режиме шардов, диспетчер, который раздаёт обновления процессам
+def run_webhook(target=None):
+    from webhook import WebhookServer
+    # Один поток только раскладывает обновления по полосам (или шардам) в порядке прихода
+    server = WebhookServer(target or bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                           queue_size=WEBHOOK_QUEUE, workers=1)
+    if METRICS_PORT:
+        metrics.register_queue("moneysaver_webhook_queue", "Обновления в очереди вебхука", server.updates)
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    log.info("webhook: слушаем %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    server.run()
+
+# Процесс шарда: своё хранилище, свой пул графиков и своя очередь отправки (общий лимит делится поровну)
+def run_shard(shard: int, updates):
+    global storage, outbox, history, reminders, lanes
+    apihelper._get_req_session(reset=True) # keep-alive соединение фронта не используем
+    storage = open_storage(shard_path(SHARDS, shard))
+    history = open_history(shard_path(SHARDS, shard))
+    reminders = open_reminders(shard_path(SHARDS, shard))
+    outbox = Outbox(bot, OUTBOX_GLOBAL_RATE / SHARDS, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_COALESCE_MS,
+                    OUTBOX_WORKERS)
+    metrics_server = start_metrics(METRICS_PORT + 1 + shard) if METRICS_PORT else None
+    storage.load()
+    history.load()
+    history.track(storage)
+    reminders.track(storage)
+    reminders.start()
+    chart_pool.warm_up()
+    track_first_update(f"shard-{shard}: первое обновление обработано")
+    bot.threaded = False
+    lanes = start_lanes()
+    try:
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            try:
+                bot.process_new_updates([update])
+            except Exception:
+                log.exception("shard-%d: ошибка обработки обновления %s", shard, update.update_id)
+    finally:
+        lanes.close()
+        tasks.shutdown(wait=True)
+        if metrics_server:
+            metrics_server.stop()
+        reminders.close()
+        chart_pool.close()
+        # Хранилище — раньше очереди отправки: последняя запись на диск вызывает колбэки
+        # after_sync, и их подтверждения ещё должны уйти
+        storage.close()
+        history.close()
+        outbox.close()
+
+def run_sharded():
+    dispatcher = ShardDispatcher(SHARDS, run_shard, SHARD_QUEUE)
+    dispatcher.start()
+    log.info("shards: запущено процессов: %d", SHARDS)
+    try:
+        if UPDATES_MODE == 'webhook':
+            run_webhook(dispatcher)
+        else:
+            dispatcher.poll(bot)
+    finally:
+        dispatcher.stop()
+
+# SIGTERM завершает бота так же, как Ctrl+C: через finally в main(), где всё сбрасывается на диск
+def handle_sigterm(signum, frame):
+    raise SystemExit(0)
+
+def toggle_profiler(signum, frame):
+    if not profiler.running:
+        profiler.start()
+        log.info("profiler: запущен")
+        return
+    # Останавливаем не в обработчике сигнала: stop() ждёт поток профилировщика
+    def dump():
+        stacks = profiler.stop()
+        log.info("profiler: горячие стеки (%d замеров)\n%s", sum(stacks.values()), metrics.format_stacks(stacks, 20))
+    threading.Thread(target=dump, name="profiler-dump", daemon=True).start()
+
+# Очередь полос — главная очередь обработчиков: её рост в метриках значит, что обработчики не успевают
+def start_lanes() -> Lanes:
+    started = Lanes(BOT_WORKERS, LANE_QUEUE)
+    if METRICS_PORT:
+        metrics.register_queue("moneysaver_lane_queue", "Обновления в очередях полос обработчиков", started)
+    return started
+
+def start_metrics(port: int):
+    metrics.instrument_api()
+    metrics.instrument_storage(storage)
+    metrics.instrument_charts(chart_cache, chart_pool)
+    metrics.instrument_outbox(outbox)
+    metrics.instrument_handlers(router)
+    server = metrics.MetricsServer(METRICS_HOST, port, profiler=profiler)
+    server.start()
+    log.info("metrics: слушаем %s:%s/metrics", METRICS_HOST, port)
+    return server
+
+def main():
+    global lanes
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not TOKEN:
+        raise ValueError("Токен не найден! Проверь token.env")
+    if RUNTIME not in ('sync', 'async'):
+        raise ValueError(f"Неизвестный режим RUNTIME={RUNTIME}")
+    if UPDATES_MODE not in ('polling', 'webhook'):
+        raise ValueError(f"Неизвестный режим UPDATES_MODE={UPDATES_MODE}")
+    # Без секрета любой, кто достучится до порта, пришлёт обновление от чужого имени (и /stats от админа)
+    if UPDATES_MODE == 'webhook' and not WEBHOOK_SECRET:
+        raise ValueError("Для вебхука нужен WEBHOOK_SECRET")
+    if UPDATES_MODE == 'webhook' and RUNTIME == 'async':
+        raise ValueError("Вебхук работает только с RUNTIME=sync")
+    if SHARDS and RUNTIME == 'async':
+        raise ValueError("Шарды работают только с RUNTIME=sync")
+    bot.token = TOKEN
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGUSR1, toggle_profiler)
+    rebalance(SHARDS_PATH / 'shards.json', SHARDS, shard_path, open_storage, open_history)
+    if SHARDS:
+        # Данные, графики и метрики — в процессах шардов (метрики шарда N на METRICS_PORT + 1 + N)
+        log_startup("начинаем получать обновления")
+        run_sharded()
+        return
+    # Обёртки ставим до load(): фоновая запись на диск берёт storage._flush при загрузке
+    metrics_server = start_metrics(METRICS_PORT) if METRICS_PORT else None
+    log_startup("модули импортированы")
+    storage.load()
+    history.load()
+    history.track(storage)
+    reminders.track(storage)
+    reminders.start()
+    log_startup("данные загружены")
+    # matplotlib грузится в фоне (в процессах пула или в отдельном потоке), бот стартует не дожидаясь
+    chart_pool.warm_up()
+    track_first_update()
+    # TeleBot сам не раскладывает обработчики по потокам: полосы держат порядок у каждого пользователя
+    bot.threaded = False
+    lanes = start_lanes()
+    print("Бот запущен...")
+    log_startup("начинаем получать обновления")
+    try:
+        if UPDATES_MODE == 'webhook':
+            run_webhook()
+        elif RUNTIME == 'async':
+            run_async()
+        else:
+            bot.infinity_polling()
+    finally:
+        lanes.close()
+        tasks.shutdown(wait=True)
+        if metrics_server:
+            metrics_server.stop()
+        reminders.close()
+        chart_pool.close()
+        # Хранилище — раньше очереди отправки: последняя запись на диск вызывает колбэки
+        # after_sync, и их подтверждения ещё должны уйти
+        storage.close()
+        history.close()
+        outbox.close()
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
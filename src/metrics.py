@@ -0,0 +1,326 @@
+import sys
+import time
+import logging
+import threading
+import functools
+import collections
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+
+log = logging.getLogger("moneysaver")
+
+# Границы корзин гистограмм задержки, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for values, value in items:
+            yield self.name + _labels_text(self.labels, values), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+
+# Значение считается в момент запроса /metrics: размер файлов, длина очередей, счётчики кэша
+class CallbackMetric:
+    def __init__(self, name: str, help: str, function, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.function = function
+
+    def samples(self):
+        try:
+            yield self.name, self.function()
+        except Exception:
+            log.exception("Метрика %s не посчиталась", self.name)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # значения меток -> [счётчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(values, list(series)) for values, series in self._series.items()]
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + "_bucket" + _labels_text(self.labels, values, f'le="{bound}"'), cumulative
+            yield self.name + "_bucket" + _labels_text(self.labels, values, 'le="+Inf"'), series[-1]
+            yield self.name + "_sum" + _labels_text(self.labels, values), series[-2]
+            yield self.name + "_count" + _labels_text(self.labels, values), series[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    # Текстовый формат Prometheus (version 0.0.4)
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "moneysaver_handler_seconds", "Время работы обработчика обновления", ("handler",)))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "moneysaver_handler_errors_total", "Исключения в обработчиках", ("handler",)))
+STORAGE_SECONDS = REGISTRY.register(Histogram(
+    "moneysaver_storage_seconds", "Время операций хранилища (flush — запись пачки на диск)", ("op",)))
+API_SECONDS = REGISTRY.register(Histogram(
+    "moneysaver_api_seconds", "Время запросов к Bot API", ("method",)))
+API_ERRORS = REGISTRY.register(Counter(
+    "moneysaver_api_errors_total", "Ошибки Bot API по кодам (0 — сеть)", ("method", "code")))
+NOT_MODIFIED = REGISTRY.register(Counter(
+    "moneysaver_api_not_modified_total", "Ответы «message is not modified» на редактирование", ("method",)))
+
+
+def _timed(function, histogram: Histogram, label: str, errors: Counter = None):
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            if errors is not None:
+                errors.inc(label)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, label)
+    return timed
+
+
+# Обработчики зарегистрированы в маршрутизаторе (routing.py), оборачиваем их замером
+def instrument_handlers(router):
+    router.replace_handlers(lambda function: _timed(function, HANDLER_SECONDS, function.__name__, HANDLER_ERRORS))
+
+
+# Вызывать до storage.load(): пачки на диск пишет фоновый поток через storage._flush
+def instrument_storage(storage):
+    for op in ("user", "add", "add_many", "delete", "sync", "_flush"):
+        setattr(storage, op, _timed(getattr(storage, op), STORAGE_SECONDS, op.lstrip("_")))
+    REGISTRY.register(CallbackMetric(
+        "moneysaver_storage_pending_writes", "Изменения, ещё не записанные на диск", storage.pending_writes))
+    REGISTRY.register(CallbackMetric(
+        "moneysaver_storage_disk_bytes", "Размер файлов данных на диске", storage.disk_bytes))
+
+
+# Все методы синхронного telebot проходят через apihelper._make_request
+def instrument_api():
+    make_request = apihelper._make_request
+
+    def timed_request(token, method_name, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            API_ERRORS.inc(method_name, str(e.error_code))
+            if "message is not modified" in e.description:
+                NOT_MODIFIED.inc(method_name)
+            raise
+        except Exception:
+            API_ERRORS.inc(method_name, "0")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - start, method_name)
+
+    apihelper._make_request = timed_request
+
+
+def instrument_charts(chart_cache, chart_pool):
+    REGISTRY.register(CallbackMetric(
+        "moneysaver_chart_cache_hits_total", "Графики, найденные в кэше", lambda: chart_cache.hits, "counter"))
+    REGISTRY.register(CallbackMetric(
+        "moneysaver_chart_cache_misses_total", "Графики, которых не было в кэше", lambda: chart_cache.misses, "counter"))
+    REGISTRY.register(CallbackMetric(
+        "moneysaver_chart_pending", "Графики в очереди и в работе", lambda: chart_pool.pending))
+
+
+def instrument_outbox(outbox):
+    register_queue("moneysaver_outbox_queue", "Исходящие запросы в очереди", outbox)
+    for name, help in (("sent", "Выполненные запросы к Bot API из очереди"),
+                       ("merged", "Сообщения, склеенные с предыдущим в тот же чат"),
+                       ("superseded", "Правки, заменённые более новой до отправки"),
+                       ("retries", "Повторы после 429 и ошибок соединения"),
+                       ("failed", "Запросы, которые так и не удалось выполнить")):
+        REGISTRY.register(CallbackMetric(f"moneysaver_outbox_{name}_total", help,
+                                         functools.partial(getattr, outbox, name), "counter"))
+
+
+def register_queue(name: str, help: str, queue):
+    REGISTRY.register(CallbackMetric(name, help, queue.qsize))
+
+
+# Сэмплирующий профилировщик: раз в interval_ms снимает стеки всех потоков.
+# Результат — «свёрнутые» стеки (формат flamegraph.pl/speedscope): «a;b;c количество»
+class SamplingProfiler:
+    def __init__(self, interval_ms: float = 10):
+        self.interval = interval_ms / 1000
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._stacks = collections.Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> collections.Counter:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            self._stop.set()
+            thread.join()
+        return self._stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+
+    # Профиль за seconds секунд (для /profile)
+    def collect(self, seconds: float) -> collections.Counter:
+        if self.running:
+            raise RuntimeError("Профилировщик уже запущен")
+        self.start()
+        time.sleep(seconds)
+        return self.stop()
+
+
+def format_stacks(stacks: collections.Counter, top: int = None) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common(top))
+
+
+# GET /metrics — метрики Prometheus, GET /profile?seconds=10 — горячие стеки за это время
+class MetricsServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100, registry: Registry = REGISTRY,
+                 profiler: SamplingProfiler = None):
+        self.registry = registry
+        self.profiler = profiler or SamplingProfiler()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/metrics":
+                    self._reply(200, server.registry.render(), "text/plain; version=0.0.4")
+                elif url.path == "/profile":
+                    try:
+                        seconds = min(float(parse_qs(url.query).get("seconds", ["10"])[0]), 60)
+                        stacks = server.profiler.collect(seconds)
+                    except (ValueError, RuntimeError) as e:
+                        self._reply(400, f"{e}\n", "text/plain")
+                        return
+                    self._reply(200, format_stacks(stacks), "text/plain")
+                else:
+                    self._reply(404, "not found\n", "text/plain")
+
+            def _reply(self, code: int, body: str, content_type: str):
+                payload = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type + "; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                log.debug("metrics: " + format, *args)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
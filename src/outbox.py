@@ -0,0 +1,283 @@
+import time
+import logging
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+from telebot.apihelper import ApiTelegramException
+
+log = logging.getLogger("moneysaver")
+
+MAX_TEXT = 4096  # длина сообщения в Telegram
+
+
+# Запрос точно не ушёл: соединение не установилось (отказ, DNS, таймаут подключения; NewConnectionError
+# в urllib3 — подкласс ConnectTimeoutError). Обрыв уже после отправки (Connection aborted,
+# RemoteDisconnected) сюда не попадает: сообщение могло дойти, повтор его продублирует
+def not_sent(error: requests.exceptions.ConnectionError) -> bool:
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд появится токен (0 — уже есть)
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+# Отложенный запрос к Bot API: send (send_message), edit (edit_message_text) или call (любая функция)
+class _Op:
+    __slots__ = ("kind", "function", "args", "kwargs", "futures", "ready_at", "attempts")
+
+    def __init__(self, kind: str, kwargs: dict, ready_at: float, function=None, args: tuple = ()):
+        self.kind = kind
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = [Future()]
+        self.ready_at = ready_at
+        self.attempts = 0
+
+    def run(self, bot):
+        if self.kind == "send":
+            return bot.send_message(**self.kwargs)
+        if self.kind == "edit":
+            return bot.edit_message_text(**self.kwargs)
+        return self.function(*self.args, **self.kwargs)
+
+    # Склеить с идущим следом сообщением в тот же чат: кнопки могут быть только у последнего
+    def merge(self, other) -> bool:
+        if self.kind != "send" or other.kind != "send" or self.kwargs.get("reply_markup") is not None:
+            return False
+        text = self.kwargs["text"] + "\n\n" + other.kwargs["text"]
+        if len(text) > MAX_TEXT:
+            return False
+        self.kwargs = {**other.kwargs, "text": text, "reply_to_message_id": self.kwargs.get("reply_to_message_id")}
+        self.futures += other.futures
+        return True
+
+
+class _Chat:
+    __slots__ = ("ops", "bucket", "busy", "blocked_until")
+
+    def __init__(self, bucket: TokenBucket):
+        self.ops = collections.deque()
+        self.bucket = bucket
+        self.busy = False  # в чат уходит не больше одного запроса за раз, порядок сохраняется
+        self.blocked_until = 0.0  # после 429 ждём retry_after
+
+
+# Очередь исходящих сообщений с лимитами Telegram: общий (global_rate в секунду)
+# и на каждый чат (chat_rate в секунду, до chat_burst подряд) — token bucket.
+# Сообщения в один чат, накопившиеся за coalesce_ms, уходят одним запросом,
+# а устаревшие правки того же сообщения выбрасываются. На 429 ждём retry_after и повторяем.
+class Outbox:
+    def __init__(self, bot, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 coalesce_ms: float = 50, workers: int = 8, max_retries: int = 5, clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce = coalesce_ms / 1000
+        self.workers = workers
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sent = 0
+        self.merged = 0
+        self.superseded = 0
+        self.retries = 0
+        self.failed = 0
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._chats = {}  # chat_id -> _Chat; порядок — очередь обхода, обслуженный чат уходит в конец
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = None
+        self._executor = None
+
+    def send_message(self, chat_id, text: str, reply_markup=None, reply_to_message_id: int = None) -> Future:
+        kwargs = {"chat_id": chat_id, "text": text, "reply_markup": reply_markup,
+                  "reply_to_message_id": reply_to_message_id}
+        return self._enqueue(chat_id, _Op("send", kwargs, self.clock() + self.coalesce))
+
+    def edit_message_text(self, chat_id, message_id: int, text: str, reply_markup=None) -> Future:
+        kwargs = {"chat_id": chat_id, "message_id": message_id, "text": text, "reply_markup": reply_markup}
+        return self._enqueue(chat_id, _Op("edit", kwargs, self.clock() + self.coalesce))
+
+    # Любой другой запрос (send_photo, ...) в общей очереди чата; результат — через Future
+    def call(self, chat_id, function, *args, **kwargs) -> Future:
+        return self._enqueue(chat_id, _Op("call", kwargs, self.clock(), function, args))
+
+    # Мимо очередей чатов и лимитов — ответ на нажатие кнопки (answer_callback_query): Telegram
+    # не считает его сообщением, а ждёт всего несколько секунд, пока у кнопки крутится индикатор
+    def call_now(self, function, *args, **kwargs) -> Future:
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("outbox закрыт")
+            if self._thread is None:
+                self._start()
+            return self._executor.submit(self._call_now, function, args, kwargs)
+
+    def _call_now(self, function, args: tuple, kwargs: dict):
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self.failed += 1
+            log.warning("outbox: запрос %s не выполнен: %s", getattr(function, "__name__", function), e)
+            raise
+        self.sent += 1
+        return result
+
+    def qsize(self) -> int:
+        return self._pending
+
+    def _enqueue(self, chat_id, op: _Op) -> Future:
+        future = op.futures[0]
+        with self._cond:
+            # После close() поток отправки уже не разберёт очередь, и Future никогда бы не завершился
+            if self._closing:
+                raise RuntimeError("outbox закрыт")
+            if self._thread is None:
+                self._start()
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, self.clock()))
+            if op.kind == "edit":
+                for i, old in enumerate(chat.ops):
+                    if old.kind == "edit" and old.kwargs["message_id"] == op.kwargs["message_id"]:
+                        # Старая правка ещё не ушла — отправим сразу новый текст на её месте
+                        op.futures = old.futures + op.futures
+                        op.ready_at = old.ready_at
+                        chat.ops[i] = op
+                        self.superseded += 1
+                        self._cond.notify()
+                        return future
+            chat.ops.append(op)
+            self._pending += 1
+            self._cond.notify()
+        return future
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    # Следующий запрос, который можно отправить сейчас, или сколько ждать до него
+    def _pick(self, now: float):
+        global_wait = self._global.delay(now)
+        if global_wait > 0:
+            return None, None, None, global_wait
+        best_wait = None
+        for chat_id, chat in list(self._chats.items()):
+            if chat.busy:
+                continue
+            if not chat.ops:
+                if chat.bucket.full(now):
+                    del self._chats[chat_id]  # чат простаивает, лимит восстановился
+                continue
+            head = chat.ops[0]
+            ready_at = head.ready_at if not self._closing else 0.0
+            wait = max(ready_at - now, chat.blocked_until - now, chat.bucket.delay(now))
+            if wait <= 0:
+                self._global.take(now)
+                chat.bucket.take(now)
+                chat.busy = True
+                op = chat.ops.popleft()
+                self._pending -= 1
+                while chat.ops and op.merge(chat.ops[0]):
+                    chat.ops.popleft()
+                    self._pending -= 1
+                    self.merged += 1
+                del self._chats[chat_id]
+                self._chats[chat_id] = chat
+                return chat_id, chat, op, None
+            best_wait = wait if best_wait is None else min(best_wait, wait)
+        return None, None, None, best_wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    chat_id, chat, op, wait = self._pick(self.clock())
+                    if op:
+                        break
+                    if self._closing and not self._pending and not any(c.busy for c in self._chats.values()):
+                        return
+                    self._cond.wait(wait)
+            self._executor.submit(self._execute, chat_id, chat, op)
+
+    def _execute(self, chat_id, chat: _Chat, op: _Op):
+        delay = error = None
+        try:
+            result = op.run(self.bot)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                delay = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+            elif "message is not modified" in e.description:
+                self._resolve(op, None)
+            else:
+                error = e
+        except requests.exceptions.ConnectionError as e:
+            if not_sent(e):
+                delay = min(0.5 * 2 ** op.attempts, 30)
+            error = e
+        except Exception as e:
+            error = e
+        else:
+            self.sent += 1
+            self._resolve(op, result)
+        with self._cond:
+            chat.busy = False
+            if delay is not None and op.attempts < self.max_retries:
+                op.attempts += 1
+                self.retries += 1
+                chat.ops.appendleft(op)
+                self._pending += 1
+                chat.blocked_until = self.clock() + delay
+                delay = error = None
+            self._cond.notify()
+        if delay is not None or error is not None:
+            self._fail(chat_id, op, error or RuntimeError(f"429 после {op.attempts} повторов"))
+
+    @staticmethod
+    def _resolve(op: _Op, result):
+        for future in op.futures:
+            future.set_result(result)
+
+    def _fail(self, chat_id, op: _Op, error: Exception):
+        self.failed += 1
+        log.warning("outbox: запрос %s в чат %s не выполнен: %s", op.kind, chat_id, error)
+        for future in op.futures:
+            future.set_exception(error)
+
+    # Отправляем всё, что накопилось (не дожидаясь окна склейки), но не дольше timeout
+    def close(self, timeout: float = 10):
+        with self._cond:
+            self._closing = True
+            if self._thread is None:
+                return
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
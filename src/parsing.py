@@ -0,0 +1,134 @@
+import io
+import re
+import math
+import csv
+import json
+import itertools
+
+YEAR_PERIODS = {"год", "г", "y", "year", "annual"}
+MONTH_PERIODS = {"месяц", "мес", "м", "month"}
+INCOME_TYPES = {"+", "доход", "доходы", "income", "in"}
+
+FORMAT_ERROR = "❌ Формат: [+] Название стоимость\nили [+] Название стоимость/год\nПример: + Зарплата 80000"
+AMOUNT_ERROR = "❌ Стоимость — положительное число (1234.56 или 1234,56 или 83988/год)"
+# Больше миллиарда в месяц или в год — опечатка; огромные числа к тому же превращаются в inf,
+# и после добавления и удаления такой записи итоги навсегда становятся nan
+MAX_AMOUNT = 1_000_000_000
+AMOUNT_LIMIT_ERROR = f"❌ Стоимость — не больше {MAX_AMOUNT:,} ₽".replace(",", " ")
+DAY_ERROR = "❌ День списания — число от 1 до 31 после стоимости месячной подписки\nПример: Кинопоиск 499 @15"
+
+
+# Префикс дохода: «+» или «Доход »
+INCOME_PREFIX_RE = re.compile(r"(?:\+|доход\s)\s*", re.IGNORECASE)
+# Сумма: 299, 299.90, 299,90, 83988/год; без знака, экспоненты, inf и nan
+AMOUNT_RE = re.compile(r"(\d+(?:[.,]\d*)?|[.,]\d+)(?:/(.+))?")
+# День списания после суммы: @15
+DAY_RE = re.compile(r"@(\d{1,2})")
+
+
+class EntryError(ValueError):
+    pass
+
+
+# Разбор строки «[+] Название стоимость[/год] [@день]» -> (kind, name, amount, yearly, day, extra_info)
+def parse_entry(line: str) -> tuple:
+    text = line.strip()
+    prefix = INCOME_PREFIX_RE.match(text)
+    if prefix:
+        text = text[prefix.end():]
+    parts = text.split()
+    day = 0
+    if parts and parts[-1].startswith("@"):
+        day_match = DAY_RE.fullmatch(parts.pop())
+        day = int(day_match.group(1)) if day_match else 0
+        # Напоминание о списании — только у ежемесячных подписок
+        if not 1 <= day <= 31 or prefix:
+            raise EntryError(DAY_ERROR)
+    if len(parts) < 2:
+        raise EntryError(FORMAT_ERROR)
+    name = ' '.join(parts[:-1])
+    match = AMOUNT_RE.fullmatch(parts[-1])
+    if not match:
+        raise EntryError(AMOUNT_ERROR)
+    cost_str, period = match.groups()
+    cost = float(cost_str.replace(',', '.'))
+    if not math.isfinite(cost) or cost > MAX_AMOUNT:
+        raise EntryError(AMOUNT_LIMIT_ERROR)
+    extra_info = ""
+    yearly = False
+    if period is None or period.lower() in MONTH_PERIODS:
+        amount = round(cost, 2)
+    elif period.lower() in YEAR_PERIODS:
+        amount = round(cost / 12, 2)
+        yearly = True
+        extra_info = f" (из годовой {cost:.2f} ₽)"
+    else:
+        raise EntryError(AMOUNT_ERROR)
+    if amount <= 0:
+        raise EntryError(AMOUNT_ERROR)
+    if day:
+        if yearly:
+            raise EntryError(DAY_ERROR)
+        extra_info += f", списание {day}-го числа"
+    return ("incomes" if prefix else "subscriptions"), name, amount, yearly, day, extra_info
+
+
+# Поля таблицы/JSON -> строка в том же формате, что и в сообщении
+def _fields_to_line(name, amount, kind=None, day=None) -> str:
+    prefix = "+ " if str(kind or "").strip().lower() in INCOME_TYPES else ""
+    line = f"{prefix}{str(name or '').strip()} {str(amount or '').strip()}"
+    day = str(day or "").strip().lstrip("@")
+    return f"{line} @{day}" if day else line
+
+
+# CSV читаем построчно из потока: название; стоимость[/год]; [тип: доход/расход]; [день списания]
+def iter_csv_lines(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    # Разделитель (Excel в русской локали сохраняет через «;») определяем по первой строке
+    first_line = text.readline()
+    delimiter = max(";\t,", key=first_line.count)
+    rows = csv.reader(itertools.chain([first_line], text), delimiter=delimiter)
+    for number, row in enumerate(rows, 1):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) < 2:
+            yield number, row[0]
+            continue
+        line = _fields_to_line(row[0], row[1], row[2] if len(row) > 2 else None, row[3] if len(row) > 3 else None)
+        # Первая строка с заголовками столбцов — не ошибка
+        if number == 1 and not any(ch.isdigit() for ch in row[1]):
+            continue
+        yield number, line
+
+
+# JSON: массив объектов {"name", "amount", "type", "day"} или JSON Lines (по объекту в строке)
+def iter_json_lines(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    first = text.read(1)
+    while first and first.isspace():
+        first = text.read(1)
+    if first == '[':
+        items = json.loads(first + text.read())
+        for number, item in enumerate(items, 1):
+            yield number, _json_item_to_line(item)
+        return
+    for number, raw in enumerate(_prepend(first, text), 1):
+        if raw.strip():
+            try:
+                yield number, _json_item_to_line(json.loads(raw))
+            except ValueError:
+                yield number, raw.strip()
+
+
+def _prepend(first: str, text):
+    lines = iter(text)
+    head = next(lines, "")
+    yield first + head
+    yield from lines
+
+
+def _json_item_to_line(item) -> str:
+    if not isinstance(item, dict):
+        return str(item)
+    kind = item.get("type") or ("доход" if item.get("income") else None)
+    return _fields_to_line(item.get("name"), item.get("amount"), kind, item.get("day"))
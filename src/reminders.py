@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import heapq
+import logging
+import calendar
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+log = logging.getLogger("moneysaver")
+
+
+# Ближайшее напоминание не раньше after: за days_before дней до дня списания, в hour часов (местное время).
+# День 31 в коротком месяце — последний день месяца
+def next_due(day: int, after: float, days_before: int = 1, hour: int = 10) -> float:
+    start = date.fromtimestamp(after)
+    year, month = start.year, start.month
+    while True:
+        billing = date(year, month, min(day, calendar.monthrange(year, month)[1]))
+        due = datetime.combine(billing - timedelta(days=days_before), datetime.min.time()).replace(hour=hour)
+        if due.timestamp() >= after:
+            return due.timestamp()
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+# Напоминания о списаниях подписок с днём списания (@15). Очередь — куча (время, user_id, id записи):
+# за тик снимаются только наступившие напоминания, пользователи без дней списания не просматриваются.
+# Расписание строится при старте по storage.billing_days() и поправляется по storage.subscribe;
+# на диске (reminders.json) — только ключ последнего отправленного напоминания, чтобы после
+# перезапуска не повторять отправленное. send(user_id, [(Entry, дата списания), ...]) —
+# одно сообщение на пользователя; за тик — не больше batch сообщений, остальные в следующем тике.
+class Reminders:
+    def __init__(self, path: Path, send, days_before: int = 1, hour: int = 10, batch: int = 30,
+                 interval: float = 1.0, grace: float = 86400, clock=time.time):
+        self.path = Path(path)
+        self.send = send
+        self.days_before = days_before
+        self.hour = hour
+        self.batch = batch
+        self.interval = interval  # пауза между пачками, пока есть наступившие
+        self.grace = grace  # пропущенное за время простоя старше этого не отправляем
+        self.clock = clock
+        self.storage = None
+        self._heap = []  # (время, user_id, id записи); отменённые остаются в куче и пропускаются
+        self._due = {}  # (user_id, id записи) -> время в куче
+        self._days = {}  # user_id -> {id записи: день списания}
+        self._sent = (0.0, "", -1)  # ключ последнего отправленного
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _load_state(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._sent = tuple(json.load(f)["sent"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            log.warning("reminders: не удалось прочитать %s, начинаем заново", self.path)
+
+    def _save_state(self, sent: tuple):
+        tmp_path = self.path.with_suffix(".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            json.dump({"sent": list(sent)}, f)
+        os.replace(tmp_path, self.path)
+
+    # Расписание по подпискам с днём списания, дальше — только по изменившимся пользователям
+    def track(self, storage):
+        self.storage = storage
+        self._load_state()
+        with self._lock:
+            # После простоя: отправленное раньше _sent не повторяем, слишком старое пропускаем
+            after = max(self._sent, (self.clock() - self.grace, "", -1))
+            for user_id, entry_id, day in storage.billing_days():
+                self._days.setdefault(user_id, {})[entry_id] = day
+                self._schedule(user_id, entry_id, day, after)
+        storage.subscribe(self._user_changed)
+
+    def _schedule(self, user_id: str, entry_id: int, day: int, after: tuple):
+        due = next_due(day, after[0], self.days_before, self.hour)
+        if (due, user_id, entry_id) <= after:
+            due = next_due(day, due + 1, self.days_before, self.hour)
+        self._due[(user_id, entry_id)] = due
+        heapq.heappush(self._heap, (due, user_id, entry_id))
+        return due
+
+    def _user_changed(self, user_id: str):
+        days = {entry.id: entry.day for entry in self.storage.user_snapshot(user_id).subscriptions
+                if entry.day}
+        with self._lock:
+            old = self._days.pop(user_id, {})
+            if days:
+                self._days[user_id] = days
+            for entry_id in old.keys() - days.keys():
+                del self._due[(user_id, entry_id)]
+            after = (self.clock(), "", -1)
+            for entry_id in days.keys() - old.keys():
+                due = self._schedule(user_id, entry_id, days[entry_id], after)
+                if self._heap[0][0] == due:
+                    self._wake.set()
+
+    # Наступившие напоминания, не больше batch пользователей; возвращает, сколько сообщений ушло
+    def tick(self) -> int:
+        now = self.clock()
+        due_by_user = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, user_id, entry_id = self._heap[0]
+                if user_id not in due_by_user and len(due_by_user) >= self.batch:
+                    break
+                heapq.heappop(self._heap)
+                if self._due.get((user_id, entry_id)) != due:
+                    continue  # запись удалена или перенесена
+                key = (due, user_id, entry_id)
+                self._schedule(user_id, entry_id, self._days[user_id][entry_id], key)
+                self._sent = key
+                due_by_user.setdefault(user_id, []).append((entry_id, due))
+            sent = self._sent
+        if not due_by_user:
+            return 0
+        for user_id, items in due_by_user.items():
+            ledger = self.storage.user_snapshot(user_id)
+            reminders = []
+            for entry_id, due in items:
+                entry = ledger.find("subscriptions", entry_id)
+                if entry is not None:
+                    billing = date.fromtimestamp(due) + timedelta(days=self.days_before)
+                    reminders.append((entry, billing))
+            if reminders:
+                try:
+                    self.send(user_id, reminders)
+                except Exception:
+                    log.exception("reminders: не удалось отправить напоминание %s", user_id)
+        self._save_state(sent)
+        return len(due_by_user)
+
+    # Секунд до следующего тика: сразу после пачки — interval, иначе до ближайшего напоминания
+    def _wait_time(self, sent: int) -> float:
+        with self._lock:
+            head = self._heap[0][0] if self._heap else None
+        if head is None:
+            return 60.0
+        delay = head - self.clock()
+        if delay <= 0:
+            return self.interval if sent else 0.0
+        return min(delay, 60.0)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                sent = self.tick()
+            except Exception:
+                log.exception("reminders: ошибка тика")
+                sent = 1
+            # close() ставит _stopped раньше _wake: пробуждение после clear() не теряется
+            if not self._stopped.is_set():
+                self._wake.wait(self._wait_time(sent))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._due)
+
+
+def format_reminder(reminders: list) -> str:
+    lines = ["⏰ Скоро списание:" if len(reminders) == 1 else "⏰ Скоро списания:"]
+    for entry, billing in reminders:
+        lines.append(f"• {entry.name} — {entry.amount:.2f} ₽, {billing.strftime('%d.%m')}")
+    return "\n".join(lines)
@@ -0,0 +1,109 @@
+# callback_data: «<версия>:<действие>:<аргументы через :>», например 2:d:s:1a:0.
+# Первая версия — старые кнопки вида del_sub_1a_0 / page_sub_0 / delete_sub_3,
+# они остаются в истории чатов и разбираются в unpack_callback.
+CALLBACK_VERSION = "2"
+
+
+def pack_callback(action: str, *args) -> str:
+    return ":".join((CALLBACK_VERSION, action, *map(str, args)))
+
+
+# callback_data -> (действие, [аргументы]); (None, []) — не разобрали
+def unpack_callback(data: str) -> tuple:
+    if ":" in data:
+        version, action, *args = data.split(":")
+        if version != CALLBACK_VERSION:
+            return None, []
+        return action, args
+    parts = data.split("_")
+    kind = {"sub": "s", "inc": "i"}.get(parts[1]) if len(parts) > 1 else None
+    if kind is None:
+        return None, []
+    if parts[0] == "del" and len(parts) == 4:
+        return "d", [kind, parts[2], parts[3]]
+    if parts[0] == "page" and len(parts) == 3:
+        return "p", [kind, parts[2]]
+    if parts[0] == "delete" and len(parts) == 3:
+        return "r", [kind]
+    return None, []
+
+
+# Маршрутизация одним поиском в словаре: текст кнопки, команда, тип содержимого,
+# действие callback. В TeleBot регистрируются только два обработчика-диспетчера.
+class Router:
+    def __init__(self):
+        self.texts = {}  # текст кнопки -> обработчик(message)
+        self.commands = {}  # команда без «/» -> обработчик(message)
+        self.content_types = {}  # document, photo, ... -> обработчик(message)
+        self.actions = {}  # действие callback -> (обработчик(call, *args), число аргументов)
+        self.default = None  # любой другой текст
+        self.unknown_callback = None
+
+    def text(self, label: str):
+        def register(function):
+            self.texts[label] = function
+            return function
+        return register
+
+    def command(self, name: str):
+        def register(function):
+            self.commands[name] = function
+            return function
+        return register
+
+    def content_type(self, name: str):
+        def register(function):
+            self.content_types[name] = function
+            return function
+        return register
+
+    def action(self, name: str, arity: int):
+        def register(function):
+            self.actions[name] = (function, arity)
+            return function
+        return register
+
+    def fallback(self, function):
+        self.default = function
+        return function
+
+    def callback_fallback(self, function):
+        self.unknown_callback = function
+        return function
+
+    def dispatch_message(self, message):
+        if message.content_type != "text":
+            handler = self.content_types.get(message.content_type)
+            if handler:
+                handler(message)
+            return
+        text = message.text
+        handler = self.texts.get(text)
+        if handler is None and text.startswith("/"):
+            # /start, /start@имя_бота, /start параметры
+            handler = self.commands.get((text[1:].split(maxsplit=1) or [""])[0].partition("@")[0])
+        (handler or self.default)(message)
+
+    def dispatch_callback(self, call):
+        action, args = unpack_callback(call.data or "")
+        handler, arity = self.actions.get(action, (None, None))
+        if handler is None or len(args) != arity:
+            self.unknown_callback(call)
+            return
+        try:
+            handler(call, *args)
+        except (ValueError, KeyError):
+            # Испорченные аргументы (не число, неизвестный список) — как неизвестная кнопка
+            self.unknown_callback(call)
+
+    # Обернуть все обработчики, например замером времени для метрик
+    def replace_handlers(self, wrap):
+        for table in (self.texts, self.commands, self.content_types):
+            for key, function in table.items():
+                table[key] = wrap(function)
+        for key, (function, arity) in self.actions.items():
+            self.actions[key] = (wrap(function), arity)
+        if self.default:
+            self.default = wrap(self.default)
+        if self.unknown_callback:
+            self.unknown_callback = wrap(self.unknown_callback)
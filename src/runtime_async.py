@@ -0,0 +1,68 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper, apihelper
+from telebot.async_telebot import AsyncTeleBot
+
+log = logging.getLogger("moneysaver")
+
+
+# Мост для обработчиков: они по-прежнему синхронно вызывают bot.send_message(...),
+# но запрос уходит в цикл событий и выполняется на общей aiohttp-сессии
+class LoopBridge:
+    def __init__(self, async_bot: AsyncTeleBot, loop: asyncio.AbstractEventLoop):
+        self._async_bot = async_bot
+        self._loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self._async_bot, name)
+        if not asyncio.iscoroutinefunction(method):
+            return method
+
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(method(*args, **kwargs), self._loop)
+            try:
+                return future.result()
+            except asyncio_helper.ApiTelegramException as e:
+                # Обработчики ловят исключение синхронного telebot
+                raise apihelper.ApiTelegramException(e.function_name, e.result, e.result_json) from e
+        return call
+
+
+# asyncio-режим на AsyncTeleBot: те же обработчики, что зарегистрированы на синхронном боте.
+# Цикл событий занят только сетью. Зарегистрированные обработчики только раскладывают обновления
+# по полосам (lanes.py), поэтому выполняются в одном потоке по порядку прихода: так обновления
+# пользователя не обгоняют друг друга, а заполненная полоса тормозит этот поток, а не цикл событий.
+class AsyncRuntime:
+    def __init__(self, token: str, sync_bot, pool_size: int = 50):
+        asyncio_helper.REQUEST_LIMIT = pool_size  # размер пула keep-alive соединений
+        self.loop = asyncio.new_event_loop()
+        self.async_bot = AsyncTeleBot(token)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feeder")
+        self.bridge = LoopBridge(self.async_bot, self.loop)
+        for handler in sync_bot.message_handlers:
+            self.async_bot.message_handlers.append({**handler, 'function': self._wrap(handler['function'])})
+        for handler in sync_bot.callback_query_handlers:
+            self.async_bot.callback_query_handlers.append({**handler, 'function': self._wrap(handler['function'])})
+
+    def _wrap(self, function):
+        async def handler(update):
+            await self.loop.run_in_executor(self.executor, function, update)
+        return handler
+
+    async def _polling(self):
+        try:
+            await self.async_bot.infinity_polling()
+        finally:
+            await self.async_bot.close_session()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._polling())
+        finally:
+            self.executor.shutdown(wait=True)
+            self.loop.close()
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import bisect
+import hashlib
+import logging
+import threading
+import multiprocessing
+from queue import Full
+from pathlib import Path
+
+from storage import KINDS
+
+log = logging.getLogger("moneysaver")
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+# Консистентное хеширование: у каждого шарда replicas точек на кольце, пользователь
+# принадлежит первой точке по часовой стрелке. При изменении числа шардов
+# переезжает примерно 1/N пользователей, а не почти все, как при user_id % N.
+class HashRing:
+    def __init__(self, shards: int, replicas: int = 64):
+        self.shards = shards
+        points = sorted((_hash(f"shard-{shard}-{i}"), shard) for shard in range(shards) for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, user_id: str) -> int:
+        i = bisect.bisect(self._hashes, _hash(user_id)) % len(self._hashes)
+        return self._owners[i]
+
+
+# Ключ шардирования — from_user.id того, от кого пришло обновление (message, callback_query, ...)
+def update_user_id(update) -> str:
+    for value in vars(update).values():
+        from_user = getattr(value, "from_user", None)
+        if from_user is not None:
+            return str(from_user.id)
+    return str(update.update_id)
+
+
+# Раскладка данных на диске: {"shards": N} и, пока не дочищены старые шарды, "cleanup_from".
+# Нет файла — один data.json без шардов (N = 0)
+def read_layout(meta_path: Path) -> dict:
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"shards": 0}
+
+
+def write_layout(meta_path: Path, layout: dict):
+    if layout == {"shards": 0}:
+        meta_path.unlink(missing_ok=True)
+        return
+    meta_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = meta_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(layout, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, meta_path)
+
+
+# Перенос пользователей при смене числа шардов (0 — один процесс, один файл данных).
+# shard_path(shards, shard) -> путь к данным шарда, open_storage(path) -> незагруженное хранилище,
+# open_history(path) -> незагруженная история итогов шарда (переезжает вместе с данными).
+# 1) копируем переезжающих пользователей в новые шарды (копия от прерванного переноса стирается),
+#    ждём записи на диск и отмечаем в раскладке, что данные уже в новых шардах;
+# 2) удаляем их из старых. Прерванный перенос продолжается с того же шага при следующем запуске.
+def rebalance(meta_path: Path, new_shards: int, shard_path, open_storage, open_history=None) -> int:
+    layout = read_layout(meta_path)
+    old_shards = layout.get("cleanup_from", layout["shards"])
+    if layout == {"shards": new_shards}:
+        return 0
+    old_ring, new_ring = HashRing(max(old_shards, 1)), HashRing(max(new_shards, 1))
+    opened = {}  # путь -> хранилище; старая и новая раскладки делят файлы шардов
+    histories = {}  # путь к данным -> история шарда
+
+    def get(path: Path):
+        if path not in opened:
+            opened[path] = open_storage(path)
+            opened[path].load()
+        return opened[path]
+
+    def get_history(path: Path):
+        if path not in histories:
+            histories[path] = open_history(path)
+            histories[path].load()
+        return histories[path]
+
+    # (хранилище, путь, user_id, путь нового владельца) для всех, кто переезжает
+    def moving():
+        for old in range(max(old_shards, 1)):
+            source_path = shard_path(old_shards, old)
+            source = get(source_path)
+            for user_id in source.user_ids():
+                if old_ring.shard_for(user_id) != old:
+                    continue  # копия от прерванного переноса — владелец не этот шард
+                target_path = shard_path(new_shards, new_ring.shard_for(user_id))
+                if target_path != source_path:
+                    yield source, source_path, user_id, target_path
+
+    moved = 0
+    try:
+        if "cleanup_from" not in layout:
+            for source, source_path, user_id, target_path in moving():
+                _copy_user(source, get(target_path), user_id)
+                if open_history:
+                    get_history(target_path).put(user_id, get_history(source_path).series(user_id))
+                moved += 1
+            for storage in list(opened.values()):
+                storage.sync()
+            write_layout(meta_path, {"shards": new_shards, "cleanup_from": old_shards})
+        for source, source_path, user_id, _ in moving():
+            _clear_user(source, user_id)
+            if open_history:
+                get_history(source_path).put(user_id, ((), (), ()))
+        for storage in opened.values():
+            storage.sync()
+    finally:
+        for storage in opened.values():
+            storage.close()
+        for history in histories.values():
+            history.close()
+    write_layout(meta_path, {"shards": new_shards})
+    log.info("shards: %d -> %d, перенесено пользователей: %d", old_shards, new_shards, moved)
+    return moved
+
+
+def _clear_user(storage, user_id: str):
+    user = storage.user(user_id)
+    for kind in KINDS:
+        for entry_id in list(user.entries(kind).ids):
+            storage.delete(user_id, kind, entry_id)
+
+
+# Целиком, с теми же id записей и next_id: кнопки удаления в старых сообщениях работают и после переезда.
+# Копия от прерванного переноса заменяется
+def _copy_user(source, target, user_id: str):
+    target.put_user(user_id, source.user_snapshot(user_id))
+
+
+# Фронт: получает обновления и раскладывает их по очередям процессов-шардов.
+# Обновления одного пользователя всегда попадают в один процесс и обрабатываются по порядку,
+# поэтому общих блокировок между процессами нет. worker(shard, updates) выполняется в процессе шарда.
+class ShardDispatcher:
+    def __init__(self, shards: int, worker, queue_size: int = 1000):
+        context = multiprocessing.get_context("fork")
+        self.ring = HashRing(shards)
+        self.queues = [context.Queue(queue_size) for _ in range(shards)]
+        self.processes = [context.Process(target=worker, args=(shard, queue), name=f"shard-{shard}")
+                          for shard, queue in enumerate(self.queues)]
+        self.threaded = False  # совместимость с WebhookServer, который передаёт обновления как боту
+        self._polling = threading.Event()
+
+    # Процессы создаём до запуска любых потоков во фронте
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # put ждёт, если очередь шарда полна, — получение обновлений притормаживает
+            self.queues[self.ring.shard_for(update_user_id(update))].put(update)
+
+    def poll(self, bot, timeout: int = 20):
+        self._polling.set()
+        offset = None
+        while self._polling.is_set():
+            try:
+                updates = bot.get_updates(offset=offset, timeout=timeout + 5, long_polling_timeout=timeout)
+            except Exception:
+                log.exception("shards: getUpdates не удался, повторяем")
+                time.sleep(1)
+                continue
+            if updates:
+                offset = updates[-1].update_id + 1
+                self.process_new_updates(updates)
+
+    def stop_polling(self):
+        self._polling.clear()
+
+    # Шарды дорабатывают свои очереди и закрывают хранилища. Зависший шард через timeout
+    # получает SIGTERM: он всё равно сбросит данные на диск
+    def stop(self, timeout: float = 60):
+        for queue, process in zip(self.queues, self.processes):
+            if process.is_alive():
+                try:
+                    queue.put(None, timeout=timeout)
+                except Full:
+                    process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                log.warning("shards: %s не завершился за %.0f с, останавливаем", process.name, timeout)
+                process.terminate()
+                process.join(timeout)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
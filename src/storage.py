@@ -0,0 +1,732 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+
+from ledger import KINDS, Entry, Ledger
+
+log = logging.getLogger("moneysaver")
+
+
+# Пользователь, которого ещё нет, — пустой Ledger; старые форматы переводит Ledger.from_json
+def normalize_user(data: dict, user_id: str) -> Ledger:
+    user = data.get(user_id)
+    if not isinstance(user, Ledger):
+        user = data[user_id] = Ledger.from_json(user)
+    return user
+
+
+def apply_op(data: dict, op: dict):
+    if op["op"] == "put":
+        # Пользователь целиком, с id записей и next_id (переезд между шардами)
+        user = data[op["user"]] = Ledger.from_json(op["data"])
+        return user
+    user = normalize_user(data, op["user"])
+    if op["op"] == "add":
+        return user.add(op["kind"], op["name"], op["amount"], op.get("yearly", False), op.get("day", 0))
+    if op["op"] == "add_many":
+        # [kind, name, amount], [kind, name, amount, yearly] или [kind, name, amount, yearly, day]
+        return [user.add(*item) for item in op["items"]]
+    if op["op"] == "del":
+        if "idx" in op:
+            # Старый формат журнала: удаление по позиции
+            return user.remove_at(op["kind"], op["idx"])
+        return user.remove(op["kind"], op["id"])
+    raise ValueError(f"Неизвестная операция: {op['op']}")
+
+
+def _fsync_dir(path: Path):
+    # Без fsync каталога os.replace может не пережить отключение питания
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Размер файлов данных; data.log.old может исчезнуть в любой момент (компакция)
+def _files_size(*paths) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += path.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+# Групповая запись: изменения только помечаются, а на диск уходят пачкой. Если запись не идёт,
+# изменение пишется сразу; всё, что пришло во время записи, уходит следующей пачкой —
+# без ожидания, когда диск свободен, и с одним fsync на пачку, когда изменений много.
+# Кому нужна гарантия сохранения, ждёт её через wait() или получает колбэк через after().
+class GroupCommit:
+    def __init__(self, flush):
+        self._flush = flush
+        self._cond = threading.Condition()
+        self._marked = 0  # номер последнего изменения
+        self._durable = 0  # до какого номера всё уже на диске
+        self._waiters = deque()  # (номер, колбэк) по возрастанию номеров
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def mark(self) -> int:
+        with self._cond:
+            self._marked += 1
+            self._cond.notify_all()
+            return self._marked
+
+    # Изменения, ещё не записанные на диск
+    @property
+    def pending(self) -> int:
+        return self._marked - self._durable
+
+    def wait(self, ticket: int = None, timeout: float = None) -> bool:
+        with self._cond:
+            ticket = self._marked if ticket is None else ticket
+            ok = self._cond.wait_for(lambda: self._durable >= ticket or self._error, timeout)
+            if self._error:
+                raise self._error
+            return bool(ok)
+
+    # callback() — без ожидания, когда все уже сделанные изменения окажутся на диске.
+    # Выполняется в потоке записи, поэтому должен быть коротким (поставить ответ в очередь).
+    # После ошибки записи колбэки не вызываются: подтверждать нечего
+    def after(self, callback):
+        with self._cond:
+            if self._error:
+                raise self._error
+            if self._durable < self._marked:
+                self._waiters.append((self._marked, callback))
+                return
+        callback()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._marked > self._durable or self._closed)
+                if self._marked == self._durable and self._closed:
+                    return
+                target = self._marked
+            try:
+                self._flush()
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable = target
+                self._cond.notify_all()
+                ready = []
+                while self._waiters and self._waiters[0][0] <= target:
+                    ready.append(self._waiters.popleft()[1])
+            for callback in ready:
+                try:
+                    callback()
+                except Exception:
+                    log.exception("group-commit: ошибка колбэка")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+# Общий интерфейс хранилищ: записи пользователей только читаем через user(),
+# а меняем через add()/delete(), чтобы бэкенд мог всё сохранить
+class Storage:
+    def __init__(self):
+        self._listeners = []
+
+    def load(self):
+        pass
+
+    def user(self, user_id: str) -> Ledger:
+        raise NotImplementedError
+
+    def add(self, user_id: str, kind: str, name: str, amount: float, yearly: bool = False, day: int = 0) -> Entry:
+        raise NotImplementedError
+
+    # Пачка записей [(kind, name, amount, yearly, day), ...] одним изменением
+    def add_many(self, user_id: str, items: list) -> list:
+        raise NotImplementedError
+
+    def delete(self, user_id: str, kind: str, entry_id: int):
+        raise NotImplementedError
+
+    # Заменить данные пользователя копией ledger с теми же id записей и next_id: кнопки удаления
+    # в старых сообщениях продолжают указывать на свои записи
+    def put_user(self, user_id: str, ledger: Ledger):
+        raise NotImplementedError
+
+    def user_ids(self) -> list:
+        raise NotImplementedError
+
+    # Копия данных пользователя на момент вызова: для чтения из другого потока (отчёты, напоминания),
+    # пока обработчик этого пользователя может их менять
+    def user_snapshot(self, user_id: str) -> Ledger:
+        return self.user(user_id).copy()
+
+    # Все пользователи подряд: (user_id, Ledger). Для отчётов по всем данным
+    def scan(self):
+        for user_id in self.user_ids():
+            yield user_id, self.user(user_id)
+
+    # Подписки с днём списания: (user_id, id записи, день). Для расписания напоминаний при старте
+    def billing_days(self):
+        for user_id, user in self.scan():
+            for entry in user.subscriptions:
+                if entry.day:
+                    yield user_id, entry.id, entry.day
+
+    # callback(user_id) после каждого изменения данных пользователя (вызывается в потоке обработчика)
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _changed(self, user_id: str):
+        for callback in self._listeners:
+            callback(user_id)
+
+    # Дождаться, пока все сделанные изменения окажутся на диске
+    def sync(self, timeout: float = None) -> bool:
+        return True
+
+    # То же без ожидания: callback() вызовется, когда все сделанные изменения окажутся на диске
+    def after_sync(self, callback):
+        callback()
+
+    # Для метрик: сколько изменений ждут записи и сколько места занимают данные
+    def pending_writes(self) -> int:
+        return 0
+
+    def disk_bytes(self) -> int:
+        return 0
+
+    # Пользователи, у которых сохранённые итоги разошлись с записями
+    def check_consistency(self) -> list:
+        return [user_id for user_id in self.user_ids() if not self.user(user_id).check_totals()]
+
+    def close(self):
+        pass
+
+
+# Снимок data.json + журнал операций data.log.
+# Каждое изменение — одна строка в журнале (fsync), снимок пересобирается в фоне, когда журнал
+# дорастает до compact_ratio от размера снимка (но не меньше compact_min_bytes): при росте данных
+# снимки реже, и на переписывание снимка уходит постоянная доля записи.
+# read_only — только прочитать (отчёты рядом с работающим ботом): файлы не меняются
+class JsonStorage(Storage):
+    def __init__(self, snapshot_path: Path, compact_ratio: float = 1.0, compact_min_bytes: int = 1 << 20,
+                 read_only: bool = False):
+        super().__init__()
+        self.read_only = read_only
+        self.snapshot_path = Path(snapshot_path)
+        self.log_path = self.snapshot_path.with_suffix('.log')
+        self.old_log_path = self.snapshot_path.with_suffix('.log.old')
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.data = {}
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()  # запись в файл журнала; берётся после _lock, не наоборот
+        self._log = None
+        self._buffer = []  # строки журнала, ещё не записанные на диск
+        self._commits = None
+        self._log_bytes = 0  # журнал после последнего снимка (в символах — для порога хватает)
+        self._snapshot_bytes = 0
+        # Пока пишется снимок: user_id -> ещё не записанный в снимок пользователь. Перед изменением
+        # пользователя из этого словаря там оставляем его копию (копирование при записи)
+        self._unsaved = None
+        self._compactor = None
+
+    def load(self):
+        with self._lock:
+            self.data, snapshot_seq = self._read_snapshot()
+            self.seq = snapshot_seq
+            replayed = 0
+            for path in (self.old_log_path, self.log_path):
+                replayed += self._replay(path, snapshot_seq)
+            if self.read_only:
+                return
+            self._log = open(self.log_path, 'a', encoding='utf-8')
+            self._log_bytes = _files_size(self.old_log_path, self.log_path) if replayed else 0
+            self._snapshot_bytes = _files_size(self.snapshot_path)
+        self._commits = GroupCommit(self._flush)
+        # Старый журнал остался после прерванной компакции — дочищаем сразу
+        if self.old_log_path.exists():
+            self.compact(wait=True)
+
+    def user(self, user_id: str) -> Ledger:
+        with self._lock:
+            return normalize_user(self.data, user_id)
+
+    def user_snapshot(self, user_id: str) -> Ledger:
+        with self._lock:
+            return normalize_user(self.data, user_id).copy()
+
+    def user_ids(self) -> list:
+        with self._lock:
+            return list(self.data)
+
+    # Без копий (на миллионе пользователей копии удваивают время отчёта): запись может меняться
+    # во время чтения, но после изменения придёт _changed, и подписчик перечитает её через user_snapshot()
+    def scan(self):
+        with self._lock:
+            users = list(self.data.items())
+        for user_id, user in users:
+            yield user_id, user if isinstance(user, Ledger) else self.user(user_id)
+
+    # Колонка дней — bytearray: у пользователей без дней списания проверка any() идёт в C
+    def billing_days(self):
+        with self._lock:
+            users = list(self.data.items())
+        for user_id, user in users:
+            entries = user.subscriptions if isinstance(user, Ledger) else self.user(user_id).subscriptions
+            if any(entries.days):
+                for entry_id, day in zip(entries.ids, entries.days):
+                    if day:
+                        yield user_id, entry_id, day
+
+    def _read_snapshot(self):
+        if not self.snapshot_path.exists():
+            return {}, 0
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        seq = data.pop("_seq", 0)
+        for user_id in data:
+            normalize_user(data, user_id).rebuild_totals()
+        return data, seq
+
+    def _replay(self, path: Path, snapshot_seq: int) -> int:
+        if not path.exists():
+            return 0
+        count = 0
+        good_size = 0
+        with open(path, 'rb') as f:
+            for raw in f:
+                try:
+                    op = json.loads(raw)
+                except ValueError:
+                    # Оборванная последняя строка после падения — отбрасываем хвост
+                    break
+                if not raw.endswith(b'\n'):
+                    break
+                good_size += len(raw)
+                if op["seq"] <= snapshot_seq:
+                    continue
+                apply_op(self.data, op)
+                self.seq = op["seq"]
+                count += 1
+        if good_size != path.stat().st_size and not self.read_only:
+            with open(path, 'r+b') as f:
+                f.truncate(good_size)
+        return count
+
+    def _append(self, op: dict):
+        self.seq += 1
+        op["seq"] = self.seq
+        line = json.dumps(op, ensure_ascii=False) + '\n'
+        self._buffer.append(line)
+        self._log_bytes += len(line)
+        self._commits.mark()
+        # Изменение ещё не записанного в снимок пользователя: снимок возьмёт его копию до изменения
+        if self._unsaved is not None:
+            user = self._unsaved.get(op["user"])
+            if user is not None and user is self.data.get(op["user"]) and isinstance(user, Ledger):
+                self._unsaved[op["user"]] = user.copy()
+
+    # Одна запись и один fsync на всю пачку накопленных изменений.
+    # _io_lock берём, ещё держа _lock: иначе _rotate между ними переключит журнал, и взятые строки
+    # попадут в новый журнал после более новых операций. Пишем и ждём fsync уже без _lock
+    def _flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._io_lock.acquire()
+        try:
+            if lines:
+                self._log.write(''.join(lines))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        finally:
+            self._io_lock.release()
+
+    def sync(self, timeout: float = None) -> bool:
+        return self._commits.wait(timeout=timeout)
+
+    def after_sync(self, callback):
+        self._commits.after(callback)
+
+    def add(self, user_id: str, kind: str, name: str, amount: float, yearly: bool = False, day: int = 0) -> Entry:
+        op = {"op": "add", "user": user_id, "kind": kind, "name": name, "amount": amount}
+        if yearly:
+            op["yearly"] = True
+        if day:
+            op["day"] = day
+        with self._lock:
+            self._append(op)
+            entry = apply_op(self.data, op)
+        self._changed(user_id)
+        self._maybe_compact()
+        return entry
+
+    def add_many(self, user_id: str, items: list) -> list:
+        op = {"op": "add_many", "user": user_id, "items": [list(item) for item in items]}
+        with self._lock:
+            self._append(op)
+            added = apply_op(self.data, op)
+        self._changed(user_id)
+        self._maybe_compact()
+        return added
+
+    def delete(self, user_id: str, kind: str, entry_id: int):
+        with self._lock:
+            if normalize_user(self.data, user_id).find(kind, entry_id) is None:
+                return None
+            op = {"op": "del", "user": user_id, "kind": kind, "id": entry_id}
+            self._append(op)
+            deleted = apply_op(self.data, op)
+        self._changed(user_id)
+        self._maybe_compact()
+        return deleted
+
+    def put_user(self, user_id: str, ledger: Ledger):
+        op = {"op": "put", "user": user_id, "data": ledger.to_json()}
+        with self._lock:
+            self._append(op)
+            apply_op(self.data, op)
+        self._changed(user_id)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._log_bytes >= max(self.compact_min_bytes, self.compact_ratio * self._snapshot_bytes):
+            self.compact()
+
+    def compact(self, wait: bool = False):
+        with self._lock:
+            if self._compactor and self._compactor.is_alive():
+                compactor = self._compactor
+            else:
+                seq = self._rotate()
+                compactor = threading.Thread(target=self._write_snapshot, args=(seq,),
+                                             name="journal-compactor", daemon=True)
+                self._compactor = compactor
+                compactor.start()
+        if wait:
+            compactor.join()
+
+    def _rotate(self):
+        # Под блокировкой: переключение на новый журнал; данные не копируем, а только запоминаем,
+        # кого записать в снимок (копия словаря — ссылки, без данных пользователей)
+        # Если .log.old остался от неудачной компакции, не трогаем его:
+        # операции с seq не больше, чем в снимке, при загрузке пропускаются
+        if not self.old_log_path.exists():
+            with self._io_lock:
+                # Хвост буфера дописываем в старый журнал, чтобы не потерять его до готовности снимка
+                if self._buffer:
+                    self._log.write(''.join(self._buffer))
+                    self._buffer = []
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._log.close()
+                os.replace(self.log_path, self.old_log_path)
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+            self._log_bytes = 0
+        self._unsaved = dict(self.data)
+        return self.seq
+
+    # В фоне: пользователей переводим в JSON пачками, блокировка — только на пачку
+    def _write_snapshot(self, seq: int, batch: int = 1000):
+        tmp_path = self.snapshot_path.with_suffix('.json.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write('{"_seq": %d' % seq)
+                while True:
+                    with self._lock:
+                        users = []
+                        for _ in range(batch):
+                            if not self._unsaved:
+                                break
+                            user_id, user = self._unsaved.popitem()
+                            users.append((user_id, user.to_json() if isinstance(user, Ledger) else user))
+                    if not users:
+                        break
+                    f.write(''.join(', %s: %s' % (json.dumps(user_id, ensure_ascii=False),
+                                                  json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+                                    for user_id, data in users))
+                f.write('}')
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            with self._lock:
+                self._unsaved = None
+        os.replace(tmp_path, self.snapshot_path)
+        self._snapshot_bytes = _files_size(self.snapshot_path)
+        _fsync_dir(self.snapshot_path.parent)
+        # Всё из старого журнала уже в снимке
+        self.old_log_path.unlink(missing_ok=True)
+
+    def pending_writes(self) -> int:
+        return self._commits.pending if self._commits else 0
+
+    def disk_bytes(self) -> int:
+        return _files_size(self.snapshot_path, self.log_path, self.old_log_path)
+
+    def close(self):
+        if self.read_only:
+            return
+        if self._commits:
+            self._commits.close()
+            self._commits = None
+        self.compact(wait=True)
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+
+# SQLite с индексом по user_id: в памяти держим только LRU горячих пользователей
+class SqliteStorage(Storage):
+    def __init__(self, db_path: Path, cache_size: int = 10000, import_from: Path = None,
+                 read_only: bool = False):
+        super().__init__()
+        self.read_only = read_only
+        self.db_path = Path(db_path)
+        self.cache_size = cache_size
+        self.import_from = import_from
+        self._lock = threading.Lock()
+        self._db = None
+        self._commits = None
+        self._in_transaction = False
+        # user_id -> запись; id записи — entry_id, свой у каждого пользователя (как в JSON),
+        # следующий id — в users.next_id
+        self._cache = OrderedDict()
+
+    def load(self):
+        if self.read_only:
+            self._db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False,
+                                       isolation_level=None)
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                amount REAL NOT NULL,
+                yearly INTEGER NOT NULL DEFAULT 0,
+                day INTEGER NOT NULL DEFAULT 0,
+                entry_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS entries_user ON entries (user_id, id);
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                next_id INTEGER NOT NULL
+            );
+        """)
+        # Базы до появления годовых записей и дней списания
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        for column in ("yearly", "day"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE entries ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        # Базы, где id записи был rowid: он и становится entry_id, поэтому старые кнопки не ломаются.
+        # next_id — после наибольшего rowid, чтобы id удалённых записей не достались новым
+        if "entry_id" not in columns:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute("ALTER TABLE entries ADD COLUMN entry_id INTEGER")
+                self._db.execute("UPDATE entries SET entry_id = id")
+                self._db.execute(
+                    "INSERT OR IGNORE INTO users (user_id, next_id) SELECT DISTINCT user_id, "
+                    "(SELECT COALESCE(MAX(id), 0) + 1 FROM entries) FROM entries")
+        # Частичный индекс только по записям с днём списания: напоминаниям при старте не нужен проход по таблице
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_billing ON entries (kind, user_id, entry_id, day) "
+                         "WHERE day > 0")
+        is_empty = self._db.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+        if is_empty and self.import_from and Path(self.import_from).exists():
+            self._import_json(Path(self.import_from))
+        self._commits = GroupCommit(self._flush)
+
+    # Изменения копятся в открытой транзакции, COMMIT (и fsync) — один на пачку
+    def _begin(self):
+        if not self._in_transaction:
+            self._db.execute("BEGIN")
+            self._in_transaction = True
+
+    def _flush(self):
+        with self._lock:
+            if self._in_transaction:
+                self._db.execute("COMMIT")
+                self._in_transaction = False
+
+    def sync(self, timeout: float = None) -> bool:
+        return self._commits.wait(timeout=timeout)
+
+    def after_sync(self, callback):
+        self._commits.after(callback)
+
+    def pending_writes(self) -> int:
+        return self._commits.pending if self._commits else 0
+
+    def disk_bytes(self) -> int:
+        return _files_size(self.db_path, Path(f"{self.db_path}-wal"))
+
+    # Переезд с JSON: снимок вместе с журналом переливаем одной транзакцией
+    def _import_json(self, snapshot_path: Path):
+        old = JsonStorage(snapshot_path, read_only=True)
+        old.load()
+        rows, users = [], []
+        for user_id in old.user_ids():
+            user = old.user(user_id)
+            users.append((user_id, user.next_id))
+            for kind in KINDS:
+                rows.extend((user_id, kind, e.name, e.amount, e.yearly, e.day, e.id) for e in user.entries(kind))
+        old.close()
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO entries (user_id, kind, name, amount, yearly, day, entry_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany("INSERT OR REPLACE INTO users (user_id, next_id) VALUES (?, ?)", users)
+
+    def _get(self, user_id: str):
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            self._cache.move_to_end(user_id)
+            return cached
+        record = Ledger()
+        rows = self._db.execute(
+            "SELECT entry_id, kind, name, amount, yearly, day FROM entries WHERE user_id = ? ORDER BY id",
+            (user_id,))
+        for entry_id, kind, name, amount, yearly, day in rows:
+            record.add(kind, name, amount, yearly, day, entry_id)
+        row = self._db.execute("SELECT next_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        record.next_id = row[0] if row else 0
+        record.rebuild_totals()
+        self._cache[user_id] = record
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return record
+
+    def user(self, user_id: str) -> Ledger:
+        with self._lock:
+            return self._get(user_id)
+
+    def user_snapshot(self, user_id: str) -> Ledger:
+        with self._lock:
+            return self._get(user_id).copy()
+
+    def add(self, user_id: str, kind: str, name: str, amount: float, yearly: bool = False, day: int = 0) -> Entry:
+        with self._lock:
+            record = self._get(user_id)
+            self._begin()
+            entry = record.add(kind, name, amount, yearly, day)
+            self._insert(user_id, kind, entry)
+            self._save_next_id(user_id, record)
+        self._commits.mark()
+        self._changed(user_id)
+        return entry
+
+    def add_many(self, user_id: str, items: list) -> list:
+        added = []
+        with self._lock:
+            record = self._get(user_id)
+            self._begin()
+            for kind, name, amount, *flags in items:
+                yearly = bool(flags and flags[0])
+                day = flags[1] if len(flags) > 1 else 0
+                entry = record.add(kind, name, amount, yearly, day)
+                self._insert(user_id, kind, entry)
+                added.append(entry)
+            self._save_next_id(user_id, record)
+        self._commits.mark()
+        self._changed(user_id)
+        return added
+
+    def delete(self, user_id: str, kind: str, entry_id: int):
+        with self._lock:
+            record = self._get(user_id)
+            if record.find(kind, entry_id) is None:
+                return None
+            self._begin()
+            self._db.execute("DELETE FROM entries WHERE user_id = ? AND entry_id = ?", (user_id, entry_id))
+            deleted = record.remove(kind, entry_id)
+        self._commits.mark()
+        self._changed(user_id)
+        return deleted
+
+    def put_user(self, user_id: str, ledger: Ledger):
+        record = ledger.copy()
+        with self._lock:
+            self._begin()
+            self._db.execute("DELETE FROM entries WHERE user_id = ?", (user_id,))
+            for kind in KINDS:
+                for entry in record.entries(kind):
+                    self._insert(user_id, kind, entry)
+            self._save_next_id(user_id, record)
+            self._cache[user_id] = record
+            self._cache.move_to_end(user_id)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._commits.mark()
+        self._changed(user_id)
+
+    def _insert(self, user_id: str, kind: str, entry: Entry):
+        self._db.execute(
+            "INSERT INTO entries (user_id, kind, name, amount, yearly, day, entry_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, kind, entry.name, entry.amount, entry.yearly, entry.day, entry.id))
+
+    def _save_next_id(self, user_id: str, record: Ledger):
+        self._db.execute("INSERT OR REPLACE INTO users (user_id, next_id) VALUES (?, ?)", (user_id, record.next_id))
+
+    def user_ids(self) -> list:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT user_id FROM users")]
+
+    def billing_days(self):
+        with self._lock:
+            return self._db.execute("SELECT user_id, entry_id, day FROM entries "
+                                    "WHERE day > 0 AND kind = 'subscriptions'").fetchall()
+
+    # Одним проходом по таблице, мимо кэша: горячие пользователи в нём не вытесняются
+    def scan(self, batch: int = 10000):
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT user_id, entry_id, kind, name, amount, yearly, day FROM entries ORDER BY user_id, id")
+            rows = cursor.fetchmany(batch)
+        current_id, record = None, None
+        while rows:
+            for user_id, entry_id, kind, name, amount, yearly, day in rows:
+                if user_id != current_id:
+                    if record is not None:
+                        record.rebuild_totals()
+                        yield current_id, record
+                    current_id, record = user_id, Ledger()
+                record.add(kind, name, amount, yearly, day, entry_id)
+            with self._lock:
+                rows = cursor.fetchmany(batch)
+        if record is not None:
+            record.rebuild_totals()
+            yield current_id, record
+
+    def close(self):
+        if self._commits:
+            self._commits.close()
+            self._commits = None
+        with self._lock:
+            if self._db:
+                if self._in_transaction:
+                    self._db.execute("COMMIT")
+                    self._in_transaction = False
+                self._db.close()
+                self._db = None
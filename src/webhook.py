@@ -0,0 +1,120 @@
+import json
+import hmac
+import queue
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot.types import Update
+
+log = logging.getLogger("moneysaver")
+
+_STOP = object()  # сигнал потокам-обработчикам завершиться; из запроса его не получить
+
+
+# Приём обновлений по вебхуку: HTTP-сервер кладёт обновления в ограниченную очередь,
+# а workers потоков передают их боту (в main.py — один поток, который раскладывает их по полосам).
+# Очередь полна — отвечаем 503, и Telegram сам повторит запрос позже.
+class WebhookServer:
+    def __init__(self, bot, host: str = "0.0.0.0", port: int = 8080, path: str = "/telegram",
+                 secret: str = None, queue_size: int = 1000, workers: int = 4):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+        self._threads = []
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/healthz":
+                    self._reply(404, {"ok": False})
+                    return
+                self._reply(200, {"ok": True, "queue": server.updates.qsize(),
+                                  "queue_size": server.updates.maxsize})
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404, {"ok": False})
+                    return
+                if server.secret:
+                    token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+                    if not hmac.compare_digest(token, server.secret):
+                        self._reply(403, {"ok": False})
+                        return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length))
+                    # null, число, список — не обновление (de_json(None) вернул бы None)
+                    if not isinstance(body, dict):
+                        raise ValueError("обновление — не объект")
+                    update = Update.de_json(body)
+                except (ValueError, KeyError, TypeError):
+                    self._reply(400, {"ok": False})
+                    return
+                try:
+                    server.updates.put_nowait(update)
+                except queue.Full:
+                    self._reply(503, {"ok": False})
+                    return
+                self._reply(200, {"ok": True})
+
+            def _reply(self, code: int, body: dict):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                log.debug("webhook: " + format, *args)
+
+        return Handler
+
+    def _work(self):
+        while True:
+            update = self.updates.get()
+            if update is _STOP:
+                break
+            try:
+                self.bot.process_new_updates([update])
+            except Exception:
+                log.exception("Ошибка обработки обновления %s", update.update_id)
+            finally:
+                self.updates.task_done()
+
+    def _start_workers(self):
+        # Обработчики выполняются прямо в наших потоках, иначе TeleBot
+        # переложил бы их в свою неограниченную очередь и противодавление пропало бы
+        self.bot.threaded = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Сервер в фоновом потоке — для локальной проверки и тестов
+    def start(self):
+        self._start_workers()
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True).start()
+
+    def run(self):
+        self._start_workers()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        # Дорабатываем то, что уже приняли
+        for _ in self._threads:
+            self.updates.put(_STOP)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+# test_main.py — первая версия бота, а не тесты: при импорте требует токен и создаёт TeleBot
+collect_ignore = ["test_main.py"]
@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Стресс-проверка из bench/concurrency.py в уменьшенном виде; bench — в конце пути,
+# чтобы bench/charts.py не закрыл src/charts.py
+sys.path.append(str(Path(__file__).parent.parent / 'bench'))
+
+import concurrency  # noqa: E402
+from fake_api import FakeBotApi  # noqa: E402
+from telebot import apihelper  # noqa: E402
+
+
+@pytest.fixture
+def fake_api():
+    api = FakeBotApi().start()
+    api_url, apihelper.API_URL = apihelper.API_URL, api.api_url
+    threaded, concurrency.bot_main.bot.threaded = concurrency.bot_main.bot.threaded, False
+    yield api
+    apihelper.API_URL = api_url
+    concurrency.bot_main.bot.threaded = threaded
+    api.stop()
+
+
+# Добавления, удаления по кнопке, пакетный импорт и баланс через полосы, параллельно со снимками
+# журнала и /stats: у каждого пользователя — те же записи, что при строго последовательной обработке
+@pytest.mark.parametrize("workers", [1, 4])
+def test_lanes_keep_per_user_order(fake_api, workers):
+    updates, model = concurrency.make_updates(users=30, count=800, seed=workers)
+    result = concurrency.run(SimpleNamespace(compact_min_bytes=4096), workers, updates, model)
+    assert result["errors"] == []
+    assert result["snapshots"] > 0
+    assert fake_api.calls["sendMessage"] > 0
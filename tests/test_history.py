@@ -0,0 +1,199 @@
+from array import array
+from datetime import date, datetime, time
+
+import pytest
+
+from history import RECORD, History, downsample
+from ledger import Ledger
+from sharding import HashRing, read_layout, rebalance, write_layout
+from storage import KINDS, JsonStorage
+
+START = date(2024, 1, 1).toordinal()
+
+
+class Clock:
+    def __init__(self, day: int = START):
+        self.day = day
+
+    def __call__(self) -> float:
+        return datetime.combine(date.fromordinal(self.day), time(12)).timestamp()
+
+
+def totals(expenses: float, incomes: float = 0.0) -> dict:
+    return {"expenses": expenses, "incomes": incomes, "balance": incomes - expenses}
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def open_history(path, clock, daily_days: int = 30, **kwargs) -> History:
+    history = History(path / 'history.db', daily_days, clock=clock, **kwargs)
+    history.load()
+    return history
+
+
+# Прореживание
+
+def test_downsample():
+    days = array("i", [START, START + 10, START + 40, START + 45, START + 59, START + 60, START + 61])
+    expenses = array("d", range(len(days)))
+    kept, kept_expenses, _ = downsample(days, expenses, array("d", expenses), START + 59)
+    # Январь и февраль до cutoff — по последней точке месяца; с cutoff — все
+    assert [day - START for day in kept] == [10, 45, 59, 60, 61]
+    assert list(kept_expenses) == [1.0, 3.0, 4.0, 5.0, 6.0]
+    assert downsample(days, expenses, expenses, START)[0] is days  # нечего прореживать
+
+
+def test_last_change_of_day_wins(tmp_path, clock):
+    history = open_history(tmp_path, clock)
+    history.record("1", totals(100.0))
+    history.record("1", totals(150.0, 10.0))
+    clock.day += 1
+    history.record("1", totals(200.0))
+    days, expenses, incomes = history.series("1")
+    assert list(days) == [START, START + 1]
+    assert list(expenses) == [150.0, 200.0] and list(incomes) == [10.0, 0.0]
+    assert len(history.series("2")[0]) == 0
+    history.close()
+
+
+def test_prune_on_close(tmp_path, clock):
+    history = open_history(tmp_path, clock)
+    for i in range(120):
+        history.record("1", totals(float(i)))
+        history.record("2", totals(float(i) * 2))
+        clock.day += 1
+    expected = downsample(*history.series("1"), history.today() - 30)
+    history.close()
+
+    history = open_history(tmp_path, clock)
+    days, expenses, _ = history.series("1")
+    assert (days, expenses) == expected[:2]
+    # До cutoff — последняя точка каждого месяца, после — каждый день
+    cutoff = history.today() - 30
+    old = [day for day in days if day < cutoff]
+    assert [date.fromordinal(day) for day in old] == \
+        [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 30)]
+    assert list(days[len(old):]) == list(range(cutoff, START + 120))
+    assert list(history.series("2")[1]) == [value * 2 for value in expenses]
+    history.close()
+
+
+def test_points_extend_to_today(tmp_path, clock):
+    history = open_history(tmp_path, clock)
+    history.record("1", totals(100.0))
+    clock.day += 5
+    days, expenses, _ = history.points("1", totals(300.0))
+    assert days == [START, START + 5] and expenses == [100.0, 300.0]
+    # Без истории — одна точка с текущими итогами
+    assert history.points("2", totals(50.0)) == ([START + 5], [50.0], [0.0])
+    history.close()
+
+
+def test_import_bin(tmp_path, clock):
+    with open(tmp_path / 'history.bin', 'wb') as f:
+        for user_id, day, expenses in [(1, START, 10.0), (1, START, 20.0), (2, START + 1, 5.0), (1, START + 2, 30.0)]:
+            f.write(RECORD.pack(user_id, day, expenses, 0.0))
+        f.write(RECORD.pack(3, START, 1.0, 0.0)[:10])  # оборванная запись при падении
+    history = open_history(tmp_path, clock, import_from=tmp_path / 'history.bin')
+    assert list(history.series("1")[1]) == [20.0, 30.0]
+    assert list(history.series("2")[0]) == [START + 1]
+    assert len(history.series("3")[0]) == 0
+    history.close()
+
+
+# Переезд между шардами
+
+USERS = [str(100 + i) for i in range(40)]
+
+
+def shard_path_in(root):
+    def shard_path(shards: int, shard: int):
+        if shards == 0:
+            return root / 'data.json'
+        return root / 'shards' / f"shard-{shard}" / 'data.json'
+    return shard_path
+
+
+# Как open_storage в main: каталог шарда создаётся при первом открытии
+def open_storage(path) -> JsonStorage:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return JsonStorage(path)
+
+
+def layout_contents(root, shards: int, clock) -> dict:
+    shard_path = shard_path_in(root)
+    contents = {}
+    for shard in range(max(shards, 1)):
+        storage = JsonStorage(shard_path(shards, shard))
+        storage.load()
+        history = History(shard_path(shards, shard).with_name('history.db'), clock=clock)
+        history.load()
+        for user_id in storage.user_ids():
+            if not any(storage.user(user_id).entries(kind) for kind in KINDS):
+                continue  # после переезда в старом шарде остаётся пустой пользователь
+            assert user_id not in contents, "пользователь в двух шардах"
+            if shards:
+                assert HashRing(shards).shard_for(user_id) == shard
+            contents[user_id] = (storage.user(user_id).to_json(), [list(column) for column in history.series(user_id)])
+        storage.close()
+        history.close()
+    return contents
+
+
+@pytest.fixture
+def single(tmp_path, clock):
+    storage = JsonStorage(tmp_path / 'data.json')
+    storage.load()
+    history = open_history(tmp_path, clock, daily_days=90)
+    for i, user_id in enumerate(USERS):
+        storage.add(user_id, "subscriptions", f"Подписка {i}", float(i + 1), day=i % 28 + 1)
+        history.record(user_id, storage.user(user_id).totals)
+        clock.day += 1
+        storage.add(user_id, "incomes", "Зарплата", 1000.0)
+        storage.delete(user_id, "subscriptions", storage.user(user_id).subscriptions.ids[0])
+        history.record(user_id, storage.user(user_id).totals)
+    storage.close()
+    history.close()
+    return tmp_path
+
+
+def test_rebalance_moves_users_with_history(single, clock):
+    before = layout_contents(single, 0, clock)
+    assert len(before) == len(USERS) and all(len(series[0]) == 2 for _, series in before.values())
+
+    def open_shard_history(path):
+        return History(path.with_name('history.db'), clock=clock)
+
+    meta = single / 'shards' / 'shards.json'
+    for shards in (3, 5, 2, 0):
+        moved = rebalance(meta, shards, shard_path_in(single), open_storage, open_shard_history)
+        assert 0 < moved <= len(USERS)
+        assert read_layout(meta) == {"shards": shards}
+        # Те же записи с теми же id и next_id, та же история — кнопки и графики работают после переезда
+        assert layout_contents(single, shards, clock) == before
+    assert rebalance(meta, 0, shard_path_in(single), open_storage, open_shard_history) == 0
+
+
+def test_rebalance_resumes_cleanup(single, clock):
+    before = layout_contents(single, 0, clock)
+    meta = single / 'shards' / 'shards.json'
+    shard_path = shard_path_in(single)
+
+    def open_shard_history(path):
+        return History(path.with_name('history.db'), clock=clock)
+
+    # Перенос прервался после копирования: пользователи есть и в старом файле, и в новых шардах
+    rebalance(meta, 3, shard_path, open_storage, open_shard_history)
+    old = JsonStorage(shard_path(0, 0))
+    old.load()
+    for user_id, (data, _) in before.items():
+        old.put_user(user_id, Ledger.from_json(data))
+    old.close()
+    write_layout(meta, {"shards": 3, "cleanup_from": 0})
+
+    assert rebalance(meta, 3, shard_path, open_storage, open_shard_history) == 0
+    assert read_layout(meta) == {"shards": 3}
+    assert layout_contents(single, 3, clock) == before
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from ledger import Entry, Ledger
+from storage import JsonStorage, apply_op
+
+
+def round_trip(ledger: Ledger) -> Ledger:
+    return Ledger.from_json(json.loads(json.dumps(ledger.to_json(), ensure_ascii=False)))
+
+
+def test_round_trip():
+    ledger = Ledger()
+    ledger.add("subscriptions", "Кинопоиск", 499.0, day=15)
+    ledger.add("subscriptions", "Метро", 1708.33, yearly=True)
+    ledger.add("incomes", "Зарплата", 80000.0)
+    ledger.remove("subscriptions", 0)
+    data = ledger.to_json()
+    assert data == {
+        "subscriptions": [{"name": "Метро", "amount": 1708.33, "id": 1, "yearly": True}],
+        "incomes": [{"name": "Зарплата", "amount": 80000.0, "id": 2}],
+        "totals": {"expenses": 1708.33, "incomes": 80000.0, "balance": 78291.67},
+        "next_id": 3,
+    }
+    assert round_trip(ledger).to_json() == data
+    # id удалённой записи не выдаётся повторно
+    assert round_trip(ledger).add("subscriptions", "IVI", 399.0).id == 3
+
+
+# Самый старый формат: пользователь — просто список подписок без id и итогов
+def test_legacy_list():
+    ledger = Ledger.from_json([{"name": "Яндекс Плюс", "amount": 299}, {"name": "IVI", "amount": 399.0}])
+    assert list(ledger.subscriptions) == [Entry(0, "Яндекс Плюс", 299.0), Entry(1, "IVI", 399.0)]
+    assert len(ledger.incomes) == 0
+    assert ledger.totals == {"expenses": 698.0, "incomes": 0.0, "balance": -698.0}
+    assert ledger.next_id == 2
+
+
+def test_legacy_dict_without_ids_and_totals():
+    ledger = Ledger.from_json({
+        "subscriptions": [{"name": "A", "amount": 10.0, "id": 4}, {"name": "B", "amount": 20.0}],
+        "incomes": [{"name": "C", "amount": 100.0}],
+    })
+    # Записи без id получают id по порядку после наибольшего
+    assert [e.id for e in ledger.subscriptions] == [4, 5]
+    assert [e.id for e in ledger.incomes] == [6]
+    assert ledger.next_id == 7
+    assert ledger.check_totals() and ledger.totals["balance"] == 70.0
+
+
+@pytest.mark.parametrize("data", [None, {}, [], "мусор"])
+def test_legacy_empty(data):
+    ledger = Ledger.from_json(data)
+    assert ledger.to_json() == {"subscriptions": [], "incomes": [], "next_id": 0,
+                                "totals": {"expenses": 0.0, "incomes": 0.0, "balance": 0.0}}
+
+
+def test_next_id_kept_when_larger():
+    ledger = Ledger.from_json({"subscriptions": [{"name": "A", "amount": 1.0, "id": 0}], "next_id": 10})
+    assert ledger.add("incomes", "B", 1.0).id == 10
+
+
+def test_empty_lists_are_shared_until_written():
+    first, second = Ledger(), Ledger()
+    assert first.incomes is second.incomes
+    first.add("incomes", "A", 1.0)
+    assert len(second.incomes) == 0
+    copy = first.copy()
+    copy.add("incomes", "B", 2.0)
+    assert [e.name for e in first.incomes] == ["A"]
+
+
+def test_names_are_interned():
+    first, second = Ledger(), Ledger()
+    first.add("subscriptions", "".join(["Кино", "поиск"]), 1.0)
+    second.add("subscriptions", "".join(["Кино", "поиск"]), 1.0)
+    assert first.subscriptions.names[0] is second.subscriptions.names[0]
+
+
+# Старый формат журнала: удаление по позиции
+def test_legacy_delete_by_position():
+    data = {}
+    apply_op(data, {"op": "add_many", "user": "1", "items": [["subscriptions", "A", 1.0], ["subscriptions", "B", 2.0]]})
+    assert apply_op(data, {"op": "del", "user": "1", "kind": "subscriptions", "idx": 0}).name == "A"
+    assert apply_op(data, {"op": "del", "user": "1", "kind": "subscriptions", "idx": 5}) is None
+    assert [e.name for e in data["1"].subscriptions] == ["B"]
+
+
+def test_legacy_data_json_loads(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({
+        "1": [{"name": "Яндекс Плюс", "amount": 299}],
+        "2": {"subscriptions": [{"name": "A", "amount": 10.0}], "incomes": [{"name": "B", "amount": 50.0}],
+              "totals": {"expenses": 999.0, "incomes": 0.0, "balance": -999.0}},
+    }, ensure_ascii=False), encoding='utf-8')
+    storage = JsonStorage(path)
+    storage.load()
+    assert storage.user("1").totals["expenses"] == 299.0
+    # Сохранённые итоги при загрузке пересчитываются по записям
+    assert storage.user("2").totals == {"expenses": 10.0, "incomes": 50.0, "balance": 40.0}
+    assert storage.check_consistency() == []
+    storage.close()
+    reopened = JsonStorage(path)
+    reopened.load()
+    assert reopened.user("2").to_json()["incomes"] == [{"name": "B", "amount": 50.0, "id": 1}]
+    reopened.close()
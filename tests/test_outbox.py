@@ -0,0 +1,245 @@
+import time
+from http.client import RemoteDisconnected
+
+import pytest
+import requests
+from telebot.apihelper import ApiTelegramException
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from outbox import MAX_TEXT, Outbox, TokenBucket
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeBot:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def _call(self, kwargs):
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        return kwargs["text"]
+
+    def send_message(self, **kwargs):
+        return self._call(kwargs)
+
+    def edit_message_text(self, **kwargs):
+        return self._call(kwargs)
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "не дождались"
+        time.sleep(0.001)
+
+
+# Часы outbox не идут сами: сдвигаем и будим поток отправки
+def advance(outbox: Outbox, clock: Clock, seconds: float):
+    clock.now += seconds
+    with outbox._cond:
+        outbox._cond.notify()
+
+
+def too_many_requests(retry_after: int) -> ApiTelegramException:
+    return ApiTelegramException("sendMessage", None, {
+        "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+        "parameters": {"retry_after": retry_after}})
+
+
+def refused() -> requests.exceptions.ConnectionError:
+    reason = NewConnectionError(None, "Failed to establish a new connection: [Errno 111] Connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/sendMessage", reason))
+
+
+def aborted() -> requests.exceptions.ConnectionError:
+    return requests.exceptions.ConnectionError(ProtocolError("Connection aborted.", RemoteDisconnected()))
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_retry_when_connection_not_established(clock):
+    bot = FakeBot(refused())
+    outbox = Outbox(bot, coalesce_ms=0, clock=clock)
+    future = outbox.send_message(1, "привет")
+    wait_for(lambda: outbox.retries == 1)
+    advance(outbox, clock, 1)
+    assert future.result(timeout=2) == "привет"
+    assert len(bot.calls) == 2
+    outbox.close()
+
+
+def test_no_retry_after_request_was_sent(clock):
+    # Соединение оборвалось после отправки: сообщение могло дойти, повтор его бы продублировал
+    bot = FakeBot(aborted())
+    outbox = Outbox(bot, coalesce_ms=0, clock=clock)
+    future = outbox.send_message(1, "привет")
+    with pytest.raises(requests.exceptions.ConnectionError):
+        future.result(timeout=2)
+    assert len(bot.calls) == 1
+    assert outbox.retries == 0 and outbox.failed == 1
+    outbox.close()
+
+
+def test_enqueue_after_close(clock):
+    outbox = Outbox(FakeBot(), coalesce_ms=0, clock=clock)
+    outbox.send_message(1, "раз").result(timeout=2)
+    outbox.close()
+    with pytest.raises(RuntimeError):
+        outbox.send_message(1, "два")
+    never_started = Outbox(FakeBot(), clock=clock)
+    never_started.close()
+    with pytest.raises(RuntimeError):
+        never_started.edit_message_text(1, 10, "три")
+
+
+# Лимиты
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, capacity=3, now=0.0)
+    for _ in range(3):
+        assert bucket.delay(0.0) == 0.0
+        bucket.take(0.0)
+    assert bucket.delay(0.0) == 1.0
+    assert bucket.delay(0.5) == 0.5
+    assert not bucket.full(1.0)
+    assert bucket.full(3.0)
+    bucket.take(100.0)
+    assert bucket.tokens == 2  # копится не больше capacity
+
+
+def test_chat_rate_limit(clock):
+    sent = []
+    outbox = Outbox(FakeBot(), global_rate=100, chat_rate=1, chat_burst=2, coalesce_ms=0, clock=clock)
+    futures = [outbox.call(1, sent.append, i) for i in range(3)]
+    other = outbox.call(2, sent.append, "чат 2")
+    other.result(timeout=2)
+    futures[1].result(timeout=2)
+    # Третье в тот же чат — только когда набежит токен; другой чат не ждёт
+    time.sleep(0.05)
+    assert sent.count(2) == 0
+    advance(outbox, clock, 1)
+    futures[2].result(timeout=2)
+    assert [item for item in sent if item != "чат 2"] == [0, 1, 2]
+    outbox.close()
+
+
+def test_global_rate_limit(clock):
+    sent = []
+    outbox = Outbox(FakeBot(), global_rate=2, chat_rate=100, chat_burst=100, coalesce_ms=0, clock=clock)
+    futures = [outbox.call(chat_id, sent.append, chat_id) for chat_id in range(3)]
+    futures[0].result(timeout=2)
+    futures[1].result(timeout=2)
+    time.sleep(0.05)
+    assert not futures[2].done()
+    advance(outbox, clock, 0.5)
+    futures[2].result(timeout=2)
+    assert sorted(sent) == [0, 1, 2]
+    outbox.close()
+
+
+# Склейка и замена правок
+
+def test_coalescing(clock):
+    bot = FakeBot()
+    outbox = Outbox(bot, coalesce_ms=50, clock=clock)
+    first = outbox.send_message(1, "✅ Добавлено", reply_to_message_id=5)
+    second = outbox.send_message(1, "📊 Баланс")
+    other = outbox.send_message(2, "привет")
+    time.sleep(0.05)
+    assert bot.calls == []  # окно склейки ещё не прошло
+    advance(outbox, clock, 0.05)
+    assert first.result(timeout=2) == second.result(timeout=2) == "✅ Добавлено\n\n📊 Баланс"
+    other.result(timeout=2)
+    merged = next(call for call in bot.calls if call["chat_id"] == 1)
+    assert merged["reply_to_message_id"] == 5
+    assert len(bot.calls) == 2 and outbox.merged == 1
+    outbox.close()
+
+
+def test_no_coalescing_past_keyboard_or_length(clock):
+    bot = FakeBot()
+    outbox = Outbox(bot, coalesce_ms=50, clock=clock)
+    outbox.send_message(1, "список", reply_markup="кнопки")
+    outbox.send_message(1, "а" * (MAX_TEXT - 10))
+    last = outbox.send_message(1, "б" * 20)
+    advance(outbox, clock, 0.05)
+    last.result(timeout=2)
+    assert [len(call["text"]) for call in bot.calls] == [len("список"), MAX_TEXT - 10, 20]
+    assert outbox.merged == 0
+    outbox.close()
+
+
+def test_edit_supersedes_pending_edit(clock):
+    bot = FakeBot()
+    outbox = Outbox(bot, coalesce_ms=50, clock=clock)
+    old = outbox.edit_message_text(1, 10, "стр. 1")
+    other_message = outbox.edit_message_text(1, 11, "другое")
+    new = outbox.edit_message_text(1, 10, "стр. 2")
+    advance(outbox, clock, 0.05)
+    assert old.result(timeout=2) == new.result(timeout=2) == "стр. 2"
+    advance(outbox, clock, 1)
+    other_message.result(timeout=2)
+    assert [(call["message_id"], call["text"]) for call in bot.calls] == [(10, "стр. 2"), (11, "другое")]
+    assert outbox.superseded == 1
+    outbox.close()
+
+
+def test_not_modified_is_not_an_error(clock):
+    error = ApiTelegramException("editMessageText", None, {
+        "error_code": 400, "description": "Bad Request: message is not modified"})
+    outbox = Outbox(FakeBot(error), coalesce_ms=0, clock=clock)
+    assert outbox.edit_message_text(1, 10, "то же самое").result(timeout=2) is None
+    assert outbox.failed == 0
+    outbox.close()
+
+
+# 429
+
+def test_retry_after(clock):
+    bot = FakeBot(too_many_requests(7))
+    outbox = Outbox(bot, coalesce_ms=0, clock=clock)
+    blocked = outbox.send_message(1, "раз")
+    wait_for(lambda: outbox.retries == 1)
+    # Другой чат не ждёт
+    assert outbox.send_message(2, "два").result(timeout=2) == "два"
+    advance(outbox, clock, 6.9)
+    time.sleep(0.05)
+    assert not blocked.done()
+    advance(outbox, clock, 0.2)
+    assert blocked.result(timeout=2) == "раз"
+    assert [call["text"] for call in bot.calls] == ["раз", "два", "раз"]
+    outbox.close()
+
+
+def test_retry_after_gives_up(clock):
+    bot = FakeBot(*[too_many_requests(1) for _ in range(3)])
+    outbox = Outbox(bot, coalesce_ms=0, max_retries=2, clock=clock)
+    future = outbox.send_message(1, "раз")
+    for attempt in (1, 2):
+        wait_for(lambda: outbox.retries == attempt)
+        advance(outbox, clock, 1)
+    with pytest.raises(RuntimeError):
+        future.result(timeout=2)
+    assert len(bot.calls) == 3 and outbox.failed == 1
+    outbox.close()
+
+
+def test_close_sends_without_waiting_for_coalescing(clock):
+    bot = FakeBot()
+    outbox = Outbox(bot, coalesce_ms=50, clock=clock)
+    future = outbox.send_message(1, "последнее")
+    outbox.close()
+    assert future.result(timeout=0) == "последнее"
+
@@ -0,0 +1,79 @@
+import pytest
+
+import main
+from routing import unpack_callback
+from storage import JsonStorage
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = JsonStorage(tmp_path / 'data.json')
+    storage.load()
+    monkeypatch.setattr(main, "storage", storage)
+    monkeypatch.setattr(main, "LIST_PAGE_SIZE", 10)
+    yield storage
+    storage.close()
+
+
+def buttons(markup) -> list:
+    return [unpack_callback(button.callback_data) for row in markup.keyboard for button in row]
+
+
+@pytest.mark.parametrize("count, page, expected_page, pages, visible", [
+    (0, 0, 0, 1, 0),
+    (1, 0, 0, 1, 1),
+    (10, 0, 0, 1, 10),
+    (11, 0, 0, 2, 10),
+    (11, 1, 1, 2, 1),
+    (20, 1, 1, 2, 10),
+    (21, 2, 2, 3, 1),
+    # Страница из старой кнопки, а записей с тех пор стало меньше, — последняя из оставшихся
+    (11, 5, 1, 2, 1),
+    (11, -1, 0, 2, 10),
+])
+def test_page_slice(storage, count, page, expected_page, pages, visible):
+    storage.add_many("1", [("subscriptions", f"Подписка {i}", 1.0) for i in range(count)])
+    items, actual_page, actual_pages = main.page_slice(storage.user("1").subscriptions, page)
+    assert (actual_page, actual_pages, len(items)) == (expected_page, pages, visible)
+
+
+@pytest.mark.parametrize("page, pages, expected", [
+    (0, 1, []),
+    (0, 3, [("p", ["s", "1"])]),
+    (1, 3, [("p", ["s", "0"]), ("p", ["s", "2"])]),
+    (2, 3, [("p", ["s", "1"])]),
+])
+def test_page_buttons(page, pages, expected):
+    assert [unpack_callback(button.callback_data) for button in main.page_buttons("s", page, pages)] == expected
+
+
+def test_short_id():
+    for entry_id in (0, 9, 10, 35, 36, 1295, 1296, 10 ** 9):
+        assert int(main.short_id(entry_id), 36) == entry_id
+
+
+def test_expenses_view_pages(storage):
+    storage.add_many("1", [("subscriptions", f"Подписка {i}", float(i + 1)) for i in range(25)])
+    for entry_id in (0, 1):
+        storage.delete("1", "subscriptions", entry_id)  # id не совпадают с позициями
+
+    text, markup = main.expenses_view("1", 2)
+    assert "стр. 3/3" in text
+    assert "Подписка 22" in text and "Подписка 21" not in text
+    assert "Итого расходов: 322.00 ₽" in text  # итог — по всем записям, не по странице
+    assert buttons(markup) == [("d", ["s", main.short_id(entry_id), "2"]) for entry_id in (22, 23, 24)] + \
+        [("p", ["s", "1"])]
+
+    text, markup = main.expenses_view("1", 0)
+    assert "стр. 1/3" in text
+    assert buttons(markup)[0] == ("d", ["s", main.short_id(2), "0"])
+    assert buttons(markup)[-1] == ("p", ["s", "1"])
+
+
+def test_short_list_has_no_pages(storage):
+    storage.add("1", "incomes", "Зарплата", 80000.0)
+    text, markup = main.incomes_view("1", 3)
+    assert "стр." not in text
+    assert buttons(markup) == [("d", ["i", "0", "0"])]
+    text, markup = main.incomes_view("2")
+    assert markup is None and "нет доходов" in text
@@ -0,0 +1,123 @@
+import io
+
+import pytest
+
+from parsing import AMOUNT_ERROR, AMOUNT_LIMIT_ERROR, DAY_ERROR, FORMAT_ERROR, EntryError, parse_entry, \
+    iter_csv_lines, iter_json_lines
+
+
+def csv_lines(text: str, encoding: str = 'utf-8') -> list:
+    return list(iter_csv_lines(io.BytesIO(text.encode(encoding))))
+
+
+def json_lines(text: str) -> list:
+    return list(iter_json_lines(io.BytesIO(text.encode('utf-8'))))
+
+
+# Строка сообщения
+
+@pytest.mark.parametrize("line, expected", [
+    ("Яндекс Плюс 299", ("subscriptions", "Яндекс Плюс", 299.0, False, 0)),
+    ("Яндекс Плюс 299,90", ("subscriptions", "Яндекс Плюс", 299.9, False, 0)),
+    ("IVI .5", ("subscriptions", "IVI", 0.5, False, 0)),
+    ("Метро 20500/год", ("subscriptions", "Метро", 1708.33, True, 0)),
+    ("Метро 20500/Y", ("subscriptions", "Метро", 1708.33, True, 0)),
+    ("Связь 300/мес", ("subscriptions", "Связь", 300.0, False, 0)),
+    ("Кинопоиск 499 @15", ("subscriptions", "Кинопоиск", 499.0, False, 15)),
+    ("Кинопоиск 499 @31", ("subscriptions", "Кинопоиск", 499.0, False, 31)),
+    ("+ Зарплата 80000", ("incomes", "Зарплата", 80000.0, False, 0)),
+    ("+Стипендия 60000/год", ("incomes", "Стипендия", 5000.0, True, 0)),
+    ("Доход Мама 400", ("incomes", "Мама", 400.0, False, 0)),
+])
+def test_parse_entry(line, expected):
+    assert parse_entry(line)[:5] == expected
+
+
+def test_parse_entry_extra_info():
+    assert parse_entry("Метро 20500/год")[5] == " (из годовой 20500.00 ₽)"
+    assert parse_entry("Кинопоиск 499 @15")[5] == ", списание 15-го числа"
+
+
+@pytest.mark.parametrize("line, error", [
+    ("Кинопоиск", FORMAT_ERROR),
+    ("Кинопоиск @15", FORMAT_ERROR),
+    ("Кинопоиск -499", AMOUNT_ERROR),
+    ("Кинопоиск 0", AMOUNT_ERROR),
+    ("Кинопоиск 0.001", AMOUNT_ERROR),
+    ("Кинопоиск 1e3", AMOUNT_ERROR),
+    ("Кинопоиск inf", AMOUNT_ERROR),
+    ("Кинопоиск nan", AMOUNT_ERROR),
+    ("Кинопоиск 499/неделя", AMOUNT_ERROR),
+    ("Кинопоиск 1000000001", AMOUNT_LIMIT_ERROR),
+    ("Кинопоиск " + "9" * 400, AMOUNT_LIMIT_ERROR),
+    ("Кинопоиск 499 @0", DAY_ERROR),
+    ("Кинопоиск 499 @32", DAY_ERROR),
+    ("Кинопоиск 499 @завтра", DAY_ERROR),
+    ("Метро 20500/год @15", DAY_ERROR),
+    ("+ Зарплата 80000 @5", DAY_ERROR),
+])
+def test_parse_entry_errors(line, error):
+    with pytest.raises(EntryError) as e:
+        parse_entry(line)
+    assert str(e.value) == error
+
+
+# Пакетный импорт: CSV
+
+@pytest.mark.parametrize("delimiter", [";", ",", "\t"])
+def test_csv_header_is_skipped(delimiter):
+    text = delimiter.join(["Название", "Стоимость", "Тип"]) + "\n" + delimiter.join(["Кинопоиск", "499", ""]) + "\n"
+    assert csv_lines(text) == [(2, "Кинопоиск 499")]
+
+
+def test_csv_without_header():
+    text = "Кинопоиск;499\nЗарплата;80000;доход\nМетро;20500/год\nIVI;399;расход;15\n"
+    assert csv_lines(text) == [
+        (1, "Кинопоиск 499"),
+        (2, "+ Зарплата 80000"),
+        (3, "Метро 20500/год"),
+        (4, "IVI 399 @15"),
+    ]
+
+
+def test_csv_excel_bom_and_blank_rows():
+    text = "Название;Стоимость\r\n\r\nЯндекс Плюс;299,90\r\n;\r\n"
+    assert csv_lines(text, 'utf-8-sig') == [(3, "Яндекс Плюс 299,90")]
+
+
+def test_csv_short_row_goes_to_parser_as_is():
+    # Строка без разделителя — как строка сообщения: ошибку покажет parse_entry с её номером
+    assert csv_lines("Кинопоиск;499\nпросто текст\n") == [(1, "Кинопоиск 499"), (2, "просто текст")]
+
+
+# Пакетный импорт: JSON
+
+def test_json_array():
+    text = """
+    [{"name": "Кинопоиск", "amount": 499, "day": 15},
+     {"name": "Зарплата", "amount": "80000", "type": "доход"},
+     {"name": "Стипендия", "amount": 5000, "income": true},
+     {"name": "Метро", "amount": "20500/год"},
+     "Мусор"]
+    """
+    assert json_lines(text) == [
+        (1, "Кинопоиск 499 @15"),
+        (2, "+ Зарплата 80000"),
+        (3, "+ Стипендия 5000"),
+        (4, "Метро 20500/год"),
+        (5, "Мусор"),
+    ]
+
+
+def test_json_lines_with_broken_line():
+    text = '{"name": "Кинопоиск", "amount": 499}\n\n{"name": "IVI", "amount": \n{"name": "Плюс", "amount": 299}\n'
+    assert json_lines(text) == [
+        (1, "Кинопоиск 499"),
+        (3, '{"name": "IVI", "amount":'),
+        (4, "Плюс 299"),
+    ]
+
+
+def test_broken_json_array():
+    with pytest.raises(ValueError):
+        json_lines('[{"name": "Кинопоиск", "amount": 499},')
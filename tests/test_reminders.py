@@ -0,0 +1,123 @@
+from datetime import date, datetime
+
+import pytest
+
+from reminders import Reminders, next_due
+from storage import JsonStorage
+
+
+def at(year: int, month: int, day: int, hour: int = 0) -> float:
+    return datetime(year, month, day, hour).timestamp()
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = JsonStorage(tmp_path / 'data.json')
+    storage.load()
+    yield storage
+    storage.close()
+
+
+def start(tmp_path, storage, clock, **kwargs):
+    sent = []
+    reminders = Reminders(tmp_path / 'reminders.json', lambda user_id, due: sent.append((user_id, due)),
+                          days_before=1, hour=10, clock=clock, **kwargs)
+    reminders.track(storage)
+    return reminders, sent
+
+
+def test_next_due():
+    # За день до списания в 10:00; уже прошло — в следующем месяце
+    assert next_due(15, at(2025, 1, 1), 1, 10) == at(2025, 1, 14, 10)
+    assert next_due(15, at(2025, 1, 14, 11), 1, 10) == at(2025, 2, 14, 10)
+    # 31-е в коротком месяце — последний день месяца
+    assert next_due(31, at(2025, 2, 1), 1, 10) == at(2025, 2, 27, 10)
+    assert next_due(31, at(2024, 2, 1), 1, 10) == at(2024, 2, 28, 10)
+    # Списание 1-го: напоминание в последний день прошлого месяца, через год
+    assert next_due(1, at(2025, 12, 5), 1, 10) == at(2025, 12, 31, 10)
+
+
+def test_reminder_sent_when_due(tmp_path, storage):
+    clock = Clock(at(2025, 1, 1))
+    storage.add("1", "subscriptions", "Кинопоиск", 499.0, day=15)
+    storage.add("1", "subscriptions", "Без дня", 100.0)
+    reminders, sent = start(tmp_path, storage, clock)
+    assert reminders.pending() == 1
+
+    clock.now = at(2025, 1, 14, 9)
+    assert reminders.tick() == 0
+    clock.now = at(2025, 1, 14, 10)
+    assert reminders.tick() == 1
+    (user_id, due), = sent
+    assert user_id == "1"
+    assert [(entry.name, billing) for entry, billing in due] == [("Кинопоиск", date(2025, 1, 15))]
+    # Следующее — через месяц, не раньше
+    assert reminders.tick() == 0
+    assert reminders._wait_time(0) == 60.0
+    clock.now = at(2025, 2, 14, 10)
+    assert reminders.tick() == 1
+    assert len(sent) == 2
+
+
+def test_restart_does_not_repeat(tmp_path, storage):
+    clock = Clock(at(2025, 1, 1))
+    storage.add("1", "subscriptions", "A", 1.0, day=15)
+    storage.add("2", "subscriptions", "B", 1.0, day=20)
+    reminders, sent = start(tmp_path, storage, clock)
+    clock.now = at(2025, 1, 14, 12)
+    assert reminders.tick() == 1
+
+    # Перезапуск после отправки: отправленное не повторяется, следующее приходит в срок
+    clock.now = at(2025, 1, 15)
+    restarted, sent_again = start(tmp_path, storage, clock)
+    assert restarted.tick() == 0
+    clock.now = at(2025, 1, 19, 10)
+    assert restarted.tick() == 1
+    assert [user_id for user_id, _ in sent_again] == ["2"]
+
+
+def test_missed_beyond_grace_is_skipped(tmp_path, storage):
+    storage.add("1", "subscriptions", "A", 1.0, day=15)
+    # Бот лежал с 1 по 20 января: напоминание 14-го старше суток — не отправляем, ждём февраля
+    reminders, sent = start(tmp_path, storage, Clock(at(2025, 1, 20)), grace=86400)
+    assert reminders.tick() == 0
+    assert reminders._heap[0][0] == at(2025, 2, 14, 10)
+
+
+def test_changes_reschedule(tmp_path, storage):
+    clock = Clock(at(2025, 1, 1))
+    reminders, sent = start(tmp_path, storage, clock)
+    assert reminders.pending() == 0
+    entry = storage.add("1", "subscriptions", "A", 1.0, day=10)
+    storage.add("1", "subscriptions", "B", 2.0, day=10)
+    assert reminders.pending() == 2
+    storage.delete("1", "subscriptions", entry.id)
+    assert reminders.pending() == 1
+
+    clock.now = at(2025, 1, 9, 10)
+    assert reminders.tick() == 1
+    (_, due), = sent
+    assert [entry.name for entry, _ in due] == ["B"]
+
+
+def test_batch_limit(tmp_path, storage):
+    clock = Clock(at(2025, 1, 1))
+    for user_id in ("1", "2", "3"):
+        storage.add(user_id, "subscriptions", "A", 1.0, day=5)
+        storage.add(user_id, "subscriptions", "B", 1.0, day=5)
+    reminders, sent = start(tmp_path, storage, clock, batch=2)
+    clock.now = at(2025, 1, 4, 10)
+    # Одно сообщение на пользователя, за тик — не больше batch пользователей
+    assert reminders.tick() == 2
+    assert reminders.tick() == 1
+    assert reminders.tick() == 0
+    assert sorted(user_id for user_id, _ in sent) == ["1", "2", "3"]
+    assert all(len(due) == 2 for _, due in sent)
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import pytest
+
+from routing import CALLBACK_VERSION, Router, pack_callback, unpack_callback
+
+
+def test_pack_unpack():
+    data = pack_callback("d", "s", "1a", 0)
+    assert data == f"{CALLBACK_VERSION}:d:s:1a:0"
+    assert unpack_callback(data) == ("d", ["s", "1a", "0"])
+    assert len(pack_callback("d", "s", "zzzzzz", 9999).encode()) <= 64  # предел callback_data в Telegram
+
+
+# Кнопки старого формата остаются в истории чатов
+@pytest.mark.parametrize("data, expected", [
+    ("del_sub_1a_0", ("d", ["s", "1a", "0"])),
+    ("del_inc_3_2", ("d", ["i", "3", "2"])),
+    ("page_sub_1", ("p", ["s", "1"])),
+    ("delete_inc_3", ("r", ["i"])),
+    ("1:d:s:1a:0", (None, [])),  # другая версия
+    ("del_xxx_1_0", (None, [])),
+    ("del_sub_1", (None, [])),
+    ("nonsense", (None, [])),
+    ("", (None, [])),
+])
+def test_unpack_old_and_unknown(data, expected):
+    assert unpack_callback(data) == expected
+
+
+@pytest.fixture
+def router():
+    router = Router()
+    calls = []
+    router.calls = calls
+
+    @router.text("📊 Баланс")
+    def balance(message):
+        calls.append(("balance", message.text))
+
+    @router.command("start")
+    def start(message):
+        calls.append(("start", message.text))
+
+    @router.content_type("document")
+    def document(message):
+        calls.append(("document", None))
+
+    @router.fallback
+    def other(message):
+        calls.append(("other", message.text))
+
+    @router.action("d", 3)
+    def delete(call, kind, entry_id, page):
+        calls.append(("delete", kind, int(entry_id, 36), int(page)))
+
+    @router.callback_fallback
+    def unknown(call):
+        calls.append(("unknown", call.data))
+
+    return router
+
+
+def message(text=None, content_type="text"):
+    return SimpleNamespace(text=text, content_type=content_type)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("📊 Баланс", ("balance", "📊 Баланс")),
+    ("/start", ("start", "/start")),
+    ("/start@moneysaver_bot", ("start", "/start@moneysaver_bot")),
+    ("/start ref123", ("start", "/start ref123")),
+    ("/unknown", ("other", "/unknown")),
+    ("/", ("other", "/")),
+    ("Кинопоиск 499", ("other", "Кинопоиск 499")),
+])
+def test_dispatch_message(router, text, expected):
+    router.dispatch_message(message(text))
+    assert router.calls == [expected]
+
+
+def test_dispatch_content_type(router):
+    router.dispatch_message(message(content_type="document"))
+    router.dispatch_message(message(content_type="sticker"))  # без обработчика — молча пропускаем
+    assert router.calls == [("document", None)]
+
+
+@pytest.mark.parametrize("data, expected", [
+    (pack_callback("d", "s", "1a", 2), ("delete", "s", 46, 2)),
+    ("del_sub_1a_2", ("delete", "s", 46, 2)),
+    # Устаревшие и испорченные кнопки — в callback_fallback, а не исключением в полосе
+    ("1:d:s:1a:2", ("unknown", "1:d:s:1a:2")),
+    (pack_callback("d", "s", "1a"), ("unknown", pack_callback("d", "s", "1a"))),
+    (pack_callback("d", "s", "!", 0), ("unknown", pack_callback("d", "s", "!", 0))),
+    (pack_callback("x", 1), ("unknown", pack_callback("x", 1))),
+    (None, ("unknown", None)),
+])
+def test_dispatch_callback(router, data, expected):
+    router.dispatch_callback(SimpleNamespace(data=data))
+    assert router.calls == [expected]
+
+
+def test_replace_handlers(router):
+    router.replace_handlers(lambda function: lambda *args: router.calls.append("wrapped") or function(*args))
+    router.dispatch_message(message("📊 Баланс"))
+    router.dispatch_callback(SimpleNamespace(data="bad"))
+    assert router.calls == ["wrapped", ("balance", "📊 Баланс"), "wrapped", ("unknown", "bad")]